@@ -11,6 +11,7 @@ from telegram.ext import ContextTypes
 
 from auth_middleware import AuthMiddleware
 from client_manager import ClientManager
+from tenant_storage import ShardedTransactionStorage
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +20,7 @@ class AdminInterface:
     def __init__(self, admin_user_ids: list = None):
         self.client_manager = ClientManager()
         self.auth_middleware = AuthMiddleware()
+        self.storage = ShardedTransactionStorage()
         # Add your Telegram user ID here for admin access
         self.admin_user_ids = admin_user_ids or []  # Add your user ID: [123456789]
 
@@ -245,6 +247,11 @@ class AdminInterface:
             total_groups = sum(c["groups_count"] for c in clients)
             total_transactions = sum(c["monthly_transactions"] for c in clients)
 
+            # Stored payment totals come from the rollups, not a history scan
+            recorded = self.storage.get_recorded_totals()
+            recorded_amount = recorded["total_amount"]
+            recorded_count = recorded["transaction_count"]
+
             plan_distribution = {}
             for client in clients:
                 plan = client["plan"]
@@ -260,6 +267,7 @@ class AdminInterface:
 
 🏘️ **Groups:** {total_groups}
 💰 **Transactions This Month:** {total_transactions}
+💵 **Recorded Payments:** ${recorded_amount:.2f} ({recorded_count} transactions)
 
 📊 **Plan Distribution:**
             """
@@ -11,6 +11,8 @@ import uuid
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional
 
+from file_lock import atomic_write_json, file_lock
+
 
 class ClientManager:
     def __init__(self, clients_file: str = "clients.json"):
@@ -67,9 +69,13 @@ class ClientManager:
 
     def _ensure_file_exists(self):
         """Create clients file if it doesn't exist."""
-        if not os.path.exists(self.clients_file):
-            with open(self.clients_file, "w") as f:
-                json.dump({}, f)
+        with self.lock():
+            if not os.path.exists(self.clients_file):
+                atomic_write_json(self.clients_file, {})
+
+    def lock(self):
+        """Lock the clients file; hold it around every read-modify-write."""
+        return file_lock(self.clients_file)
 
     def load_clients(self) -> Dict[str, Any]:
         """Load all clients from JSON file."""
@@ -82,8 +88,8 @@ class ClientManager:
     def save_clients(self, clients: Dict[str, Any]) -> bool:
         """Save clients to JSON file."""
         try:
-            with open(self.clients_file, "w") as f:
-                json.dump(clients, f, indent=2)
+            with self.lock():
+                atomic_write_json(self.clients_file, clients, indent=2)
             return True
         except Exception as e:
             print(f"Error saving clients: {e}")
@@ -99,8 +105,6 @@ class ClientManager:
 
     def create_client(self, email: str, company_name: str, plan: str = "free") -> Dict[str, Any]:
         """Create a new client account."""
-        clients = self.load_clients()
-
         client_id = str(uuid.uuid4())
         api_key = self.generate_api_key()
 
@@ -124,8 +128,10 @@ class ClientManager:
             },
         }
 
-        clients[client_id] = client_data
-        self.save_clients(clients)
+        with self.lock():
+            clients = self.load_clients()
+            clients[client_id] = client_data
+            self.save_clients(clients)
 
         return {
             "client_id": client_id,
@@ -152,14 +158,19 @@ class ClientManager:
 
     def update_client(self, client_id: str, updates: Dict[str, Any]) -> bool:
         """Update client data."""
-        clients = self.load_clients()
-        if client_id in clients:
-            clients[client_id].update(updates)
-            return self.save_clients(clients)
+        with self.lock():
+            clients = self.load_clients()
+            if client_id in clients:
+                clients[client_id].update(updates)
+                return self.save_clients(clients)
         return False
 
     def add_group_to_client(self, client_id: str, group_id: str, group_name: str) -> bool:
         """Add a Telegram group to client's account."""
+        with self.lock():
+            return self._add_group_to_client(client_id, group_id, group_name)
+
+    def _add_group_to_client(self, client_id: str, group_id: str, group_name: str) -> bool:
         client = self.get_client(client_id)
         if not client:
             return False
@@ -215,14 +226,16 @@ class ClientManager:
 
     def increment_usage(self, client_id: str, transactions: int = 1) -> bool:
         """Increment client's usage counters."""
-        client = self.get_client(client_id)
-        if not client:
-            return False
+        # Held across read and write so concurrent workers don't lose increments
+        with self.lock():
+            client = self.get_client(client_id)
+            if not client:
+                return False
 
-        usage = client.get("monthly_usage", {"transactions": 0})
-        usage["transactions"] += transactions
+            usage = client.get("monthly_usage", {"transactions": 0})
+            usage["transactions"] += transactions
 
-        return self.update_client(client_id, {"monthly_usage": usage})
+            return self.update_client(client_id, {"monthly_usage": usage})
 
     def upgrade_plan(self, client_id: str, new_plan: str) -> bool:
         """Upgrade client's subscription plan."""
@@ -13,17 +13,67 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
 # File paths
 TRANSACTIONS_FILE = "transactions.json"
+TRANSACTIONS_JOURNAL_FILE = "transactions.jsonl"
+TRANSACTIONS_DB_FILE = "transactions.db"
+TRANSACTIONS_PARTITION_DIR = "transactions"
+TRANSACTION_ROLLUPS_FILE = "transaction_rollups.jsonl"
+TRANSACTION_FINGERPRINTS_FILE = "transaction_fingerprints.idx"
+TRANSACTION_PAYERS_FILE = "transaction_payers.jsonl"
+TRANSACTION_SNAPSHOT_FILE = "transaction_snapshot.bin"
+TRANSACTION_ARCHIVE_DIR = "archive"
+TRANSACTION_SHARDS_DIR = "tenants"
 CLIENTS_FILE = "clients.json"
 GROUP_SETTINGS_FILE = "group_settings.json"
 
+# Transaction storage backend: "journal" (append-only), "sqlite" (indexed database),
+# "partitioned" (one journal per day/month) or "json" (legacy single file)
+TRANSACTIONS_BACKEND = os.getenv("TRANSACTIONS_BACKEND", "journal")
+TRANSACTIONS_PARTITION_GRANULARITY = os.getenv("TRANSACTIONS_PARTITION_GRANULARITY", "month")
+
+# Give every client (tenant) its own transaction store under TRANSACTION_SHARDS_DIR
+TRANSACTIONS_SHARD_BY_CLIENT = os.getenv("TRANSACTIONS_SHARD_BY_CLIENT", "false").lower() == "true"
+
+# Maximum number of decrypted transactions kept in memory (0 disables the cache)
+TRANSACTION_CACHE_MAX_RECORDS = int(os.getenv("TRANSACTION_CACHE_MAX_RECORDS", "50000"))
+
+# Workers for bulk decryption (default one per core; 1 decrypts serially).
+# Decryption holds the GIL, so only "process" pools use several cores; "thread"
+# saves one interpreter per worker but decrypts at roughly single-core speed.
+# Process workers are started by a fork server, never forked from the bot's threads.
+TRANSACTION_DECRYPT_WORKERS = int(
+    os.getenv("TRANSACTION_DECRYPT_WORKERS", str(os.cpu_count() or 1))
+)
+TRANSACTION_DECRYPT_POOL = os.getenv("TRANSACTION_DECRYPT_POOL", "process")
+
+# Rewrite the columnar snapshot after this many new transactions (0 = only on shutdown)
+TRANSACTION_SNAPSHOT_INTERVAL = int(os.getenv("TRANSACTION_SNAPSHOT_INTERVAL", "1000"))
+
+# Compact the rollup log into one snapshot line after this many appended batches
+TRANSACTION_ROLLUPS_COMPACT_EVERY = int(os.getenv("TRANSACTION_ROLLUPS_COMPACT_EVERY", "1000"))
+
+# Write-behind batching: flush every N records or every T milliseconds.
+# The defaults (1 record, 0 ms) write each payment through immediately.
+TRANSACTION_FLUSH_MAX_RECORDS = int(os.getenv("TRANSACTION_FLUSH_MAX_RECORDS", "1"))
+TRANSACTION_FLUSH_INTERVAL_MS = int(os.getenv("TRANSACTION_FLUSH_INTERVAL_MS", "0"))
+
 # Payment system settings
 PAYMENT_SYSTEM_IDENTIFIER = "kb_prasac_merchant_payment"
 DEFAULT_CURRENCY = os.getenv("DEFAULT_CURRENCY", "USD")
 TRANSACTION_TIMEOUT_HOURS = int(os.getenv("TRANSACTION_TIMEOUT_HOURS", "24"))
 
+# Move transactions older than this many days into compressed monthly archives
+# (0 keeps everything in the hot store). Payments younger than
+# TRANSACTION_TIMEOUT_HOURS are never archived.
+TRANSACTION_RETENTION_DAYS = int(os.getenv("TRANSACTION_RETENTION_DAYS", "0"))
+TRANSACTION_ARCHIVE_COMPRESSION = os.getenv("TRANSACTION_ARCHIVE_COMPRESSION", "gzip")
+
 # Scheduler settings
 DAILY_REPORT_TIME = "09:00"  # 24-hour format
 
 # Feature flags
 ENABLE_ANALYTICS = os.getenv("ENABLE_ANALYTICS", "true").lower() == "true"
 ENABLE_RATE_LIMITING = os.getenv("ENABLE_RATE_LIMITING", "true").lower() == "true"
+ENABLE_TRANSACTION_ROLLUPS = os.getenv("ENABLE_TRANSACTION_ROLLUPS", "true").lower() == "true"
+ENABLE_COLUMNAR_SNAPSHOT = os.getenv("ENABLE_COLUMNAR_SNAPSHOT", "true").lower() == "true"
+ENABLE_DUPLICATE_DETECTION = os.getenv("ENABLE_DUPLICATE_DETECTION", "true").lower() == "true"
+ENABLE_PAYER_DICTIONARY = os.getenv("ENABLE_PAYER_DICTIONARY", "true").lower() == "true"
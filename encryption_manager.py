@@ -5,31 +5,174 @@ Copyright (c) 2025 Sochetra. All rights reserved.
 This module provides AES encryption for sensitive data storage.
 """
 
+import atexit
 import base64
 import hashlib
+import hmac
 import json
 import logging
+import multiprocessing
 import os
-from typing import Any, Dict, Optional, Union
+import struct
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 logger = logging.getLogger(__name__)
 
+# PBKDF2 is deliberately slow, so each key is derived once per process.
+# Entries are keyed by a SHA-256 of the key material, not the key itself.
+_fernet_cache: Dict[bytes, Fernet] = {}
+_fernet_cache_lock = threading.Lock()
 
-class EncryptionManager:
-    """Manages encryption/decryption for sensitive data storage."""
+# Worker pools for decrypt_many(), shared by every manager in the process
+_decrypt_pools: Dict[Tuple, Executor] = {}
+_decrypt_pools_lock = threading.Lock()
+
+
+def _shutdown_decrypt_pools():
+    """Stop every decrypt pool's workers; registered to run at exit."""
+    with _decrypt_pools_lock:
+        pools = list(_decrypt_pools.values())
+        _decrypt_pools.clear()
+    for executor in pools:
+        executor.shutdown(wait=True)
+
+
+atexit.register(_shutdown_decrypt_pools)
+
+
+def process_pool_context() -> multiprocessing.context.BaseContext:
+    """Return the start method for worker process pools.
+
+    The bot runs the polling loop, schedulers and flush timers on threads,
+    and a forked child inherits any lock one of them held at fork time, so
+    workers come from a fork server (or are spawned where there is none).
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+# The manager used inside process-pool workers, set by _init_decrypt_worker()
+_worker_manager: Optional["EncryptionManager"] = None
+
+
+def _init_decrypt_worker(encryption_key: str, previous_keys: List[str]):
+    global _worker_manager
+    _worker_manager = EncryptionManager(encryption_key, previous_keys)
 
-    def __init__(self, encryption_key: Optional[str] = None):
+
+def _decrypt_chunk_in_worker(
+    records: List[Dict[str, Any]], sensitive_fields: List[str]
+) -> List[Dict[str, Any]]:
+    return _worker_manager._decrypt_chunk(records, sensitive_fields)
+
+
+class EncryptionManager:
+    """Manages encryption/decryption for sensitive data storage.
+
+    ``self.fernet`` is a keyring: new data is encrypted with the current key
+    and data written under any of the previous keys still decrypts.
+    """
+
+    KEY_FILE = ".encryption_key"
+    PREVIOUS_KEYS_FILE = ".encryption_key.previous"
+
+    # Stored values are "v2:<fernet token>". Fernet tokens are already
+    # URL-safe base64, so they are kept as-is; the prefix can never occur
+    # in the legacy base64-of-token format, which is still read.
+    CIPHERTEXT_PREFIX = "v2:"
+
+    # Batches smaller than this are decrypted inline; the pool is not worth it
+    PARALLEL_DECRYPT_MIN_RECORDS = 256
+
+    # Streamed file format: FILE_MAGIC, a random 16-byte file id, then frames of
+    # <4-byte length><raw Fernet token>. Each token encrypts FRAME_HEADER
+    # (file id, chunk index, final flag) followed by up to FILE_CHUNK_SIZE
+    # bytes, so chunks cannot be reordered, dropped, truncated or spliced in
+    # from another file without failing authentication.
+    FILE_MAGIC = b"PBENCF\x01\n"
+    FILE_CHUNK_SIZE = 64 * 1024
+    FRAME_HEADER = struct.Struct(">16sQ?")
+    FRAME_LENGTH = struct.Struct(">I")
+
+    def __init__(
+        self, encryption_key: Optional[str] = None, previous_keys: Optional[List[str]] = None
+    ):
         """Initialize encryption manager with key."""
+        # Keys read from the key files are re-read when a rotation replaces them
+        self._key_files_state = None
+        if encryption_key is None and previous_keys is None:
+            self._key_files_state = self._key_files_signature()
+
         self.encryption_key = encryption_key or self._get_or_create_key()
-        self.fernet = self._create_fernet()
+        self.previous_keys = (
+            previous_keys if previous_keys is not None else self._load_previous_keys()
+        )
+        self.fernet = self._create_keyring()
+        self.index_key = self._create_index_key()
+
+    @classmethod
+    def _key_files_signature(cls) -> tuple:
+        signature = []
+        for path in (cls.KEY_FILE, cls.PREVIOUS_KEYS_FILE):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_ino, stat.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def reload_keys(self) -> bool:
+        """Pick up keys published by a rotation; returns True if the current key changed.
+
+        Only applies to managers whose keys came from the key files. New
+        previous keys are added to the keyring either way.
+        """
+        if self._key_files_state is None:
+            return False
+        state = self._key_files_signature()
+        if state == self._key_files_state:
+            return False
+        self._key_files_state = state
+
+        encryption_key = self._get_or_create_key()
+        previous_keys = self._load_previous_keys()
+        if encryption_key == self.encryption_key and previous_keys == self.previous_keys:
+            return False
+
+        key_changed = encryption_key != self.encryption_key
+        self.encryption_key = encryption_key
+        self.previous_keys = previous_keys
+        self.fernet = self._create_keyring()
+        self.index_key = self._create_index_key()
+        logger.info("Reloaded encryption keys")
+        return key_changed
+
+    @classmethod
+    def save_keys(cls, encryption_key: str, previous_keys: List[str]):
+        """Atomically replace the key files (owner read-only)."""
+        for path, content in (
+            (cls.PREVIOUS_KEYS_FILE, "".join(f"{key}\n" for key in previous_keys)),
+            (cls.KEY_FILE, encryption_key),
+        ):
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
 
     def _get_or_create_key(self) -> str:
         """Get existing encryption key or create a new one."""
-        key_file = ".encryption_key"
+        key_file = self.KEY_FILE
 
         # Try to load existing key
         if os.path.exists(key_file):
@@ -56,8 +199,33 @@ class EncryptionManager:
 
         return key
 
-    def _create_fernet(self) -> Fernet:
-        """Create Fernet cipher from the encryption key."""
+    def _load_previous_keys(self) -> List[str]:
+        """Load retired keys that must stay readable, one per line."""
+        if not os.path.exists(self.PREVIOUS_KEYS_FILE):
+            return []
+        try:
+            with open(self.PREVIOUS_KEYS_FILE, "r") as f:
+                return [line.strip() for line in f if line.strip()]
+        except Exception as e:
+            logger.warning(f"Could not read previous encryption keys: {e}")
+            return []
+
+    def _create_keyring(self) -> MultiFernet:
+        """Combine the current key with the previous keys, current first."""
+        keys = [self.encryption_key] + [
+            key for key in self.previous_keys if key != self.encryption_key
+        ]
+        return MultiFernet([self._create_fernet(key) for key in keys])
+
+    def _create_fernet(self, encryption_key: Optional[str] = None) -> Fernet:
+        """Create Fernet cipher from an encryption key (default the current one)."""
+        key_bytes = (encryption_key or self.encryption_key).encode()
+        cache_key = hashlib.sha256(key_bytes).digest()
+        with _fernet_cache_lock:
+            fernet = _fernet_cache.get(cache_key)
+        if fernet is not None:
+            return fernet
+
         try:
             # Derive key using PBKDF2
             salt = b"payment_bot_salt_2025"  # Fixed salt for consistency
@@ -68,17 +236,46 @@ class EncryptionManager:
                 iterations=100000,
             )
 
-            key_bytes = self.encryption_key.encode()
             derived_key = base64.urlsafe_b64encode(kdf.derive(key_bytes))
-
-            return Fernet(derived_key)
+            fernet = Fernet(derived_key)
 
         except Exception as e:
             logger.error(f"Failed to create encryption cipher: {e}")
             raise
 
+        with _fernet_cache_lock:
+            _fernet_cache[cache_key] = fernet
+        return fernet
+
+    def _create_index_key(self) -> bytes:
+        """Derive the HMAC key used for blind indexes from the encryption key."""
+        hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b"payment_bot_blind_index",
+        )
+        return hkdf.derive(self.encryption_key.encode())
+
+    def blind_index(self, value: str) -> str:
+        """Create a keyed hash of a value so encrypted fields can be matched without decrypting."""
+        return hmac.new(self.index_key, str(value).encode("utf-8"), hashlib.sha256).hexdigest()
+
+    @classmethod
+    def is_encrypted(cls, value: Any) -> bool:
+        """Check whether a stored value is in the versioned ciphertext format."""
+        return isinstance(value, str) and value.startswith(cls.CIPHERTEXT_PREFIX)
+
+    @classmethod
+    def _token(cls, encrypted_data: str) -> bytes:
+        """Return the Fernet token of a stored value in either format."""
+        if cls.is_encrypted(encrypted_data):
+            return encrypted_data[len(cls.CIPHERTEXT_PREFIX) :].encode("ascii")
+        # Legacy values base64-encode the (already base64) token once more
+        return base64.urlsafe_b64decode(encrypted_data.encode("ascii"))
+
     def encrypt_data(self, data: Union[str, Dict, Any]) -> str:
-        """Encrypt data and return base64 encoded string."""
+        """Encrypt data and return it in the versioned ciphertext format."""
         try:
             # Convert to JSON string if not already a string
             if not isinstance(data, str):
@@ -87,23 +284,19 @@ class EncryptionManager:
                 data_str = data
 
             # Encrypt the data
-            encrypted_bytes = self.fernet.encrypt(data_str.encode("utf-8"))
+            token = self.fernet.encrypt(data_str.encode("utf-8"))
 
-            # Return base64 encoded string
-            return base64.urlsafe_b64encode(encrypted_bytes).decode("ascii")
+            return self.CIPHERTEXT_PREFIX + token.decode("ascii")
 
         except Exception as e:
             logger.error(f"Encryption failed: {e}")
             raise
 
     def decrypt_data(self, encrypted_data: str, return_json: bool = False) -> Union[str, Dict, Any]:
-        """Decrypt base64 encoded encrypted data."""
+        """Decrypt data in the versioned or the legacy base64 ciphertext format."""
         try:
-            # Decode from base64
-            encrypted_bytes = base64.urlsafe_b64decode(encrypted_data.encode("ascii"))
-
             # Decrypt the data
-            decrypted_bytes = self.fernet.decrypt(encrypted_bytes)
+            decrypted_bytes = self.fernet.decrypt(self._token(encrypted_data))
             decrypted_str = decrypted_bytes.decode("utf-8")
 
             # Return as JSON object if requested
@@ -117,56 +310,121 @@ class EncryptionManager:
             raise
 
     def encrypt_file(self, file_path: str, output_path: Optional[str] = None) -> bool:
-        """Encrypt a file and save to output path."""
-        try:
-            # Read the file
-            with open(file_path, "r", encoding="utf-8") as f:
-                file_content = f.read()
-
-            # Encrypt the content
-            encrypted_content = self.encrypt_data(file_content)
+        """Encrypt a file chunk by chunk and save to output path.
 
-            # Determine output path
-            if output_path is None:
-                output_path = f"{file_path}.encrypted"
+        Memory use is bounded by FILE_CHUNK_SIZE whatever the file size.
+        """
+        # Determine output path
+        if output_path is None:
+            output_path = f"{file_path}.encrypted"
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
 
-            # Write encrypted file
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(encrypted_content)
+        try:
+            file_id = os.urandom(16)
+            with open(file_path, "rb") as source, open(temp_path, "wb") as target:
+                target.write(self.FILE_MAGIC + file_id)
+
+                # Read one chunk ahead so the last chunk can be flagged as final
+                chunk = source.read(self.FILE_CHUNK_SIZE)
+                index = 0
+                while True:
+                    next_chunk = source.read(self.FILE_CHUNK_SIZE)
+                    final = not next_chunk
+                    frame = self.FRAME_HEADER.pack(file_id, index, final) + chunk
+                    token = base64.urlsafe_b64decode(self.fernet.encrypt(frame))
+                    target.write(self.FRAME_LENGTH.pack(len(token)) + token)
+                    if final:
+                        break
+                    chunk = next_chunk
+                    index += 1
+
+                target.flush()
+                os.fsync(target.fileno())
+            os.replace(temp_path, output_path)
 
             logger.info(f"File encrypted: {file_path} -> {output_path}")
             return True
 
         except Exception as e:
             logger.error(f"File encryption failed: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
             return False
 
-    def decrypt_file(self, encrypted_file_path: str, output_path: Optional[str] = None) -> bool:
-        """Decrypt a file and save to output path."""
-        try:
-            # Read the encrypted file
-            with open(encrypted_file_path, "r", encoding="utf-8") as f:
-                encrypted_content = f.read()
-
-            # Decrypt the content
-            decrypted_content = self.decrypt_data(encrypted_content)
+    def _max_frame_length(self) -> int:
+        """Size of the raw Fernet token of a full frame.
+
+        Version byte, timestamp, IV, the PKCS7-padded header and chunk, HMAC.
+        """
+        plaintext = self.FRAME_HEADER.size + self.FILE_CHUNK_SIZE
+        return 1 + 8 + 16 + (plaintext // 16 + 1) * 16 + 32
+
+    def _decrypt_frames(self, source, target):
+        """Decrypt the frames of a streamed file, checking order and completeness."""
+        file_id = source.read(16)
+        index = 0
+        while True:
+            length_bytes = source.read(self.FRAME_LENGTH.size)
+            if len(length_bytes) < self.FRAME_LENGTH.size:
+                raise ValueError("Encrypted file is truncated")
+            (length,) = self.FRAME_LENGTH.unpack(length_bytes)
+            # The length is not authenticated; never read more than a frame can hold
+            if length > self._max_frame_length():
+                raise ValueError("Encrypted file chunk is corrupt")
+            token = source.read(length)
+            if len(token) < length:
+                raise ValueError("Encrypted file is truncated")
+
+            frame = self.fernet.decrypt(base64.urlsafe_b64encode(token))
+            frame_file_id, frame_index, final = self.FRAME_HEADER.unpack_from(frame)
+            if frame_file_id != file_id or frame_index != index:
+                raise ValueError("Encrypted file chunks are out of order or from another file")
+            target.write(frame[self.FRAME_HEADER.size :])
+
+            if final:
+                if source.read(1):
+                    raise ValueError("Unexpected data after the final chunk")
+                return
+            index += 1
 
-            # Determine output path
-            if output_path is None:
-                if encrypted_file_path.endswith(".encrypted"):
-                    output_path = encrypted_file_path[:-10]  # Remove .encrypted
-                else:
-                    output_path = f"{encrypted_file_path}.decrypted"
+    def decrypt_file(self, encrypted_file_path: str, output_path: Optional[str] = None) -> bool:
+        """Decrypt a file and save to output path.
+
+        Files in the streamed format are decrypted chunk by chunk; files
+        written by the old whole-file format are still accepted.
+        """
+        # Determine output path
+        if output_path is None:
+            if encrypted_file_path.endswith(".encrypted"):
+                output_path = encrypted_file_path[:-10]  # Remove .encrypted
+            else:
+                output_path = f"{encrypted_file_path}.decrypted"
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
 
-            # Write decrypted file
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(decrypted_content)
+        try:
+            with open(encrypted_file_path, "rb") as source:
+                streamed = source.read(len(self.FILE_MAGIC)) == self.FILE_MAGIC
+                if streamed:
+                    with open(temp_path, "wb") as target:
+                        self._decrypt_frames(source, target)
+
+            if not streamed:
+                # Legacy format: one base64 token for the whole (text) file
+                with open(encrypted_file_path, "r", encoding="utf-8") as f:
+                    decrypted_content = self.decrypt_data(f.read())
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    f.write(decrypted_content)
+
+            # Plaintext only appears under the output name once fully authenticated
+            os.replace(temp_path, output_path)
 
             logger.info(f"File decrypted: {encrypted_file_path} -> {output_path}")
             return True
 
         except Exception as e:
             logger.error(f"File decryption failed: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
             return False
 
     def encrypt_sensitive_fields(
@@ -178,9 +436,8 @@ class EncryptionManager:
         for field in sensitive_fields:
             if field in encrypted_data and encrypted_data[field] is not None:
                 try:
+                    # The ciphertext prefix marks the field; no separate marker is stored
                     encrypted_data[field] = self.encrypt_data(str(encrypted_data[field]))
-                    # Mark field as encrypted
-                    encrypted_data[f"{field}_encrypted"] = True
                 except Exception as e:
                     logger.error(f"Failed to encrypt field {field}: {e}")
 
@@ -193,17 +450,97 @@ class EncryptionManager:
         decrypted_data = data.copy()
 
         for field in sensitive_fields:
-            if f"{field}_encrypted" in decrypted_data and decrypted_data.get(f"{field}_encrypted"):
+            # Legacy records flag encrypted fields with a "<field>_encrypted" marker
+            legacy = bool(decrypted_data.get(f"{field}_encrypted"))
+            if legacy or self.is_encrypted(decrypted_data.get(field)):
                 try:
                     if field in decrypted_data:
                         decrypted_data[field] = self.decrypt_data(decrypted_data[field])
                         # Remove encryption marker
-                        del decrypted_data[f"{field}_encrypted"]
+                        decrypted_data.pop(f"{field}_encrypted", None)
                 except Exception as e:
                     logger.error(f"Failed to decrypt field {field}: {e}")
 
         return decrypted_data
 
+    def _decrypt_chunk(
+        self, records: List[Dict[str, Any]], sensitive_fields: List[str]
+    ) -> List[Dict[str, Any]]:
+        decrypted = []
+        for record in records:
+            try:
+                decrypted.append(self.decrypt_sensitive_fields(record, sensitive_fields))
+            except Exception as e:
+                # One bad record must not fail the batch; keep it as stored
+                logger.error(f"Failed to decrypt record: {e}")
+                decrypted.append(record.copy())
+        return decrypted
+
+    def _decrypt_pool(self, workers: int, pool: str) -> Executor:
+        """Return the shared pool for a worker count, creating it on first use."""
+        if pool == "process":
+            # Workers hold their own keyring, so the pool is tied to the keys
+            keys = (self.encryption_key, tuple(self.previous_keys))
+            pool_key = (pool, workers, hashlib.sha256(repr(keys).encode()).digest())
+        else:
+            pool_key = (pool, workers)
+
+        with _decrypt_pools_lock:
+            if pool_key not in _decrypt_pools:
+                if pool == "process":
+                    # Workers of a replaced key would otherwise linger until exit
+                    for stale_key in [k for k in _decrypt_pools if k[:2] == pool_key[:2]]:
+                        _decrypt_pools.pop(stale_key).shutdown(wait=False)
+                    _decrypt_pools[pool_key] = ProcessPoolExecutor(
+                        max_workers=workers,
+                        mp_context=process_pool_context(),
+                        initializer=_init_decrypt_worker,
+                        initargs=(self.encryption_key, list(self.previous_keys)),
+                    )
+                else:
+                    _decrypt_pools[pool_key] = ThreadPoolExecutor(
+                        max_workers=workers, thread_name_prefix="decrypt"
+                    )
+            return _decrypt_pools[pool_key]
+
+    def decrypt_many(
+        self,
+        records: Iterable[Dict[str, Any]],
+        sensitive_fields: list,
+        max_workers: Optional[int] = None,
+        pool: str = "process",
+    ) -> List[Dict[str, Any]]:
+        """Decrypt the sensitive fields of many records across a worker pool.
+
+        Decryption holds the GIL for most of its work, so only the default
+        "process" pool runs on several cores; "thread" avoids starting
+        worker processes but gives little speedup.
+
+        Results are in input order. A record that fails to decrypt is
+        returned as stored (fields that did decrypt aside), like
+        decrypt_sensitive_fields() does per field.
+        """
+        records = list(records)
+        workers = max_workers or os.cpu_count() or 1
+        if workers <= 1 or len(records) < self.PARALLEL_DECRYPT_MIN_RECORDS:
+            return self._decrypt_chunk(records, sensitive_fields)
+
+        # A few chunks per worker evens out uneven records without much overhead
+        size = -(-len(records) // (workers * 4))
+        chunks = [records[i : i + size] for i in range(0, len(records), size)]
+        if pool == "process":
+            task = _decrypt_chunk_in_worker
+        else:
+            task = self._decrypt_chunk
+
+        executor = self._decrypt_pool(workers, pool)
+        try:
+            results = executor.map(task, chunks, [sensitive_fields] * len(chunks))
+        except RuntimeError:
+            # Another manager's key change shut this pool down in the meantime
+            return self._decrypt_chunk(records, sensitive_fields)
+        return [record for chunk in results for record in chunk]
+
     def hash_data(self, data: str, salt: Optional[str] = None) -> str:
         """Create a hash of sensitive data for indexing/comparison."""
         if salt is None:
@@ -224,17 +561,22 @@ class EncryptionManager:
         return base64.urlsafe_b64encode(os.urandom(32)).decode()
 
     def rotate_key(self, new_key: Optional[str] = None) -> str:
-        """Rotate the encryption key."""
-        old_fernet = self.fernet
+        """Rotate the encryption key.
 
+        The old key joins the previous keys, so existing data stays readable
+        until it has been migrated.
+        """
         # Generate new key if not provided
         if new_key is None:
             new_key = self.generate_random_key()
 
-        # Create new Fernet with new key
         old_encryption_key = self.encryption_key
         self.encryption_key = new_key
-        self.fernet = self._create_fernet()
+        self.previous_keys = [old_encryption_key] + [
+            key for key in self.previous_keys if key not in (old_encryption_key, new_key)
+        ]
+        self.fernet = self._create_keyring()
+        self.index_key = self._create_index_key()
 
         logger.info("Encryption key rotated")
 
@@ -243,20 +585,12 @@ class EncryptionManager:
     def migrate_encrypted_data(self, old_encrypted_data: str, old_key: str) -> str:
         """Migrate data from old encryption key to current key."""
         try:
-            # Create temporary Fernet with old key
-            old_encryption_key = self.encryption_key
-            self.encryption_key = old_key
-            old_fernet = self._create_fernet()
-
-            # Decrypt with old key
-            decrypted_data = self.decrypt_data(old_encrypted_data)
-
-            # Restore current key
-            self.encryption_key = old_encryption_key
-            self.fernet = self._create_fernet()
+            # Both ciphers come from the derived-key cache
+            keyring = MultiFernet([self._create_fernet(), self._create_fernet(old_key)])
 
-            # Encrypt with new key
-            return self.encrypt_data(decrypted_data)
+            # Decrypt with whichever key matches and re-encrypt with the current key
+            token = keyring.rotate(self._token(old_encrypted_data))
+            return self.CIPHERTEXT_PREFIX + token.decode("ascii")
 
         except Exception as e:
             logger.error(f"Data migration failed: {e}")
@@ -0,0 +1,99 @@
+"""
+File Locking for Payment Bot SaaS
+Copyright (c) 2025 Sochetra. All rights reserved.
+
+This module serialises read-modify-write cycles on the bot's data files
+across threads and worker processes sharing the same volume.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl
+    fcntl = None
+
+
+class FileLock:
+    """Exclusive advisory lock on ``<path>.lock``, re-entrant within a process.
+
+    Threads of one process are serialised with an RLock; processes with
+    ``flock``. Where ``fcntl`` is unavailable only the thread lock applies,
+    so run a single worker there.
+    """
+
+    def __init__(self, path: str):
+        self.lock_path = f"{path}.lock"
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd: Optional[int] = None
+
+    def __enter__(self) -> "FileLock":
+        self._thread_lock.acquire()
+        try:
+            if self._depth == 0 and fcntl is not None:
+                self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except Exception:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._thread_lock.release()
+            raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+
+_locks: Dict[str, FileLock] = {}
+_locks_guard = threading.Lock()
+
+
+def file_lock(path: str) -> FileLock:
+    """Return the process-wide lock for a data file."""
+    key = os.path.abspath(path)
+    with _locks_guard:
+        if key not in _locks:
+            _locks[key] = FileLock(path)
+        return _locks[key]
+
+
+def atomic_write_json(path: str, data: Any, indent: Optional[int] = None):
+    """Write JSON to a temporary file and rename it over ``path``.
+
+    Readers see either the old or the new content, never a partial file.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "w") as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def fsync_directory(path: str):
+    """Make file creations and renames in a directory durable.
+
+    Only POSIX systems can open and sync a directory; elsewhere this does nothing.
+    """
+    if os.name != "posix":
+        return
+    fd = os.open(path or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -1,9 +1,14 @@
 import json
 import os
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Set, Tuple
+
+from file_lock import atomic_write_json, file_lock
 
 
 class GroupSettingsManager:
+    # Settings that decide which patterns a group's messages are parsed with
+    PATTERN_SETTINGS = ("payment_source", "custom_patterns")
+
     def __init__(self, settings_file: str = "group_settings.json"):
         self.settings_file = settings_file
         self._ensure_file_exists()
@@ -42,9 +47,13 @@ class GroupSettingsManager:
 
     def _ensure_file_exists(self):
         """Create settings file if it doesn't exist."""
-        if not os.path.exists(self.settings_file):
-            with open(self.settings_file, "w") as f:
-                json.dump({}, f)
+        with self.lock():
+            if not os.path.exists(self.settings_file):
+                atomic_write_json(self.settings_file, {})
+
+    def lock(self):
+        """Lock the settings file; hold it around every read-modify-write."""
+        return file_lock(self.settings_file)
 
     def load_settings(self) -> Dict[str, Any]:
         """Load all group settings from JSON file."""
@@ -54,11 +63,19 @@ class GroupSettingsManager:
         except (FileNotFoundError, json.JSONDecodeError):
             return {}
 
+    def settings_signature(self) -> Optional[Tuple[int, int, int]]:
+        """Identify the settings file's contents by inode, size and modification time."""
+        try:
+            stat = os.stat(self.settings_file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
     def save_settings(self, settings: Dict[str, Any]) -> bool:
         """Save group settings to JSON file."""
         try:
-            with open(self.settings_file, "w") as f:
-                json.dump(settings, f, indent=2)
+            with self.lock():
+                atomic_write_json(self.settings_file, settings, indent=2)
             return True
         except Exception as e:
             print(f"Error saving settings: {e}")
@@ -80,14 +97,19 @@ class GroupSettingsManager:
 
     def update_group_settings(self, group_id: str, new_settings: Dict[str, Any]) -> bool:
         """Update settings for a specific group."""
-        all_settings = self.load_settings()
-        group_id_str = str(group_id)
+        with self.lock():
+            all_settings = self.load_settings()
+            group_id_str = str(group_id)
 
-        if group_id_str not in all_settings:
-            all_settings[group_id_str] = self._get_default_group_settings()
+            if group_id_str not in all_settings:
+                all_settings[group_id_str] = self._get_default_group_settings()
 
-        all_settings[group_id_str].update(new_settings)
-        return self.save_settings(all_settings)
+            group_settings = all_settings[group_id_str]
+            if any(key in new_settings for key in self.PATTERN_SETTINGS):
+                # Lets parsers in any process drop patterns compiled for the old config
+                group_settings["config_version"] = group_settings.get("config_version", 0) + 1
+            group_settings.update(new_settings)
+            return self.save_settings(all_settings)
 
     def set_payment_source(self, group_id: str, source_key: str) -> bool:
         """Set the payment source for a group."""
@@ -114,7 +136,18 @@ class GroupSettingsManager:
 
     def get_payment_config(self, group_id: str) -> Dict[str, Any]:
         """Get the current payment configuration for a group."""
+        return self._payment_config(self.get_group_settings(group_id))
+
+    def get_versioned_payment_config(self, group_id: str) -> Tuple[int, Dict[str, Any]]:
+        """Get a group's payment configuration with its config version.
+
+        The version changes whenever the group's payment source or custom
+        patterns change, so it can key caches built from the configuration.
+        """
         settings = self.get_group_settings(group_id)
+        return settings.get("config_version", 0), self._payment_config(settings)
+
+    def _payment_config(self, settings: Dict[str, Any]) -> Dict[str, Any]:
         source_key = settings.get("payment_source", "kb_prasac_merchant_payment")
 
         if source_key == "custom" and settings.get("custom_patterns"):
@@ -124,6 +157,16 @@ class GroupSettingsManager:
             source_key, self.default_sources["kb_prasac_merchant_payment"]
         )
 
+    def get_all_identifiers(self) -> Set[str]:
+        """Get the identifier of every payment source any group is or could be set to."""
+        identifiers = {source["identifier"] for source in self.default_sources.values()}
+        for settings in self.load_settings().values():
+            if settings.get("payment_source") == "custom" and settings.get("custom_patterns"):
+                identifiers.add(
+                    settings["custom_patterns"].get("identifier", "kb_prasac_merchant_payment")
+                )
+        return identifiers
+
     def get_available_sources(self) -> Dict[str, Dict[str, Any]]:
         """Get all available payment sources."""
         return self.default_sources
@@ -0,0 +1,407 @@
+"""
+Key Rotation for Payment Bot SaaS
+Copyright (c) 2025 Sochetra. All rights reserved.
+
+This module re-encrypts every stored transaction (hot store, archive and
+client shards) under a new encryption key while the bot keeps running.
+Records are re-encrypted in parallel chunks into a staging area with a
+checkpoint after every chunk, so an interrupted rotation resumes where it
+stopped. The new key is only published once every staged record has been
+verified to decrypt with it alone.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import TRANSACTION_DECRYPT_WORKERS
+from encryption_manager import EncryptionManager, process_pool_context
+from file_lock import atomic_write_json, file_lock
+from storage_backends import JournalBackend, StorageBackend
+from tenant_storage import ShardedTransactionStorage
+from transaction_storage import TransactionStorage
+
+logger = logging.getLogger(__name__)
+
+EMPTY_CHAIN = hashlib.sha256(b"").hexdigest()
+
+
+def _chain(digest: str, record: Dict[str, Any]) -> str:
+    """Extend a running digest with one record, so a sequence can be checked in order."""
+    data = json.dumps(record, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(digest.encode("ascii") + data).hexdigest()
+
+
+# The (old keyring, new key) managers of a re-encryption worker, set by _init_rotation_worker()
+_worker_managers: Tuple[Optional[EncryptionManager], Optional[EncryptionManager]] = (None, None)
+
+
+def _init_rotation_worker(old_key: str, previous_keys: List[str], new_key: str):
+    global _worker_managers
+    _worker_managers = (EncryptionManager(old_key, previous_keys), EncryptionManager(new_key, []))
+
+
+def _decrypt_in_worker(
+    records: List[Dict[str, Any]], sensitive_fields: List[str]
+) -> List[Dict[str, Any]]:
+    return _worker_managers[0]._decrypt_chunk(records, sensitive_fields)
+
+
+def _encrypt_in_worker(
+    records: List[Dict[str, Any]], sensitive_fields: List[str]
+) -> List[Dict[str, Any]]:
+    return [_worker_managers[1].encrypt_sensitive_fields(r, sensitive_fields) for r in records]
+
+
+class KeyRotation:
+    """Resumable re-encryption of every transaction store under a new key.
+
+    1. Stage: stream each store part ("hot" backend, "archive") through
+       decrypt-with-keyring / re-encrypt-with-new-key into a staging journal.
+    2. Verify: decrypt every staged record with the new key only and check
+       it against the plaintext digest taken while staging.
+    3. Publish: add the new key to the readable keyring, then under the
+       stores' locks stage anything written meanwhile, swap the staged
+       records in, make the new key current and rebuild blind indexes,
+       rollups, fingerprints and the columnar snapshot.
+
+    The live stores are untouched until publishing, and the old key stays
+    readable afterwards, so the bot keeps serving throughout.
+    """
+
+    STAGING_DIR = ".key_rotation"
+    CHUNK_SIZE = 500
+
+    def __init__(
+        self,
+        sharded: Optional[ShardedTransactionStorage] = None,
+        workers: int = TRANSACTION_DECRYPT_WORKERS,
+    ):
+        self.sharded = sharded or ShardedTransactionStorage()
+        self.workers = max(1, workers)
+        self.checkpoint_path = os.path.join(self.STAGING_DIR, "checkpoint.json")
+        self.next_key_path = os.path.join(self.STAGING_DIR, "next_key")
+        self.checkpoint: Dict[str, Any] = {}
+        self.new_manager: Optional[EncryptionManager] = None
+        self._targets: Dict[str, TransactionStorage] = {}
+
+    def lock(self):
+        """Only one rotation may run at a time."""
+        return file_lock(self.STAGING_DIR)
+
+    def _save_checkpoint(self):
+        atomic_write_json(self.checkpoint_path, self.checkpoint, indent=2)
+
+    def _load_or_start(self, new_key: Optional[str]):
+        """Resume the rotation in progress, or start one with a new key."""
+        os.makedirs(self.STAGING_DIR, exist_ok=True)
+        if os.path.exists(self.checkpoint_path) and os.path.exists(self.next_key_path):
+            with open(self.checkpoint_path, "r") as f:
+                self.checkpoint = json.load(f)
+            with open(self.next_key_path, "r") as f:
+                staged_key = f.read().strip()
+            if new_key is not None and new_key != staged_key:
+                raise RuntimeError("A rotation to a different key is in progress; finish it first")
+            new_key = staged_key
+            logger.info("Resuming key rotation from checkpoint")
+        else:
+            new_key = new_key or EncryptionManager.generate_random_key()
+            fd = os.open(self.next_key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(new_key)
+                f.flush()
+                os.fsync(f.fileno())
+            self.checkpoint = {"phase": "staging", "stores": {}}
+            self._save_checkpoint()
+
+        # The new key alone: staged records must not depend on any old key
+        self.new_manager = EncryptionManager(new_key, [])
+
+    def _store_dir(self, client_id: str) -> str:
+        return os.path.join(self.STAGING_DIR, f"tenant-{client_id}" if client_id else "shared")
+
+    def _target(self, client_id: str) -> TransactionStorage:
+        """A store in the staging area that prepares records under the new key."""
+        if client_id not in self._targets:
+            store_dir = self._store_dir(client_id)
+            os.makedirs(store_dir, exist_ok=True)
+            self._targets[client_id] = TransactionStorage(
+                backend=JournalBackend(os.path.join(store_dir, "hot.jsonl")),
+                data_dir=store_dir,
+                encryption_manager=self.new_manager,
+            )
+        return self._targets[client_id]
+
+    def _parts(
+        self, client_id: str, store: TransactionStorage
+    ) -> List[Tuple[str, StorageBackend, JournalBackend]]:
+        """(name, live backend, staging journal) for the hot store and the archive."""
+        target = self._target(client_id)
+        archive = JournalBackend(os.path.join(self._store_dir(client_id), "archive.jsonl"))
+        return [("hot", store.backend, target.backend), ("archive", store.archive, archive)]
+
+    def _reencrypt_window(
+        self,
+        run: Callable,
+        store: TransactionStorage,
+        target: TransactionStorage,
+        records: List[Dict[str, Any]],
+    ) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Decrypt records with the store's keyring and prepare them under the new key.
+
+        ``run`` maps a worker function over chunks, in worker processes or
+        in this one. Fernet work holds the GIL, so only processes use
+        several cores; payer ids, blind indexes and fingerprints are cheap
+        and computed here.
+        """
+        fields = store.sensitive_fields
+        plains = []
+        for plain in self._run_chunked(run, _decrypt_in_worker, records, fields):
+            plain = store._resolve_payer(plain)
+            for field in fields:
+                if plain.get(f"{field}_encrypted") or EncryptionManager.is_encrypted(
+                    plain.get(field)
+                ):
+                    # Re-encrypting the ciphertext would lose the value for good
+                    raise RuntimeError(f"Stored {field} cannot be decrypted with any known key")
+            plains.append(store._strip_storage_fields(plain))
+
+        prepared = [target._prepare_for_storage(plain, encrypt_fields=False) for plain in plains]
+        stored = self._run_chunked(run, _encrypt_in_worker, prepared, fields)
+        return list(zip(stored, plains))
+
+    def _run_chunked(
+        self,
+        run: Callable,
+        task: Callable,
+        records: List[Dict[str, Any]],
+        sensitive_fields: List[str],
+    ) -> List[Dict[str, Any]]:
+        """Apply a worker task to records CHUNK_SIZE at a time, keeping their order."""
+        chunks = [records[i : i + self.CHUNK_SIZE] for i in range(0, len(records), self.CHUNK_SIZE)]
+        results = run(task, chunks, [sensitive_fields] * len(chunks))
+        return [record for chunk in results for record in chunk]
+
+    def _stage_part(
+        self,
+        client_id: str,
+        store: TransactionStorage,
+        part: str,
+        read_source: Callable[[], Iterator[Dict[str, Any]]],
+        staged: JournalBackend,
+    ):
+        """Re-encrypt the records of one part that have not been staged yet."""
+        state = self.checkpoint["stores"].setdefault(client_id, {}).setdefault(part, {})
+        if "count" not in state:
+            self._reset_state(state)
+
+        # A crash between appending a chunk and saving the checkpoint leaves extra records
+        if len(list(islice(staged.iter_records(), state["count"] + 1))) > state["count"]:
+            staged.rewrite_records(list(islice(staged.iter_records(), state["count"])))
+
+        # Staged records must still be a prefix of the source; a rewrite means starting over
+        records = read_source()
+        source_chain = EMPTY_CHAIN
+        for record in islice(records, state["count"]):
+            source_chain = _chain(source_chain, record)
+        if source_chain != state["source"]:
+            logger.info(f"Source of {client_id or 'shared'}/{part} was rewritten; restaging it")
+            staged.rewrite_records([])
+            self._reset_state(state)
+            self._save_checkpoint()
+            records = read_source()
+
+        target = self._target(client_id)
+        keys = (
+            store.encryption_manager.encryption_key,
+            list(store.encryption_manager.previous_keys),
+            self.new_manager.encryption_key,
+        )
+        with ExitStack() as stack:
+            run = None
+            while True:
+                window = list(islice(records, self.CHUNK_SIZE * self.workers))
+                if not window:
+                    break
+
+                if run is None and self.workers > 1:
+                    executor = stack.enter_context(
+                        ProcessPoolExecutor(
+                            max_workers=self.workers,
+                            mp_context=process_pool_context(),
+                            initializer=_init_rotation_worker,
+                            initargs=keys,
+                        )
+                    )
+                    run = executor.map
+                elif run is None:
+                    _init_rotation_worker(*keys)
+                    run = map
+
+                entries = self._reencrypt_window(run, store, target, window)
+                staged.append_records([stored for stored, _ in entries])
+
+                for record in window:
+                    state["source"] = _chain(state["source"], record)
+                for _, plain in entries:
+                    state["plain"] = _chain(state["plain"], plain)
+                state["count"] += len(window)
+                self._save_checkpoint()
+                logger.info(f"Staged {state['count']} {part} records of {client_id or 'shared'}")
+
+    @staticmethod
+    def _reset_state(state: Dict[str, Any]):
+        state.update(
+            count=0, source=EMPTY_CHAIN, plain=EMPTY_CHAIN, verified=0, verified_plain=EMPTY_CHAIN
+        )
+
+    def _verify_part(
+        self, client_id: str, store: TransactionStorage, part: str, staged: JournalBackend
+    ):
+        """Check that staged records decrypt under the new key alone to the staged plaintext."""
+        state = self.checkpoint["stores"][client_id][part]
+        chain = state["verified_plain"]
+        verified = state["verified"]
+
+        records = islice(staged.iter_records(), verified, None)
+        while True:
+            batch = list(islice(records, self.CHUNK_SIZE * self.workers))
+            if not batch:
+                break
+            decrypted = self.new_manager.decrypt_many(
+                batch, store.sensitive_fields, max_workers=self.workers
+            )
+            for record in decrypted:
+                record = self._target(client_id)._resolve_payer(record)
+                for field in store.sensitive_fields:
+                    if EncryptionManager.is_encrypted(record.get(field)):
+                        raise RuntimeError(
+                            f"Verification failed: a staged {part} record of "
+                            f"{client_id or 'shared'} does not decrypt with the new key"
+                        )
+                chain = _chain(chain, store._strip_storage_fields(record))
+            verified += len(batch)
+
+        if verified != state["count"] or chain != state["plain"]:
+            raise RuntimeError(
+                f"Verification failed: staged {part} records of {client_id or 'shared'} "
+                "do not match the source"
+            )
+        state.update(verified=verified, verified_plain=chain)
+        self._save_checkpoint()
+
+    def _publish(self, stores: Dict[str, TransactionStorage]):
+        """Swap the staged records in and make the new key current."""
+        for store in stores.values():
+            store.flush()
+        new_key = self.new_manager.encryption_key
+
+        current = EncryptionManager()
+        if current.encryption_key != new_key:
+            # Make the new key readable everywhere before any live record uses it
+            if new_key not in current.previous_keys:
+                EncryptionManager.save_keys(
+                    current.encryption_key, [new_key] + current.previous_keys
+                )
+            previous_keys = [current.encryption_key] + [
+                key for key in current.previous_keys if key != new_key
+            ]
+        else:
+            # An earlier run stopped after publishing the key
+            previous_keys = current.previous_keys
+        self.checkpoint["phase"] = "publishing"
+        self._save_checkpoint()
+
+        with ExitStack() as stack:
+            # Writers of every store wait until the new key and data are in place.
+            # Each store's own lock comes first, as in TransactionStorage, so its
+            # flush timer can't hold it while waiting for the file locks below
+            for store in stores.values():
+                stack.enter_context(store._lock)
+            for store in stores.values():
+                if store.fingerprints is not None:
+                    stack.enter_context(store.fingerprints.lock())
+                stack.enter_context(store.backend.lock())
+                if store.rollups is not None:
+                    stack.enter_context(store.rollups.lock())
+                if store.payers is not None:
+                    stack.enter_context(store.payers.lock())
+
+            for client_id, store in stores.items():
+                store._refresh_keys()
+                for part, live, staged in self._parts(client_id, store):
+                    # Records written since staging are re-encrypted now, under the lock
+                    records = list(live.iter_records())
+                    self._stage_part(client_id, store, part, lambda: iter(records), staged)
+                    self._verify_part(client_id, store, part, staged)
+
+            for client_id, store in stores.items():
+                for part, live, staged in self._parts(client_id, store):
+                    live.rewrite_records(list(staged.iter_records()))
+                target = self._target(client_id)
+                if store.payers is not None and target.payers is not None:
+                    # Staged records refer to the ids of the staged dictionary
+                    store.payers.replace_with(target.payers)
+
+            EncryptionManager.save_keys(new_key, previous_keys)
+
+            for store in stores.values():
+                # Blind indexes and fingerprints are keyed, so everything derived is redone
+                store._refresh_keys()
+                store.rebuild_derived_data()
+
+        logger.info(f"Published new encryption key for {len(stores)} transaction stores")
+
+    def run(self, new_key: Optional[str] = None) -> Dict[str, int]:
+        """Rotate (or resume rotating) every store; returns records re-encrypted per store."""
+        with self.lock():
+            self._load_or_start(new_key)
+            stores = self.sharded.stores()
+
+            if self.checkpoint["phase"] == "staging":
+                for client_id, store in stores.items():
+                    for part, live, staged in self._parts(client_id, store):
+                        self._stage_part(client_id, store, part, live.iter_records, staged)
+                        self._verify_part(client_id, store, part, staged)
+
+            self._publish(stores)
+
+            counts = {
+                client_id or "shared": sum(part["count"] for part in parts.values())
+                for client_id, parts in self.checkpoint["stores"].items()
+            }
+            for target in self._targets.values():
+                target.close()
+            shutil.rmtree(self.STAGING_DIR, ignore_errors=True)
+            return counts
+
+
+def main():
+    """Rotate the encryption key of all stored transactions."""
+    arg_parser = argparse.ArgumentParser(
+        description="Re-encrypt all stored transactions under a new key (resumable)"
+    )
+    arg_parser.add_argument(
+        "--new-key-file", help="file holding the new key (default: generate one)"
+    )
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    new_key = None
+    if args.new_key_file:
+        with open(args.new_key_file, "r") as f:
+            new_key = f.read().strip()
+
+    for store, count in KeyRotation().run(new_key).items():
+        print(f"{store}: {count} transactions re-encrypted")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,8 @@ from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandl
 from config import TELEGRAM_BOT_TOKEN
 from group_settings import GroupSettingsManager
 from payment_parser import PaymentParser
+from scheduler import ArchiveScheduler
+from tenant_storage import ShardedTransactionStorage
 from transaction_storage import TransactionStorage
 
 logging.basicConfig(
@@ -36,7 +38,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id) if update.effective_user else "unknown"
 
     # Try to parse as payment notification (no authentication required)
-    transaction = parser.parse_payment(message_text, group_id)
+    transaction = parser.parse_payment(
+        message_text, group_id, PaymentParser.original_send_time(update.message)
+    )
     if transaction:
         success = storage.save_transaction(transaction)
         if success:
@@ -51,7 +55,8 @@ async def cmd_daily_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_info = f"@{user.username}" if user.username else f"{user.first_name}"
 
     date_str = datetime.now().strftime("%Y-%m-%d")
-    summary = storage.get_daily_summary(date_str)
+    group_id = str(update.effective_chat.id)
+    summary = storage.get_daily_summary(date_str, group_id=group_id)
 
     if summary["transaction_count"] == 0:
         await update.message.reply_text(f"📊 No transactions found for {date_str}")
@@ -121,16 +126,29 @@ def main():
     app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
 
     # Add handlers
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    # Edited messages are out of scope: an edit that corrects the amount or payer
+    # would fingerprint as a new payment, so only new messages are parsed
+    app.add_handler(
+        MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, handle_message)
+    )
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("daily", cmd_daily_report))
     app.add_handler(CommandHandler("help", cmd_help))
 
     print("✅ Simple bot is running! Send /help in your group to test.")
 
+    # Move transactions past TRANSACTION_RETENTION_DAYS into the archive
+    archiver = ArchiveScheduler(ShardedTransactionStorage(shared=storage))
+    archiver.start()
+
     # Start polling
     app.run_polling()
 
+    archiver.stop()
+
+    # Write out any buffered transactions before exiting
+    storage.close()
+
 
 if __name__ == "__main__":
     main()
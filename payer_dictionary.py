@@ -0,0 +1,166 @@
+"""
+Payer Dictionary for Payment Bot SaaS
+Copyright (c) 2025 Sochetra. All rights reserved.
+
+This module stores each distinct payer name once, encrypted, and gives it a
+small integer id that transaction records reference instead of carrying
+their own ciphertext. Regular customers then cost one decryption per
+process rather than one per payment.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Callable, Dict, Optional
+
+from file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+
+class PayerDictionary:
+    """Append-only JSON-lines file of ``{"id", "index", "payer"}`` entries.
+
+    ``index`` is the payer's blind index and ``payer`` its ciphertext.
+    Entries never change once written, so decrypted names are memoised while
+    the file keeps the (inode, size) it was read at or grows by appends. A
+    key rotation replaces the file and renumbers the ids, which every process
+    notices on its next lookup.
+    """
+
+    def __init__(self, file_path: str, decrypt: Callable[[str], str]):
+        self.file_path = file_path
+        self._decrypt = decrypt
+        self._lock = threading.RLock()
+        self._clear()
+        self._refresh()
+
+    def _clear(self):
+        self.ids: Dict[str, int] = {}
+        self.ciphertexts: Dict[int, str] = {}
+        self._plaintexts: Dict[int, str] = {}
+        # (inode, bytes read) of the file as last loaded
+        self._position: Optional[tuple] = None
+
+    def reload(self):
+        """Forget everything loaded so far and read the file again."""
+        with self._lock:
+            self._clear()
+            self._refresh()
+
+    def lock(self):
+        """Return the cross-process lock to hold while assigning ids."""
+        return file_lock(self.file_path)
+
+    def _replaced(self) -> bool:
+        """Whether the file on disk is no longer the one the loaded entries came from."""
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return self._position is not None
+        if self._position is None:
+            return True
+        return stat.st_ino != self._position[0] or stat.st_size < self._position[1]
+
+    def _refresh(self):
+        """Load entries appended by other storage instances."""
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            if self._position is not None:
+                self._clear()
+            return
+
+        offset = 0
+        if self._position is not None and self._position[0] == stat.st_ino:
+            if self._position[1] == stat.st_size:
+                return
+            if self._position[1] < stat.st_size:
+                offset = self._position[1]
+        if offset == 0:
+            # New or replaced file: ids may now mean different payers
+            self._clear()
+
+        with open(self.file_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+
+        # Ignore a partially written last line; it is picked up once complete
+        complete = data.rfind(b"\n") + 1
+        for line in data[:complete].decode("utf-8").split("\n"):
+            if not line:
+                continue
+            entry = json.loads(line)
+            self.ids[entry["index"]] = entry["id"]
+            self.ciphertexts[entry["id"]] = entry["payer"]
+        self._position = (stat.st_ino, offset + complete)
+
+    def id_for(self, index: str, encrypt: Callable[[], str]) -> int:
+        """Return the id of a payer, adding it (encrypted lazily) if it is new."""
+        with self._lock:
+            payer_id = self.ids.get(index)
+            if payer_id is not None:
+                return payer_id
+
+            with self.lock():
+                self._refresh()
+                payer_id = self.ids.get(index)
+                if payer_id is not None:
+                    return payer_id
+
+                payer_id = len(self.ciphertexts) + 1
+                ciphertext = encrypt()
+                entry = {"id": payer_id, "index": index, "payer": ciphertext}
+                with open(self.file_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                    end = f.tell()
+
+                self.ids[index] = payer_id
+                self.ciphertexts[payer_id] = ciphertext
+                self._position = (os.stat(self.file_path).st_ino, end)
+                return payer_id
+
+    def ciphertext(self, payer_id: int) -> Optional[str]:
+        """Return the stored ciphertext of a payer id."""
+        with self._lock:
+            if payer_id not in self.ciphertexts:
+                self._refresh()
+            return self.ciphertexts.get(payer_id)
+
+    def lookup(self, payer_id: int) -> Optional[str]:
+        """Return the decrypted payer name, decrypting each entry at most once."""
+        with self._lock:
+            # Ids are only stable within one file; a rotation may have swapped it
+            if payer_id in self._plaintexts and not self._replaced():
+                return self._plaintexts[payer_id]
+            # Another worker may have added the entry, or a rotation replaced the file
+            self._refresh()
+            ciphertext = self.ciphertexts.get(payer_id)
+            if ciphertext is None:
+                logger.warning(f"Unknown payer id {payer_id} in {self.file_path}")
+                return None
+
+            try:
+                payer = self._decrypt(ciphertext)
+            except Exception as e:
+                logger.warning(f"Could not decrypt payer {payer_id}: {e}")
+                # Like inline fields, keep the ciphertext if decryption fails
+                return ciphertext
+            self._plaintexts[payer_id] = payer
+            return payer
+
+    def replace_with(self, other: "PayerDictionary"):
+        """Atomically replace this dictionary with a copy of another one's file."""
+        temp_path = f"{self.file_path}.{os.getpid()}.tmp"
+        with self._lock:
+            if os.path.exists(other.file_path):
+                shutil.copyfile(other.file_path, temp_path)
+            with open(temp_path, "ab") as f:
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.file_path)
+            self._refresh()
+        logger.info(f"Replaced payer dictionary {self.file_path}")
@@ -3,10 +3,11 @@ Payment Parser for Payment Bot SaaS
 Copyright (c) 2025 Sochetra. All rights reserved.
 """
 
+import html
 import logging
 import re
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Pattern, Tuple
 
 from group_settings import GroupSettingsManager
 from security_validator import SecurityValidator
@@ -15,77 +16,183 @@ logger = logging.getLogger(__name__)
 
 
 class PaymentParser:
+    # Bank reference carried by most notifications, used to detect re-deliveries
+    TRANSACTION_ID_PATTERN = re.compile(r"Transaction\s*ID\s*[:#]?\s*([\w-]+)", re.IGNORECASE)
+
     def __init__(self):
         self.settings_manager = GroupSettingsManager()
-
-    def is_payment_message(self, message_text: str, group_id: str) -> bool:
-        """Check if the message is a payment notification based on group configuration."""
-        # Security validation first
-        validation = SecurityValidator.validate_message_input(message_text, group_id)
-        if not validation["valid"]:
-            logger.warning(f"Invalid message input: {validation['errors']}")
-            return False
-
-        config = self.settings_manager.get_payment_config(group_id)
-        identifier = config.get("identifier", "kb_prasac_merchant_payment")
-
-        # Use sanitized message for checking
-        sanitized_message = validation["sanitized_message"]
-        return identifier in sanitized_message
-
-    def parse_payment(self, message_text: str, group_id: str) -> Optional[Dict[str, Any]]:
-        """Parse payment notification and extract amount and payer name using group-specific patterns."""
-        # Rate limiting check
-        rate_check = SecurityValidator.check_rate_limit(group_id, "parse_payment")
-        if not rate_check["allowed"]:
-            logger.warning(f"Rate limit exceeded for group {group_id}: {rate_check}")
-            SecurityValidator.log_security_event(
-                "rate_limit_exceeded", {"group_id": group_id, "action": "parse_payment"}, "WARNING"
-            )
-            return None
-
-        # Validate input first
-        validation = SecurityValidator.validate_message_input(message_text, group_id)
-        if not validation["valid"]:
-            logger.error(f"Security validation failed: {validation['errors']}")
-            return None
-
-        # Use sanitized inputs
-        sanitized_message = validation["sanitized_message"]
-        sanitized_group_id = validation["sanitized_group_id"]
-
-        if not self.is_payment_message(message_text, group_id):
-            return None
-
-        config = self.settings_manager.get_payment_config(sanitized_group_id)
+        # group_id -> ((config version, amount pattern, payer pattern), compiled patterns or
+        # None if they failed validation); a new version or pattern text replaces the entry
+        self._matchers: Dict[str, Tuple[Tuple[int, str, str], Optional[Dict[str, Pattern]]]] = {}
+        # (settings file signature, matcher for every identifier any group could use)
+        self._identifier_filter: Tuple[Optional[tuple], Optional[Pattern]] = (None, None)
+
+    @staticmethod
+    def original_send_time(message: Any) -> Optional[datetime]:
+        """Return when a Telegram message was first sent, looking through forwards.
+
+        ``message.date`` is when this copy was posted, so a forwarded
+        notification would otherwise get a new time on every forward.
+        """
+        if hasattr(message, "forward_origin"):
+            # python-telegram-bot 20.8+; forward_date is deprecated there
+            origin = message.forward_origin
+            if origin is not None and getattr(origin, "date", None) is not None:
+                return origin.date
+        elif getattr(message, "forward_date", None) is not None:
+            return message.forward_date
+        return getattr(message, "date", None)
+
+    def _get_identifier_filter(self) -> Optional[Pattern]:
+        """Return a matcher for all known identifiers, rebuilt when the settings file changes.
+
+        None means every message has to be treated as a candidate.
+        """
+        signature = self.settings_manager.settings_signature()
+        if signature is not None and signature == self._identifier_filter[0]:
+            return self._identifier_filter[1]
+
+        alternatives = set()
+        for identifier in self.settings_manager.get_all_identifiers():
+            if not identifier.strip():
+                # An empty identifier is contained in every message
+                alternatives = None
+                break
+            # Identifiers are matched against sanitized text: HTML-escaped, whitespace collapsed
+            for variant in (identifier, html.unescape(identifier)):
+                alternatives.add(r"\s+".join(re.escape(word) for word in variant.split()))
+
+        matcher = re.compile("|".join(sorted(alternatives))) if alternatives else None
+        self._identifier_filter = (signature, matcher)
+        return matcher
+
+    def _is_candidate(self, message_text: str) -> bool:
+        """Cheaply check the raw text for any identifier before the full validation."""
+        if not isinstance(message_text, str):
+            # Left to validation, which rejects and logs it
+            return True
+        matcher = self._get_identifier_filter()
+        if matcher is None:
+            return True
+        # Sanitization drops null bytes, which could otherwise split an identifier
+        return matcher.search(message_text.replace("\x00", "")) is not None
+
+    def _get_matchers(
+        self, group_id: str, version: int, config: Dict[str, Any]
+    ) -> Optional[Dict[str, Pattern]]:
+        """Return a group's compiled amount and payer patterns, validating them once."""
         amount_pattern = config.get("amount_pattern")
         payer_pattern = config.get("payer_pattern")
-
         if not amount_pattern or not payer_pattern:
             return None
 
+        key = (version, amount_pattern, payer_pattern)
+        cached = self._matchers.get(group_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
         # Validate patterns before use
         amount_pattern_validation = SecurityValidator.validate_regex_pattern(
             amount_pattern, "amount"
         )
         payer_pattern_validation = SecurityValidator.validate_regex_pattern(payer_pattern, "payer")
 
+        matchers = None
         if not amount_pattern_validation["valid"] or not payer_pattern_validation["valid"]:
-            logger.error(f"Invalid regex patterns detected for group {sanitized_group_id}")
+            logger.error(f"Invalid regex patterns detected for group {group_id}")
             SecurityValidator.log_security_event(
                 "invalid_regex_pattern",
                 {
-                    "group_id": sanitized_group_id,
+                    "group_id": group_id,
                     "amount_errors": amount_pattern_validation.get("errors", []),
                     "payer_errors": payer_pattern_validation.get("errors", []),
                 },
                 "ERROR",
             )
+        else:
+            matchers = {
+                "amount": re.compile(amount_pattern, re.IGNORECASE),
+                "payer": re.compile(payer_pattern, re.IGNORECASE),
+            }
+
+        self._matchers[group_id] = (key, matchers)
+        return matchers
+
+    def _message_context(self, message_text: str, group_id: str) -> Optional[Dict[str, Any]]:
+        """Validate and sanitize a message once and gather everything later stages need.
+
+        The context holds the sanitized message and group ID, the group's
+        payment config and its compiled patterns (None if they are invalid).
+        """
+        validation = SecurityValidator.validate_message_input(message_text, group_id)
+        if not validation["valid"]:
+            logger.warning(f"Invalid message input: {validation['errors']}")
+            return None
+
+        sanitized_group_id = validation["sanitized_group_id"]
+        version, config = self.settings_manager.get_versioned_payment_config(sanitized_group_id)
+        return {
+            "message": validation["sanitized_message"],
+            "group_id": sanitized_group_id,
+            "config": config,
+            # Patterns are validated and compiled once per config version
+            "matchers": self._get_matchers(sanitized_group_id, version, config),
+        }
+
+    @staticmethod
+    def _is_payment(context: Dict[str, Any]) -> bool:
+        identifier = context["config"].get("identifier", "kb_prasac_merchant_payment")
+        return identifier in context["message"]
+
+    def is_payment_message(self, message_text: str, group_id: str) -> bool:
+        """Check if the message is a payment notification based on group configuration."""
+        if not self._is_candidate(message_text):
+            return False
+        context = self._message_context(message_text, group_id)
+        return context is not None and self._is_payment(context)
+
+    def parse_payment(
+        self, message_text: str, group_id: str, message_time: Optional[datetime] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Parse a payment notification into amount and payer using the group's patterns.
+
+        ``message_time`` is when the notification was originally sent; it lets
+        storage recognise re-delivered messages that carry no transaction ID.
+        """
+        # Ordinary chat is dropped before it costs validation or rate limit budget
+        if not self._is_candidate(message_text):
+            return None
+
+        # Rate limiting check
+        rate_check = SecurityValidator.check_rate_limit(group_id, "parse_payment")
+        if not rate_check["allowed"]:
+            logger.warning(f"Rate limit exceeded for group {group_id}: {rate_check}")
+            SecurityValidator.log_security_event(
+                "rate_limit_exceeded", {"group_id": group_id, "action": "parse_payment"}, "WARNING"
+            )
+            return None
+
+        # Validate, sanitize and look up the group's config once for every stage
+        context = self._message_context(message_text, group_id)
+        if context is None or not self._is_payment(context):
+            return None
+
+        return self._extract_payment(context, message_time)
+
+    def _extract_payment(
+        self, context: Dict[str, Any], message_time: Optional[datetime]
+    ) -> Optional[Dict[str, Any]]:
+        """Extract and validate a transaction from a classified payment message."""
+        matchers = context["matchers"]
+        if matchers is None:
             return None
 
+        sanitized_message = context["message"]
+        sanitized_group_id = context["group_id"]
+
         try:
             # Extract amount using validated pattern
-            amount_match = re.search(amount_pattern, sanitized_message, re.IGNORECASE)
+            amount_match = matchers["amount"].search(sanitized_message)
             if not amount_match:
                 return None
 
@@ -96,7 +203,7 @@ class PaymentParser:
                 return None
 
             # Extract payer name using validated pattern
-            payer_match = re.search(payer_pattern, sanitized_message, re.IGNORECASE)
+            payer_match = matchers["payer"].search(sanitized_message)
             if not payer_match:
                 return None
 
@@ -111,7 +218,7 @@ class PaymentParser:
             payer = payer_validation["sanitized_name"]
 
             now = datetime.now()
-            source_name = config.get("name", "Unknown Source")
+            source_name = context["config"].get("name", "Unknown Source")
 
             transaction = {
                 "date": now.strftime("%Y-%m-%d"),
@@ -123,6 +230,12 @@ class PaymentParser:
                 "group_id": sanitized_group_id,
             }
 
+            transaction_id_match = self.TRANSACTION_ID_PATTERN.search(sanitized_message)
+            if transaction_id_match:
+                transaction["transaction_id"] = transaction_id_match.group(1)
+            if message_time is not None:
+                transaction["message_time"] = message_time.isoformat()
+
             # Log successful parsing (with hashed sensitive data)
             SecurityValidator.log_security_event(
                 "payment_parsed",
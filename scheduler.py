@@ -2,11 +2,13 @@ import asyncio
 import threading
 import time
 from datetime import datetime
+from typing import Optional
 
 import schedule
 from telegram import Bot
 
-from config import DAILY_REPORT_TIME, TELEGRAM_BOT_TOKEN
+from config import DAILY_REPORT_TIME, TELEGRAM_BOT_TOKEN, TRANSACTION_RETENTION_DAYS
+from tenant_storage import ShardedTransactionStorage
 from transaction_storage import TransactionStorage
 
 
@@ -24,7 +26,10 @@ class DailyReportScheduler:
             return
 
         yesterday = datetime.now().strftime("%Y-%m-%d")
-        summary = self.storage.get_daily_summary(yesterday)
+        group_id = str(self.group_chat_id)
+        summary = self.storage.get_daily_summary(
+            yesterday, include_transactions=False, group_id=group_id
+        )
 
         if summary["transaction_count"] == 0:
             report = f"📊 **Daily Report - {yesterday}**\n\nNo transactions recorded today."
@@ -34,7 +39,8 @@ class DailyReportScheduler:
             report += f"📝 Transaction Count: {summary['transaction_count']}\n\n"
             report += "**Transactions:**\n"
 
-            for i, transaction in enumerate(summary["transactions"], 1):
+            transactions = self.storage.iter_transactions(yesterday, yesterday, group_id)
+            for i, transaction in enumerate(transactions, 1):
                 report += f"{i}. ${transaction['amount']:.2f} - {transaction['payer']}\n"
 
         # Send the report
@@ -77,3 +83,48 @@ class DailyReportScheduler:
         self.running = False
         schedule.clear()
         print("Scheduler stopped")
+
+
+class ArchiveScheduler:
+    """Archives old transactions of every store from inside the running bot.
+
+    Runs once at startup and then daily at DAILY_REPORT_TIME, on its own
+    schedule.Scheduler so it never shares jobs with DailyReportScheduler.
+    Does nothing while TRANSACTION_RETENTION_DAYS is 0.
+    """
+
+    def __init__(self, storage: Optional[ShardedTransactionStorage] = None):
+        self.storage = storage or ShardedTransactionStorage()
+        self.scheduler = schedule.Scheduler()
+        self.running = False
+
+    def archive(self):
+        """Archive every store, keeping the scheduler alive if one fails."""
+        try:
+            counts = self.storage.archive_old_transactions()
+            print(f"Archived {sum(counts.values())} transactions from {len(counts)} stores")
+        except Exception as e:
+            print(f"Error archiving transactions: {e}")
+
+    def start(self):
+        """Start archiving in a background thread."""
+        if self.running or TRANSACTION_RETENTION_DAYS <= 0:
+            return
+
+        self.running = True
+        self.scheduler.every().day.at(DAILY_REPORT_TIME).do(self.archive)
+
+        def run_scheduler():
+            # A bot restarted more often than daily would otherwise never archive
+            self.archive()
+            while self.running:
+                self.scheduler.run_pending()
+                time.sleep(60)
+
+        threading.Thread(target=run_scheduler, daemon=True).start()
+        print(f"Transactions older than {TRANSACTION_RETENTION_DAYS} days will be archived")
+
+    def stop(self):
+        """Stop archiving."""
+        self.running = False
+        self.scheduler.clear()
@@ -40,6 +40,25 @@ class SecurityValidator:
     # Rate limits (requests per minute)
     RATE_LIMITS = {"parse_payment": 100, "admin_command": 20, "pattern_test": 10}
 
+    # Suspicious content, combined into one pattern so each text is scanned once
+    SUSPICIOUS_CONTENT = re.compile(
+        "|".join(
+            [
+                r"<script",  # Script tags
+                r"javascript:",  # JavaScript protocols
+                r"eval\(",  # Eval functions
+                r"exec\(",  # Exec functions
+                r"import\s+os",  # OS imports
+                r"import\s+subprocess",  # Subprocess imports
+                r"__import__",  # Dynamic imports
+                r"\$\{.*\}",  # Template injection
+                r"#{.*}",  # Template injection
+            ]
+        ),
+        re.IGNORECASE,
+    )
+    WHITESPACE = re.compile(r"\s+")
+
     @classmethod
     def validate_message_input(cls, message_text: str, group_id: str) -> Dict[str, Any]:
         """Validate and sanitize message input."""
@@ -226,7 +245,7 @@ class SecurityValidator:
         sanitized = sanitized.replace("\x00", "")
 
         # Normalize whitespace
-        sanitized = re.sub(r"\s+", " ", sanitized).strip()
+        sanitized = cls.WHITESPACE.sub(" ", sanitized).strip()
 
         return sanitized
 
@@ -257,23 +276,7 @@ class SecurityValidator:
     @classmethod
     def _contains_suspicious_content(cls, text: str) -> bool:
         """Check for suspicious content patterns."""
-        suspicious_patterns = [
-            r"<script",  # Script tags
-            r"javascript:",  # JavaScript protocols
-            r"eval\(",  # Eval functions
-            r"exec\(",  # Exec functions
-            r"import\s+os",  # OS imports
-            r"import\s+subprocess",  # Subprocess imports
-            r"__import__",  # Dynamic imports
-            r"\$\{.*\}",  # Template injection
-            r"#{.*}",  # Template injection
-        ]
-
-        for pattern in suspicious_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                return True
-
-        return False
+        return cls.SUSPICIOUS_CONTENT.search(text) is not None
 
     @classmethod
     def _has_potential_backtracking(cls, pattern: str) -> bool:
@@ -28,7 +28,8 @@ from client_manager import ClientManager
 from config import TELEGRAM_BOT_TOKEN
 from group_settings import GroupSettingsManager
 from payment_parser import PaymentParser
-from transaction_storage import TransactionStorage
+from scheduler import ArchiveScheduler
+from tenant_storage import ShardedTransactionStorage
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -37,7 +38,8 @@ logger = logging.getLogger(__name__)
 
 # Initialize components
 parser = PaymentParser()
-storage = TransactionStorage()
+# One transaction store per client when TRANSACTIONS_SHARD_BY_CLIENT is enabled
+storage = ShardedTransactionStorage()
 settings_manager = GroupSettingsManager()
 auth_middleware = AuthMiddleware()
 client_manager = ClientManager()
@@ -57,7 +59,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     group_id = str(update.effective_chat.id)
 
     # Try to parse as payment notification
-    transaction = parser.parse_payment(message_text, group_id)
+    transaction = parser.parse_payment(
+        message_text, group_id, PaymentParser.original_send_time(update.message)
+    )
     if transaction:
         # Add client information to transaction
         transaction["client_id"] = client["client_id"]
@@ -78,7 +82,10 @@ async def cmd_daily_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_info = f"@{user.username}" if user.username else f"{user.first_name}"
 
     date_str = datetime.now().strftime("%Y-%m-%d")
-    summary = storage.get_daily_summary(date_str)
+    group_id = str(update.effective_chat.id)
+    client = context.user_data.get("client")
+    client_storage = storage.for_client(client["client_id"] if client else None)
+    summary = client_storage.get_daily_summary(date_str, group_id=group_id)
 
     if summary["transaction_count"] == 0:
         await update.message.reply_text(f"📊 No transactions found for {date_str}")
@@ -259,7 +266,11 @@ def main():
     app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
 
     # Add handlers
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    # Edited messages are out of scope: an edit that corrects the amount or payer
+    # would fingerprint as a new payment, so only new messages are parsed
+    app.add_handler(
+        MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, handle_message)
+    )
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("daily", cmd_daily_report))
     app.add_handler(CommandHandler("help", cmd_help))
@@ -278,9 +289,18 @@ def main():
 
     print("✅ Bot is running! Send /help in your group to test.")
 
+    # Move transactions past TRANSACTION_RETENTION_DAYS into the archive
+    archiver = ArchiveScheduler(storage)
+    archiver.start()
+
     # Start polling
     app.run_polling()
 
+    archiver.stop()
+
+    # Write out any buffered transactions before exiting
+    storage.close()
+
 
 if __name__ == "__main__":
     main()
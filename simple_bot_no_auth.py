@@ -9,6 +9,8 @@ from datetime import datetime
 from telegram import Update
 from telegram.ext import Application, MessageHandler, CommandHandler, filters, ContextTypes
 from payment_parser import PaymentParser
+from scheduler import ArchiveScheduler
+from tenant_storage import ShardedTransactionStorage
 from transaction_storage import TransactionStorage
 from group_settings import GroupSettingsManager
 from admin_utils import admin_only_command, get_user_info
@@ -34,7 +36,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     group_id = str(update.effective_chat.id)
     
     # Try to parse as payment notification (no authentication required)
-    transaction = parser.parse_payment(message_text, group_id)
+    transaction = parser.parse_payment(
+        message_text, group_id, PaymentParser.original_send_time(update.message)
+    )
     if transaction:
         success = storage.save_transaction(transaction)
         if success:
@@ -46,7 +50,8 @@ async def cmd_daily_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_info = f"@{user.username}" if user.username else f"{user.first_name}"
     
     date_str = datetime.now().strftime('%Y-%m-%d')
-    summary = storage.get_daily_summary(date_str)
+    group_id = str(update.effective_chat.id)
+    summary = storage.get_daily_summary(date_str, group_id=group_id)
     
     if summary['transaction_count'] == 0:
         await update.message.reply_text(f"📊 No transactions found for {date_str}")
@@ -111,15 +116,30 @@ def main():
     app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
     
     # Add handlers
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    # Edited messages are out of scope: an edit that corrects the amount or payer
+    # would fingerprint as a new payment, so only new messages are parsed
+    app.add_handler(
+        MessageHandler(
+            filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, handle_message
+        )
+    )
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("daily", cmd_daily_report))
     app.add_handler(CommandHandler("help", cmd_help))
     
     print("✅ Simple bot is running! Send /help in your group to test.")
     
+    # Move transactions past TRANSACTION_RETENTION_DAYS into the archive
+    archiver = ArchiveScheduler(ShardedTransactionStorage(shared=storage))
+    archiver.start()
+
     # Start polling
     app.run_polling()
 
+    archiver.stop()
+
+    # Write out any buffered transactions before exiting
+    storage.close()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,267 @@
+"""
+Bank Statement Import for Payment Bot SaaS
+Copyright (c) 2025 Sochetra. All rights reserved.
+
+This module backfills a group's transaction history from CSV or JSON bank
+statements, so onboarding a merchant does not depend on replaying months of
+payment notifications through the bot.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from security_validator import SecurityValidator
+from tenant_storage import ShardedTransactionStorage
+
+logger = logging.getLogger(__name__)
+
+# Accepted header names per field, compared lower-cased with spaces/dashes as underscores
+COLUMN_ALIASES = {
+    "date": ("date", "transaction_date", "value_date", "posting_date", "booking_date"),
+    "time": ("time", "transaction_time"),
+    "amount": ("amount", "credit", "credit_amount", "amount_usd"),
+    "payer": ("payer", "payer_name", "from", "sender", "name", "counterparty", "description"),
+    "transaction_id": ("transaction_id", "trx_id", "reference", "ref", "reference_no"),
+    "currency": ("currency", "ccy"),
+}
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d", "%d %b %Y", "%b %d, %Y")
+TIME_FORMATS = ("%H:%M:%S", "%H:%M", "%I:%M %p")
+
+# Currency symbols, codes and spaces around a statement amount
+AMOUNT_NOISE = re.compile(r"[^\d.,\-]")
+# Accepted amount layouts by decimal separator: optional thousands groups of three
+# digits and at most two decimals, so "1.234,56" can't be misread as 1.234
+AMOUNT_FORMATS = {
+    ".": re.compile(r"^-?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d{1,2})?$"),
+    ",": re.compile(r"^-?(?:\d{1,3}(?:\.\d{3})+|\d+)(?:,\d{1,2})?$"),
+}
+
+
+def _normalize_header(name: str) -> str:
+    return re.sub(r"[\s\-]+", "_", name.strip().lower())
+
+
+def _map_columns(headers: List[str]) -> Dict[str, str]:
+    """Map our field names to the statement's own column names."""
+    by_normalized = {_normalize_header(header): header for header in headers if header}
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in by_normalized:
+                columns[field] = by_normalized[alias]
+                break
+    return columns
+
+
+def _parse_date(value: str, date_format: Optional[str]) -> Optional[datetime]:
+    value = value.strip()
+    formats = (date_format,) if date_format else DATE_FORMATS
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    # Statements often carry a full timestamp in the date column
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _parse_amount(value: str, decimal_separator: str) -> Optional[float]:
+    """Parse a statement amount, or return None if it doesn't fit the decimal separator."""
+    amount = AMOUNT_NOISE.sub("", value)
+    if not AMOUNT_FORMATS[decimal_separator].match(amount):
+        return None
+    thousands_separator = "," if decimal_separator == "." else "."
+    amount = amount.replace(thousands_separator, "").replace(decimal_separator, ".")
+    return round(float(amount), 2)
+
+
+def _parse_time(value: str) -> Optional[datetime]:
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _row_to_transaction(
+    row: Dict[str, Any],
+    columns: Dict[str, str],
+    group_id: str,
+    source: str,
+    client_id: Optional[str],
+    date_format: Optional[str],
+    decimal_separator: str,
+) -> Optional[Dict[str, Any]]:
+    """Turn one statement row into a transaction as the parser would produce it."""
+    value = {field: str(row.get(column) or "").strip() for field, column in columns.items()}
+
+    day = _parse_date(value.get("date", ""), date_format)
+    if day is None:
+        logger.warning(f"Skipping statement row with unreadable date: {row}")
+        return None
+
+    has_time = bool(value.get("time")) or day.time() != datetime.min.time()
+    if value.get("time"):
+        time_of_day = _parse_time(value["time"])
+        if time_of_day is None:
+            has_time = False
+        else:
+            day = day.replace(
+                hour=time_of_day.hour, minute=time_of_day.minute, second=time_of_day.second
+            )
+
+    amount = _parse_amount(value.get("amount", ""), decimal_separator)
+    if amount is None:
+        logger.warning(f"Skipping statement row with unreadable or ambiguous amount: {row}")
+        return None
+
+    payer_validation = SecurityValidator.validate_payer_name(value.get("payer", ""))
+    if not payer_validation["valid"]:
+        logger.warning(f"Skipping statement row with invalid payer: {payer_validation['errors']}")
+        return None
+
+    transaction = {
+        "date": day.strftime("%Y-%m-%d"),
+        "timestamp": day.isoformat(),
+        "amount": amount,
+        "payer": payer_validation["sanitized_name"],
+        "type": "income",
+        "source": source,
+        "group_id": str(group_id),
+    }
+    if value.get("currency"):
+        transaction["currency"] = value["currency"].upper()
+    if client_id:
+        transaction["client_id"] = client_id
+    # Any of these gives the row a fingerprint, so re-importing a statement is harmless
+    if value.get("transaction_id"):
+        transaction["transaction_id"] = value["transaction_id"]
+    elif has_time:
+        transaction["message_time"] = day.isoformat()
+    return transaction
+
+
+def _rows_to_transactions(
+    rows: Iterable[Dict[str, Any]], headers: List[str], *args
+) -> Iterator[Dict[str, Any]]:
+    columns = _map_columns(headers)
+    missing = [field for field in ("date", "amount", "payer") if field not in columns]
+    if missing:
+        raise ValueError(f"Statement has no column for: {', '.join(missing)}")
+
+    occurrences = Counter()
+    for row in rows:
+        transaction = _row_to_transaction(row, columns, *args)
+        if transaction is None:
+            continue
+        if "transaction_id" not in transaction and "message_time" not in transaction:
+            # Only the date is known: number same-day payments of one amount by one
+            # payer, which overlapping statements of the same days agree on
+            key = (transaction["date"], transaction["amount"], transaction["payer"])
+            occurrences[key] += 1
+            transaction["statement_row"] = occurrences[key]
+        yield transaction
+
+
+def read_statement(
+    file_path: str,
+    group_id: str,
+    source: str = "Bank Statement",
+    client_id: Optional[str] = None,
+    date_format: Optional[str] = None,
+    decimal_separator: str = ".",
+) -> Iterator[Dict[str, Any]]:
+    """Yield transactions from a CSV file or a JSON array of row objects.
+
+    ``decimal_separator`` is "." ("1,234.56") or "," ("1.234,56"); amounts
+    that don't fit it are skipped rather than guessed.
+    """
+    if decimal_separator not in AMOUNT_FORMATS:
+        raise ValueError(f"Unsupported decimal separator: {decimal_separator!r}")
+    options = (group_id, source, client_id, date_format, decimal_separator)
+    if file_path.lower().endswith(".json"):
+        with open(file_path, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        if isinstance(rows, dict):
+            rows = rows.get("transactions", [])
+        headers = sorted({key for row in rows for key in row})
+        yield from _rows_to_transactions(rows, headers, *options)
+        return
+
+    with open(file_path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        yield from _rows_to_transactions(reader, reader.fieldnames or [], *options)
+
+
+def import_statement(
+    file_path: str,
+    group_id: str,
+    source: str = "Bank Statement",
+    client_id: Optional[str] = None,
+    date_format: Optional[str] = None,
+    storage: Optional[ShardedTransactionStorage] = None,
+    decimal_separator: str = ".",
+) -> Dict[str, int]:
+    """Import a statement into a group's history with one batched write."""
+    storage = storage or ShardedTransactionStorage()
+    transactions = read_statement(
+        file_path, group_id, source, client_id, date_format, decimal_separator
+    )
+    counts = storage.for_client(client_id).save_transactions(transactions)
+    logger.info(f"Imported {os.path.basename(file_path)} into group {group_id}: {counts}")
+    return counts
+
+
+def main():
+    """Import bank statements from the command line."""
+    arg_parser = argparse.ArgumentParser(
+        description="Import CSV/JSON bank statements into a group's transaction history"
+    )
+    arg_parser.add_argument("group_id", help="Telegram group ID the payments belong to")
+    arg_parser.add_argument("files", nargs="+", help="statement files (.csv or .json)")
+    arg_parser.add_argument("--source", default="Bank Statement", help="payment source name")
+    arg_parser.add_argument("--client-id", help="client whose shard receives the transactions")
+    arg_parser.add_argument("--date-format", help="strptime format of the date column")
+    arg_parser.add_argument(
+        "--decimal-separator",
+        choices=AMOUNT_FORMATS,
+        default=".",
+        help='decimal separator of the amounts: "." (1,234.56) or "," (1.234,56)',
+    )
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    storage = ShardedTransactionStorage()
+    try:
+        for file_path in args.files:
+            counts = import_statement(
+                file_path,
+                args.group_id,
+                args.source,
+                args.client_id,
+                args.date_format,
+                storage,
+                args.decimal_separator,
+            )
+            print(
+                f"{file_path}: {counts['saved']} saved, {counts['duplicates']} duplicates, "
+                f"{counts['invalid']} invalid"
+            )
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,855 @@
+"""
+Storage Backends for Payment Bot SaaS
+Copyright (c) 2025 Sochetra. All rights reserved.
+
+This module provides the on-disk formats used by TransactionStorage. Backends
+only deal with stored (already encrypted) records; encryption stays in
+TransactionStorage.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import lzma
+import os
+import sqlite3
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from config import (
+    TRANSACTIONS_DB_FILE,
+    TRANSACTIONS_FILE,
+    TRANSACTIONS_JOURNAL_FILE,
+    TRANSACTIONS_PARTITION_DIR,
+    TRANSACTIONS_PARTITION_GRANULARITY,
+)
+from file_lock import atomic_write_json, file_lock, fsync_directory
+
+logger = logging.getLogger(__name__)
+
+
+def _in_date_range(
+    record: Dict[str, Any], start_date: Optional[str], end_date: Optional[str]
+) -> bool:
+    """Check a stored record against an inclusive YYYY-MM-DD range."""
+    if start_date is None and end_date is None:
+        return True
+
+    date = record.get("date")
+    if not date:
+        return False
+
+    if start_date is not None and date < start_date:
+        return False
+    if end_date is not None and date > end_date:
+        return False
+    return True
+
+
+def _matches_indexes(
+    record: Dict[str, Any], group_index: Optional[str], payer_index: Optional[str]
+) -> bool:
+    """Check blind indexes, keeping records that predate them for a plaintext check."""
+    for field, value in (("group_id_index", group_index), ("payer_index", payer_index)):
+        if value is None:
+            continue
+        stored = record.get(field)
+        if stored is not None and stored != value:
+            return False
+    return True
+
+
+def _lacks_indexes(record: Dict[str, Any]) -> bool:
+    """Check whether a record was stored before blind indexes existed."""
+    return (record.get("group_id") is not None and "group_id_index" not in record) or (
+        record.get("payer") is not None and "payer_index" not in record
+    )
+
+
+def _count_unindexed(records: Iterable[Dict[str, Any]]) -> int:
+    return sum(1 for record in records if _lacks_indexes(record))
+
+
+class StorageBackend:
+    """Base class for transaction storage backends.
+
+    Subclasses must implement ``_scan``, ``append_records`` and
+    ``rewrite_records``. The query methods fall back to a full scan and may be
+    overridden by backends that can answer them more cheaply.
+
+    ``iter_records`` may return records without a blind index when filtering
+    by group or payer; callers confirm those after decryption. Aggregates only
+    count records whose stored index matches.
+
+    Writers hold ``lock()`` so several worker processes can share the store;
+    callers may also hold it to read a consistent signature.
+    """
+
+    # Data file the advisory lock is taken on; None disables locking
+    lock_target: Optional[str] = None
+
+    # Records found without blind indexes when the store was opened (imported
+    # from the legacy JSON file); TransactionStorage backfills their indexes
+    legacy_records: int = 0
+
+    def lock(self):
+        """Return the cross-process lock guarding writes to this store."""
+        return file_lock(self.lock_target) if self.lock_target else nullcontext()
+
+    def _scan(self) -> Iterator[Dict[str, Any]]:
+        """Yield every stored record in insertion order."""
+        raise NotImplementedError
+
+    def append_records(self, records: List[Dict[str, Any]]) -> None:
+        """Persist new stored records."""
+        raise NotImplementedError
+
+    def rewrite_records(self, records: Iterable[Dict[str, Any]]) -> None:
+        """Replace the whole store with the given records."""
+        raise NotImplementedError
+
+    def signature(self) -> Optional[Any]:
+        """Return a token that changes whenever the stored data changes.
+
+        ``None`` means the backend cannot tell, and callers must not cache.
+        """
+        return None
+
+    def changes_since(
+        self, old_signature: Any, new_signature: Any
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Return the records appended between two signatures.
+
+        ``None`` means the change was not a plain append (or is unknown), so
+        anything derived from the old state has to be rebuilt.
+        """
+        return None
+
+    def iter_records(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+        payer_index: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield stored records, optionally limited to a date range, group or payer."""
+        for record in self._scan():
+            if _in_date_range(record, start_date, end_date) and _matches_indexes(
+                record, group_index, payer_index
+            ):
+                yield record
+
+    def _iter_exact(
+        self, start_date: Optional[str], end_date: Optional[str], group_index: Optional[str]
+    ) -> Iterator[Dict[str, Any]]:
+        for record in self.iter_records(start_date, end_date, group_index):
+            if group_index is None or record.get("group_id_index") == group_index:
+                yield record
+
+    def summarize(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Return total amount and transaction count for a date range."""
+        total_amount = 0
+        transaction_count = 0
+        for record in self._iter_exact(start_date, end_date, group_index):
+            total_amount += record.get("amount", 0)
+            transaction_count += 1
+
+        return {"total_amount": total_amount, "transaction_count": transaction_count}
+
+    def daily_totals(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+    ) -> Dict[str, float]:
+        """Return the total amount per date for a date range."""
+        totals = {}
+        for record in self._iter_exact(start_date, end_date, group_index):
+            date = record.get("date")
+            if date:
+                totals[date] = totals.get(date, 0) + record.get("amount", 0)
+        return totals
+
+
+def _file_signature(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+
+def _load_legacy_records(legacy_file_path: Optional[str]) -> List[Dict[str, Any]]:
+    """Read records from the legacy JSON file so a new backend can be seeded."""
+    if legacy_file_path and os.path.exists(legacy_file_path):
+        return JSONFileBackend(legacy_file_path)._read_all()
+    return []
+
+
+class JSONFileBackend(StorageBackend):
+    """Legacy backend keeping all records in a single JSON array."""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.lock_target = file_path
+        self._ensure_file_exists()
+        # This is the legacy format itself, so records may predate blind indexes
+        self.legacy_records = _count_unindexed(self._read_all())
+
+    def _ensure_file_exists(self):
+        """Create transactions file if it doesn't exist."""
+        if not os.path.exists(self.file_path):
+            with open(self.file_path, "w") as f:
+                json.dump([], f)
+
+    def _read_all(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.file_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            logger.warning(f"Could not load transactions: {e}")
+            return []
+
+    def _scan(self) -> Iterator[Dict[str, Any]]:
+        yield from self._read_all()
+
+    def append_records(self, records: List[Dict[str, Any]]) -> None:
+        # Stored records are appended as-is, nothing gets decrypted here
+        with self.lock():
+            transactions = self._read_all()
+            transactions.extend(records)
+            self.rewrite_records(transactions)
+
+    def rewrite_records(self, records: Iterable[Dict[str, Any]]) -> None:
+        with self.lock():
+            atomic_write_json(self.file_path, list(records), indent=2)
+
+    def signature(self) -> Optional[tuple]:
+        return _file_signature(self.file_path)
+
+
+class JournalBackend(StorageBackend):
+    """Append-only journal with one JSON record per line.
+
+    Each line has the form ``{"seq": <n>, "record": {...}}``. Inserts are a
+    single append, so the cost of saving a payment does not grow with history.
+    """
+
+    def __init__(self, file_path: str, legacy_file_path: str = None):
+        self.file_path = file_path
+        self.lock_target = file_path
+        with self.lock():
+            self._ensure_file_exists(legacy_file_path)
+            self._terminate_torn_line()
+            self.last_seq = self._read_last_seq()
+
+    def _ensure_file_exists(self, legacy_file_path: str = None):
+        """Create the journal, seeding it from the legacy JSON file if present."""
+        if os.path.exists(self.file_path):
+            return
+
+        legacy_records = _load_legacy_records(legacy_file_path)
+
+        temp_path = f"{self.file_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for seq, record in enumerate(legacy_records, 1):
+                f.write(self._encode_line(seq, record))
+        os.replace(temp_path, self.file_path)
+
+        if legacy_records:
+            self.legacy_records = _count_unindexed(legacy_records)
+            logger.info(
+                f"Imported {len(legacy_records)} transactions from {legacy_file_path} "
+                f"into {self.file_path}"
+            )
+
+    def _terminate_torn_line(self):
+        """Make sure the next append starts on a fresh line after a crash."""
+        with open(self.file_path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    @staticmethod
+    def _encode_line(seq: int, record: Dict[str, Any]) -> str:
+        return json.dumps({"seq": seq, "record": record}, ensure_ascii=False) + "\n"
+
+    def _read_last_seq(self) -> int:
+        """Read the sequence number of the last complete line without a full scan."""
+        with open(self.file_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            buffer = b""
+
+            while position > 0:
+                step = min(4096, position)
+                position -= step
+                f.seek(position)
+                buffer = f.read(step) + buffer
+
+                lines = buffer.rstrip(b"\n").split(b"\n")
+                # Keep reading backwards until we hold at least one full line
+                if len(lines) > 1 or position == 0:
+                    for line in reversed(lines):
+                        try:
+                            return int(json.loads(line)["seq"])
+                        except (ValueError, KeyError, TypeError):
+                            continue
+                    if position == 0:
+                        break
+
+        return 0
+
+    def _read_from(self, offset: int = 0, end: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Yield records stored between two byte offsets (to the end by default)."""
+        try:
+            with open(self.file_path, "rb") as f:
+                f.seek(offset)
+                lines = f if end is None else f.read(end - offset).splitlines()
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    try:
+                        yield json.loads(line)["record"]
+                    except (json.JSONDecodeError, KeyError) as e:
+                        # A torn write after a crash only affects the last line
+                        logger.warning(f"Skipping corrupt journal line in {self.file_path}: {e}")
+        except FileNotFoundError as e:
+            logger.warning(f"Could not load transactions: {e}")
+
+    def _scan(self) -> Iterator[Dict[str, Any]]:
+        return self._read_from(0)
+
+    def signature(self) -> Optional[tuple]:
+        # The journal only grows in place; rewrites replace the inode
+        file_signature = _file_signature(self.file_path)
+        return file_signature[:2] if file_signature else None
+
+    def changes_since(
+        self, old_signature: Any, new_signature: Any
+    ) -> Optional[List[Dict[str, Any]]]:
+        if (
+            not old_signature
+            or not new_signature
+            or new_signature[0] != old_signature[0]
+            or new_signature[1] < old_signature[1]
+        ):
+            return None
+        return list(self._read_from(old_signature[1], new_signature[1]))
+
+    def append_records(self, records: List[Dict[str, Any]]) -> None:
+        with self.lock():
+            # Other processes may have appended (or crashed mid-append) since we last looked
+            self._terminate_torn_line()
+            seq = self._read_last_seq()
+
+            lines = []
+            for record in records:
+                seq += 1
+                lines.append(self._encode_line(seq, record))
+
+            with open(self.file_path, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.last_seq = seq
+
+    def rewrite_records(self, records: Iterable[Dict[str, Any]]) -> None:
+        with self.lock():
+            temp_path = f"{self.file_path}.tmp"
+            seq = 0
+            with open(temp_path, "w", encoding="utf-8") as f:
+                for record in records:
+                    seq += 1
+                    f.write(self._encode_line(seq, record))
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(temp_path, self.file_path)
+            self.last_seq = seq
+
+
+class PartitionedBackend(StorageBackend):
+    """Date-partitioned journals, one file per day or per month.
+
+    Range queries only open the partitions that overlap the range, so a
+    single-day report never reads the rest of the history. Records without a
+    date go to an ``undated`` partition that is only read by unbounded scans.
+    """
+
+    UNDATED = "undated"
+
+    def __init__(self, directory: str, granularity: str = "month", legacy_file_path: str = None):
+        if granularity not in ("day", "month"):
+            raise ValueError(f"Unknown partition granularity: {granularity}")
+
+        self.directory = directory
+        self.lock_target = directory
+        self.key_length = 10 if granularity == "day" else 7
+        self._partitions: Dict[str, JournalBackend] = {}
+
+        with self.lock():
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, exist_ok=True)
+                legacy_records = _load_legacy_records(legacy_file_path)
+                if legacy_records:
+                    self.append_records(legacy_records)
+                    self.legacy_records = _count_unindexed(legacy_records)
+                    logger.info(
+                        f"Imported {len(legacy_records)} transactions from {legacy_file_path} "
+                        f"into {self.directory}"
+                    )
+
+    def _partition_key(self, record: Dict[str, Any]) -> str:
+        date = record.get("date")
+        return date[: self.key_length] if date else self.UNDATED
+
+    def _partition(self, key: str) -> JournalBackend:
+        if key not in self._partitions:
+            self._partitions[key] = JournalBackend(os.path.join(self.directory, f"{key}.jsonl"))
+        return self._partitions[key]
+
+    def _partition_keys(self, start_date: Optional[str], end_date: Optional[str]) -> List[str]:
+        """List existing partitions overlapping an inclusive date range, oldest first."""
+        keys = sorted(
+            name[: -len(".jsonl")] for name in os.listdir(self.directory) if name.endswith(".jsonl")
+        )
+
+        if start_date is None and end_date is None:
+            return keys
+
+        selected = []
+        for key in keys:
+            if key == self.UNDATED:
+                continue
+            if start_date is not None and key < start_date[: self.key_length]:
+                continue
+            if end_date is not None and key > end_date[: self.key_length]:
+                continue
+            selected.append(key)
+        return selected
+
+    def _scan(self) -> Iterator[Dict[str, Any]]:
+        return self.iter_records()
+
+    def append_records(self, records: List[Dict[str, Any]]) -> None:
+        by_partition: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            by_partition.setdefault(self._partition_key(record), []).append(record)
+
+        with self.lock():
+            for key, partition_records in by_partition.items():
+                self._partition(key).append_records(partition_records)
+
+    def rewrite_records(self, records: Iterable[Dict[str, Any]]) -> None:
+        by_partition: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            by_partition.setdefault(self._partition_key(record), []).append(record)
+
+        with self.lock():
+            for key in self._partition_keys(None, None):
+                if key not in by_partition:
+                    os.remove(os.path.join(self.directory, f"{key}.jsonl"))
+                    self._partitions.pop(key, None)
+
+            for key, partition_records in by_partition.items():
+                self._partition(key).rewrite_records(partition_records)
+
+    def signature(self) -> Optional[tuple]:
+        return tuple(
+            (key, self._partition(key).signature()) for key in self._partition_keys(None, None)
+        )
+
+    def changes_since(
+        self, old_signature: Any, new_signature: Any
+    ) -> Optional[List[Dict[str, Any]]]:
+        if old_signature is None or new_signature is None:
+            return None
+
+        previous = dict(old_signature)
+        changes = []
+        for key, partition_signature in new_signature:
+            if partition_signature is None:
+                return None
+            appended = self._partition(key).changes_since(
+                previous.pop(key, (partition_signature[0], 0)), partition_signature
+            )
+            if appended is None:
+                return None
+            changes.extend(appended)
+
+        # A partition that disappeared means records were removed
+        return None if previous else changes
+
+    def iter_records(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+        payer_index: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        for key in self._partition_keys(start_date, end_date):
+            # Month partitions may still hold dates outside the range
+            yield from self._partition(key).iter_records(
+                start_date, end_date, group_index, payer_index
+            )
+
+
+class SQLiteBackend(StorageBackend):
+    """SQLite backend with indexed columns for date, group, client and source.
+
+    The full stored record is kept as JSON in ``record``; the indexed columns
+    are copies of its plaintext (or blind-indexed) fields so that filters and
+    aggregates run inside SQLite.
+    """
+
+    def __init__(self, db_path: str, legacy_file_path: str = None):
+        self.db_path = db_path
+        # SQLite locks its own writes; this only orders them with signature reads
+        self.lock_target = db_path
+        with self.lock():
+            is_new = not os.path.exists(self.db_path)
+            self._create_schema()
+
+            if is_new:
+                legacy_records = _load_legacy_records(legacy_file_path)
+                if legacy_records:
+                    self.append_records(legacy_records)
+                    self.legacy_records = _count_unindexed(legacy_records)
+                    logger.info(
+                        f"Imported {len(legacy_records)} transactions from {legacy_file_path} "
+                        f"into {self.db_path}"
+                    )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection that commits on success and is always closed."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _create_schema(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS transactions (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    date TEXT,
+                    amount REAL,
+                    source TEXT,
+                    client_id TEXT,
+                    group_index TEXT,
+                    payer_index TEXT,
+                    record TEXT NOT NULL
+                )
+                """
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(transactions)")}
+            if "payer_index" not in columns:
+                conn.execute("ALTER TABLE transactions ADD COLUMN payer_index TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_transactions_group "
+                "ON transactions(group_index, date)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_transactions_payer "
+                "ON transactions(payer_index, date)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_transactions_client "
+                "ON transactions(client_id, date)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_transactions_source ON transactions(source, date)"
+            )
+
+    @staticmethod
+    def _where_clause(
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+        payer_index: Optional[str] = None,
+        exact: bool = False,
+    ):
+        """Build a WHERE clause and parameters for a date range and blind indexes."""
+        conditions = []
+        params = []
+        if start_date is not None:
+            conditions.append("date >= ?")
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append("date <= ?")
+            params.append(end_date)
+
+        for column, value in (("group_index", group_index), ("payer_index", payer_index)):
+            if value is None:
+                continue
+            if exact:
+                conditions.append(f"{column} = ?")
+            else:
+                conditions.append(f"({column} = ? OR {column} IS NULL)")
+            params.append(value)
+
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where, params
+
+    def _scan(self) -> Iterator[Dict[str, Any]]:
+        return self.iter_records()
+
+    def _insert(self, conn: sqlite3.Connection, records: List[Dict[str, Any]]):
+        conn.executemany(
+            "INSERT INTO transactions "
+            "(date, amount, source, client_id, group_index, payer_index, record) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            self._rows(records),
+        )
+
+    @staticmethod
+    def _rows(records: List[Dict[str, Any]]) -> List[tuple]:
+        return [
+            (
+                record.get("date"),
+                record.get("amount"),
+                record.get("source"),
+                record.get("client_id"),
+                record.get("group_id_index"),
+                record.get("payer_index"),
+                json.dumps(record, ensure_ascii=False),
+            )
+            for record in records
+        ]
+
+    def append_records(self, records: List[Dict[str, Any]]) -> None:
+        with self.lock(), self._connect() as conn:
+            self._insert(conn, records)
+
+    def rewrite_records(self, records: Iterable[Dict[str, Any]]) -> None:
+        records = list(records)
+        with self.lock(), self._connect() as conn:
+            conn.execute("DELETE FROM transactions")
+            self._insert(conn, records)
+
+    def signature(self) -> Optional[tuple]:
+        # Commits land in the WAL first, so watch both files
+        return (_file_signature(self.db_path), _file_signature(f"{self.db_path}-wal"))
+
+    def iter_records(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+        payer_index: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        where, params = self._where_clause(start_date, end_date, group_index, payer_index)
+        with self._connect() as conn:
+            for (record,) in conn.execute(
+                f"SELECT record FROM transactions{where} ORDER BY seq", params
+            ):
+                yield json.loads(record)
+
+    def summarize(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        where, params = self._where_clause(start_date, end_date, group_index, exact=True)
+        with self._connect() as conn:
+            total_amount, transaction_count = conn.execute(
+                f"SELECT COALESCE(SUM(amount), 0), COUNT(*) FROM transactions{where}", params
+            ).fetchone()
+
+        return {"total_amount": total_amount, "transaction_count": transaction_count}
+
+    def daily_totals(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+    ) -> Dict[str, float]:
+        where, params = self._where_clause(start_date, end_date, group_index, exact=True)
+        where = f"{where} AND date IS NOT NULL" if where else " WHERE date IS NOT NULL"
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT date, COALESCE(SUM(amount), 0) FROM transactions{where} GROUP BY date",
+                params,
+            ).fetchall()
+
+        return dict(rows)
+
+
+class ArchiveBackend(StorageBackend):
+    """Compressed, append-only monthly segments for transactions out of the hot window.
+
+    Each ``YYYY-MM.jsonl.gz`` (or ``.xz``) segment holds stored records, one
+    per line; appends add a new compressed member to the segment. Range
+    queries only open the segments of the months they overlap.
+
+    Appends are fsynced and skip records the segment already holds, so
+    archiving again after a crash between archiving and removing records
+    from the hot store does not archive them twice.
+    """
+
+    OPENERS = {"gzip": (gzip.open, ".jsonl.gz"), "lzma": (lzma.open, ".jsonl.xz")}
+    # Each call writes one complete gzip member / xz stream; readers see the concatenation
+    COMPRESSORS = {"gzip": gzip.compress, "lzma": lzma.compress}
+
+    def __init__(self, directory: str, compression: str = "gzip"):
+        if compression not in self.OPENERS:
+            raise ValueError(f"Unknown archive compression: {compression}")
+
+        self.directory = directory
+        self.lock_target = directory
+        self.compression = compression
+
+    def _segment_path(self, month: str, compression: Optional[str] = None) -> str:
+        suffix = self.OPENERS[compression or self.compression][1]
+        return os.path.join(self.directory, f"{month}{suffix}")
+
+    def _segments(self, start_date: Optional[str], end_date: Optional[str]) -> List[tuple]:
+        """List (month, path, opener) of segments overlapping a date range, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+
+        segments = []
+        for name in sorted(os.listdir(self.directory)):
+            for opener, suffix in self.OPENERS.values():
+                if not name.endswith(suffix):
+                    continue
+                month = name[: -len(suffix)]
+                if start_date is not None and month < start_date[:7]:
+                    continue
+                if end_date is not None and month > end_date[:7]:
+                    continue
+                segments.append((month, os.path.join(self.directory, name), opener))
+        return segments
+
+    def months(self) -> List[str]:
+        """List archived months."""
+        return sorted({month for month, _, _ in self._segments(None, None)})
+
+    def _scan(self) -> Iterator[Dict[str, Any]]:
+        return self.iter_records()
+
+    @staticmethod
+    def record_key(record: Dict[str, Any]) -> bytes:
+        """Identify one stored record.
+
+        Encrypted fields carry a random IV and parsed records a timestamp, so
+        two stored records only compare equal when one is a copy of the other.
+        """
+        return hashlib.sha256(
+            json.dumps(record, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).digest()
+
+    def append_records(self, records: List[Dict[str, Any]]) -> None:
+        by_month: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            if not record.get("date"):
+                raise ValueError("Undated transactions cannot be archived")
+            by_month.setdefault(record["date"][:7], []).append(record)
+
+        compress = self.COMPRESSORS[self.compression]
+        with self.lock():
+            os.makedirs(self.directory, exist_ok=True)
+            skipped = 0
+            for month, month_records in sorted(by_month.items()):
+                # Copies left by an archive run that crashed before the hot rewrite
+                archived = {
+                    self.record_key(r) for r in self.iter_records(f"{month}-01", f"{month}-31")
+                }
+                new_records = [r for r in month_records if self.record_key(r) not in archived]
+                skipped += len(month_records) - len(new_records)
+                if not new_records:
+                    continue
+
+                data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in new_records)
+                with open(self._segment_path(month), "ab") as f:
+                    f.write(compress(data.encode("utf-8")))
+                    f.flush()
+                    os.fsync(f.fileno())
+            # New segments must survive a crash before the hot store drops the records
+            fsync_directory(self.directory)
+
+        if skipped:
+            logger.info(f"Skipped {skipped} transactions that were already archived")
+
+    def rewrite_records(self, records: Iterable[Dict[str, Any]]) -> None:
+        with self.lock():
+            old_paths = [path for _, path, _ in self._segments(None, None)]
+            for path in old_paths:
+                os.rename(path, f"{path}.old")
+            try:
+                self.append_records(list(records))
+            except Exception:
+                for path in old_paths:
+                    os.replace(f"{path}.old", path)
+                raise
+            for path in old_paths:
+                os.remove(f"{path}.old")
+
+    def signature(self) -> Optional[tuple]:
+        return tuple((path, _file_signature(path)) for _, path, _ in self._segments(None, None))
+
+    def iter_records(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+        payer_index: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        for _, path, opener in self._segments(start_date, end_date):
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if _in_date_range(record, start_date, end_date) and _matches_indexes(
+                        record, group_index, payer_index
+                    ):
+                        yield record
+
+
+def create_backend(name: str, data_dir: Optional[str] = None) -> StorageBackend:
+    """Create the storage backend selected in config.
+
+    With ``data_dir`` the backend's files live in that directory (one tenant
+    shard) and nothing is imported from the legacy JSON file.
+    """
+    if data_dir is not None:
+        os.makedirs(data_dir, exist_ok=True)
+
+    def path(file_name: str) -> str:
+        return os.path.join(data_dir, file_name) if data_dir is not None else file_name
+
+    legacy_file_path = TRANSACTIONS_FILE if data_dir is None else None
+
+    if name == "json":
+        return JSONFileBackend(path(TRANSACTIONS_FILE))
+    if name == "journal":
+        return JournalBackend(path(TRANSACTIONS_JOURNAL_FILE), legacy_file_path=legacy_file_path)
+    if name == "sqlite":
+        return SQLiteBackend(path(TRANSACTIONS_DB_FILE), legacy_file_path=legacy_file_path)
+    if name == "partitioned":
+        return PartitionedBackend(
+            path(TRANSACTIONS_PARTITION_DIR),
+            granularity=TRANSACTIONS_PARTITION_GRANULARITY,
+            legacy_file_path=legacy_file_path,
+        )
+
+    raise ValueError(f"Unknown transactions backend: {name}")
@@ -1,5 +1,6 @@
 import logging
 from datetime import datetime
+from typing import Optional
 
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
@@ -53,7 +54,8 @@ class PaymentBot:
             # Default to today
             date_str = datetime.now().strftime("%Y-%m-%d")
 
-        summary = self.storage.get_daily_summary(date_str)
+        group_id = str(update.effective_chat.id)
+        summary = self.storage.get_daily_summary(date_str, group_id=group_id)
 
         if summary["transaction_count"] == 0:
             await update.message.reply_text(f"📊 No transactions found for {date_str}")
@@ -69,15 +71,17 @@ class PaymentBot:
 
         await update.message.reply_text(report, parse_mode="Markdown")
 
-    async def cmd_weekly_report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Generate summary report for all transactions."""
-        summary = self.storage.get_all_time_summary()
-
+    async def _send_range_report(
+        self, update: Update, title: str, summary: dict, period: Optional[str] = None
+    ):
+        """Reply with totals and the daily breakdown of a summary."""
         if summary["transaction_count"] == 0:
-            await update.message.reply_text("📊 No transactions found")
+            await update.message.reply_text(
+                f"📊 No transactions found for {period}" if period else "📊 No transactions found"
+            )
             return
 
-        report = f"📊 **All-Time Summary**\n\n"
+        report = f"📊 **{title}**\n\n"
         report += f"💰 Total Amount: ${summary['total_amount']:.2f} USD\n"
         report += f"📝 Transaction Count: {summary['transaction_count']}\n\n"
 
@@ -90,6 +94,46 @@ class PaymentBot:
 
         await update.message.reply_text(report, parse_mode="Markdown")
 
+    async def cmd_weekly_report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Generate report for the current week or the week containing a date."""
+        date_str = context.args[0] if context.args else None
+        if date_str:
+            try:
+                datetime.strptime(date_str, "%Y-%m-%d")  # Validate format
+            except ValueError:
+                await update.message.reply_text("❌ Invalid date format. Use YYYY-MM-DD")
+                return
+
+        group_id = str(update.effective_chat.id)
+        summary = self.storage.get_weekly_summary(
+            date_str, include_transactions=False, group_id=group_id
+        )
+        period = f"{summary['start_date']} to {summary['end_date']}"
+        await self._send_range_report(update, f"Weekly Report - {period}", summary, period)
+
+    async def cmd_monthly_report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Generate report for the current month or a specified month."""
+        month_str = context.args[0] if context.args else None
+        if month_str:
+            try:
+                datetime.strptime(month_str, "%Y-%m")  # Validate format
+            except ValueError:
+                await update.message.reply_text("❌ Invalid month format. Use YYYY-MM")
+                return
+
+        group_id = str(update.effective_chat.id)
+        summary = self.storage.get_monthly_summary(
+            month_str, include_transactions=False, group_id=group_id
+        )
+        period = summary["start_date"][:7]
+        await self._send_range_report(update, f"Monthly Report - {period}", summary, period)
+
+    async def cmd_summary(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Generate summary report for all transactions."""
+        group_id = str(update.effective_chat.id)
+        summary = self.storage.get_all_time_summary(include_transactions=False, group_id=group_id)
+        await self._send_range_report(update, "All-Time Summary", summary)
+
     async def cmd_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show help message with available commands."""
         help_text = """
@@ -97,6 +141,8 @@ class PaymentBot:
 
 /daily - Today's payment report
 /daily YYYY-MM-DD - Specific date report
+/weekly - This week's report (/weekly YYYY-MM-DD for another week)
+/monthly - This month's report (/monthly YYYY-MM for another month)
 /summary - All-time summary
 /help - Show this help message
 
@@ -116,7 +162,9 @@ The bot automatically tracks payments from kb_prasac_merchant_payment notificati
         # Add handlers
         self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         self.app.add_handler(CommandHandler("daily", self.cmd_daily_report))
-        self.app.add_handler(CommandHandler("summary", self.cmd_weekly_report))
+        self.app.add_handler(CommandHandler("weekly", self.cmd_weekly_report))
+        self.app.add_handler(CommandHandler("monthly", self.cmd_monthly_report))
+        self.app.add_handler(CommandHandler("summary", self.cmd_summary))
         self.app.add_handler(CommandHandler("help", self.cmd_help))
 
         logger.info("Starting Telegram Payment Bot...")
@@ -124,6 +172,9 @@ The bot automatically tracks payments from kb_prasac_merchant_payment notificati
         # Start the bot
         self.app.run_polling()
 
+        # Write out any buffered transactions before exiting
+        self.storage.close()
+
 
 if __name__ == "__main__":
     bot = PaymentBot()
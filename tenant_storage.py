@@ -0,0 +1,271 @@
+"""
+Per-Tenant Transaction Storage for Payment Bot SaaS
+Copyright (c) 2025 Sochetra. All rights reserved.
+
+This module gives every client its own TransactionStorage (journal or
+database, rollups, fingerprints and caches) in a directory of its own, so
+one merchant's reports never read or decrypt another merchant's history and
+a client can be exported or deleted without touching anyone else.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import TRANSACTION_SHARDS_DIR, TRANSACTIONS_SHARD_BY_CLIENT
+from transaction_storage import TransactionStorage
+
+logger = logging.getLogger(__name__)
+
+# Client ids are UUIDs; anything else must not be able to escape the shards directory
+CLIENT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class ShardedTransactionStorage:
+    """Routes transactions to one TransactionStorage per ``client_id``.
+
+    Transactions without a client id, and every transaction when sharding
+    is disabled, go to the shared store used before sharding existed.
+    """
+
+    def __init__(
+        self,
+        shards_dir: str = TRANSACTION_SHARDS_DIR,
+        enabled: bool = TRANSACTIONS_SHARD_BY_CLIENT,
+        shared: Optional[TransactionStorage] = None,
+    ):
+        self.shards_dir = shards_dir
+        self.enabled = enabled
+        # A process that already has the shared store open passes it in
+        self._shared: Optional[TransactionStorage] = shared
+        self._shards: Dict[str, TransactionStorage] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self) -> TransactionStorage:
+        """The store for transactions that belong to no client."""
+        with self._lock:
+            if self._shared is None:
+                self._shared = TransactionStorage()
+            return self._shared
+
+    def _shard_dir(self, client_id: str) -> str:
+        if not CLIENT_ID_PATTERN.match(str(client_id)):
+            raise ValueError(f"Invalid client id for storage shard: {client_id!r}")
+        return os.path.join(self.shards_dir, str(client_id))
+
+    def for_client(self, client_id: Optional[str]) -> TransactionStorage:
+        """Return the store holding a client's transactions."""
+        if not self.enabled or not client_id:
+            return self.shared
+
+        return self._open_shard(client_id)
+
+    def _open_shard(self, client_id: str) -> TransactionStorage:
+        shard_dir = self._shard_dir(client_id)
+        with self._lock:
+            if client_id not in self._shards:
+                self._shards[client_id] = TransactionStorage(data_dir=shard_dir)
+            return self._shards[client_id]
+
+    def stores(self) -> Dict[str, TransactionStorage]:
+        """Every store on disk by client id ("" for the shared store).
+
+        Shards are included even while sharding is disabled, so maintenance
+        such as key rotation never skips data.
+        """
+        stores = {"": self.shared}
+        for client_id in self.client_ids():
+            stores[client_id] = self._open_shard(client_id)
+        return stores
+
+    def save_transaction(self, transaction: Dict[str, Any]) -> bool:
+        """Save a transaction in the shard of its ``client_id``."""
+        return self.for_client(transaction.get("client_id")).save_transaction(transaction)
+
+    def client_ids(self) -> List[str]:
+        """List the clients that have a shard on disk."""
+        if not os.path.isdir(self.shards_dir):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.shards_dir)
+            if os.path.isdir(os.path.join(self.shards_dir, name))
+        )
+
+    def export_client(self, client_id: str, output_path: str) -> int:
+        """Write a client's decrypted transactions to a JSON file; returns the count."""
+        storage = self.for_client(client_id)
+        count = 0
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write("[")
+            # Streamed so exporting a large client does not load its history
+            for transaction in storage.iter_transactions():
+                if not self.enabled and transaction.get("client_id") != client_id:
+                    continue
+                f.write(",\n" if count else "\n")
+                json.dump(transaction, f, ensure_ascii=False)
+                count += 1
+            f.write("\n]\n")
+
+        logger.info(f"Exported {count} transactions of client {client_id} to {output_path}")
+        return count
+
+    def delete_client(self, client_id: str) -> bool:
+        """Delete every stored transaction of a client by removing its shard."""
+        shard_dir = self._shard_dir(client_id)
+        with self._lock:
+            storage = self._shards.pop(client_id, None)
+        if storage is not None:
+            storage.close()
+
+        if not os.path.isdir(shard_dir):
+            return False
+
+        shutil.rmtree(shard_dir)
+        logger.info(f"Deleted transaction shard of client {client_id}")
+        return True
+
+    def split_shared_store(self) -> Dict[str, int]:
+        """Move transactions that carry a client id from the shared store into shards.
+
+        Hot and archived records both move, archived ones into the shard's
+        archive. Stored records are copied as-is (they stay encrypted with
+        the same key); rollups, fingerprints and snapshots are rebuilt on both
+        sides.
+        """
+        if not self.enabled:
+            raise RuntimeError("Enable TRANSACTIONS_SHARD_BY_CLIENT before splitting storage")
+
+        shared = self.shared
+        shared.flush()
+
+        with shared._lock, shared.backend.lock(), shared.archive.lock():
+            by_client, remaining = self._by_client(shared.backend.iter_records())
+            archived_by_client, archived_remaining = self._by_client(shared.archive.iter_records())
+
+            moved = {}
+            for client_id in sorted(set(by_client) | set(archived_by_client)):
+                storage = self.for_client(client_id)
+                records = by_client.get(client_id, [])
+                archived = archived_by_client.get(client_id, [])
+                if shared.payers is not None and storage.payers is not None:
+                    records = [self._copy_payer(shared, storage, record) for record in records]
+                    archived = [self._copy_payer(shared, storage, record) for record in archived]
+                # Archive first, as archive_old_transactions() does
+                if archived:
+                    storage.archive.append_records(archived)
+                if records:
+                    storage.backend.append_records(records)
+                # Archived rows are counted by the snapshot too, so rebuild all of it
+                storage.rebuild_derived_data()
+                moved[client_id] = len(records) + len(archived)
+
+            if archived_by_client:
+                shared.archive.rewrite_records(archived_remaining)
+            if by_client:
+                shared.backend.rewrite_records(remaining)
+        shared.rebuild_derived_data()
+
+        logger.info(f"Moved {sum(moved.values())} transactions into {len(moved)} client shards")
+        return moved
+
+    @staticmethod
+    def _by_client(
+        records: Iterable[Dict[str, Any]],
+    ) -> Tuple[Dict[str, List[Dict[str, Any]]], List[Dict[str, Any]]]:
+        """Group stored records by client id; records without one are returned apart."""
+        by_client: Dict[str, List[Dict[str, Any]]] = {}
+        remaining = []
+        for record in records:
+            client_id = record.get("client_id")
+            if client_id:
+                by_client.setdefault(str(client_id), []).append(record)
+            else:
+                remaining.append(record)
+        return by_client, remaining
+
+    @staticmethod
+    def _copy_payer(
+        source: TransactionStorage, target: TransactionStorage, record: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Re-point a record's payer id at the target store's payer dictionary."""
+        payer_id = record.get(TransactionStorage.PAYER_ID_FIELD)
+        if payer_id is None:
+            return record
+        record = record.copy()
+        record[TransactionStorage.PAYER_ID_FIELD] = target.payers.id_for(
+            record["payer_index"], lambda: source.payers.ciphertext(payer_id)
+        )
+        return record
+
+    def archive_old_transactions(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Archive old transactions in the shared store and every shard on disk.
+
+        Returns the number archived per store ("" for the shared store).
+        """
+        return {
+            client_id: storage.archive_old_transactions(now)
+            for client_id, storage in self.stores().items()
+        }
+
+    def get_recorded_totals(self) -> Dict[str, Any]:
+        """Total amount and count over the shared store and every client shard."""
+        stores = [self.shared] + [self.for_client(c) for c in self.client_ids() if self.enabled]
+        total_amount = 0
+        transaction_count = 0
+        for storage in stores:
+            summary = storage.get_all_time_summary(include_transactions=False)
+            total_amount += summary["total_amount"]
+            transaction_count += summary["transaction_count"]
+        return {"total_amount": total_amount, "transaction_count": transaction_count}
+
+    def close(self):
+        """Flush every open store."""
+        with self._lock:
+            stores = list(self._shards.values()) + ([self._shared] if self._shared else [])
+        for storage in stores:
+            storage.close()
+
+
+def main():
+    """Manage per-client transaction shards from the command line."""
+    arg_parser = argparse.ArgumentParser(description="Manage per-client transaction shards")
+    group = arg_parser.add_mutually_exclusive_group(required=True)
+    group.add_argument(
+        "--split", action="store_true", help="move client transactions out of the shared store"
+    )
+    group.add_argument("--export", nargs=2, metavar=("CLIENT_ID", "FILE"), help="export a client")
+    group.add_argument("--delete", metavar="CLIENT_ID", help="delete a client's transactions")
+    group.add_argument(
+        "--archive", action="store_true", help="archive old transactions of every store"
+    )
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    storage = ShardedTransactionStorage()
+
+    if args.split:
+        for client_id, count in storage.split_shared_store().items():
+            print(f"{client_id}: {count} transactions")
+    elif args.export:
+        count = storage.export_client(*args.export)
+        print(f"Exported {count} transactions")
+    elif args.delete:
+        if not storage.delete_client(args.delete):
+            print(f"No transaction shard for client {args.delete}")
+            raise SystemExit(1)
+        print(f"Deleted transactions of client {args.delete}")
+    elif args.archive:
+        for client_id, count in storage.archive_old_transactions().items():
+            print(f"{client_id or 'shared'}: {count} transactions archived")
+
+
+if __name__ == "__main__":
+    main()
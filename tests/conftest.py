@@ -0,0 +1,16 @@
+"""Shared fixtures for the Payment Bot test suite."""
+
+import os
+import sys
+
+import pytest
+
+# The bot's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """Run every test in an empty directory; data and key files are cwd-relative."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
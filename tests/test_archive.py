@@ -0,0 +1,89 @@
+"""Archiving transactions out of the hot store."""
+
+from datetime import datetime
+
+import pytest
+
+import transaction_storage
+from storage_backends import ArchiveBackend
+from tenant_storage import ShardedTransactionStorage
+from transaction_storage import TransactionStorage
+
+NOW = datetime(2025, 6, 15, 12, 0)
+
+
+@pytest.fixture(autouse=True)
+def retention(monkeypatch):
+    monkeypatch.setattr(transaction_storage, "TRANSACTION_RETENTION_DAYS", 30)
+
+
+def payment(date, amount, transaction_id):
+    return {
+        "date": date,
+        "amount": amount,
+        "payer": "ALICE",
+        "source": "ABA",
+        "group_id": "-1",
+        "transaction_id": transaction_id,
+    }
+
+
+def fill(storage):
+    storage.save_transaction(payment("2025-03-02", 5, "A1"))
+    storage.save_transaction(payment("2025-04-10", 7, "A2"))
+    storage.save_transaction(payment("2025-06-14", 11, "A3"))
+    storage.flush()
+
+
+@pytest.mark.parametrize("compression", ["gzip", "lzma"])
+def test_archiving_keeps_totals_and_moves_old_records(monkeypatch, compression):
+    monkeypatch.setattr(transaction_storage, "TRANSACTION_ARCHIVE_COMPRESSION", compression)
+    storage = TransactionStorage()
+    fill(storage)
+
+    assert storage.archive_old_transactions(now=NOW) == 2
+    assert storage.archive.months() == ["2025-03", "2025-04"]
+    assert [r["date"] for r in storage.backend.iter_records()] == ["2025-06-14"]
+
+    storage.rebuild_rollups()
+    assert storage.get_all_time_summary(include_transactions=False)["total_amount"] == 23
+    assert len(storage.get_all_time_summary(include_archived=True)["transactions"]) == 3
+    # Archived payments still count as seen
+    assert not storage.save_transaction(payment("2025-03-02", 5, "A1"))
+
+
+def test_crash_before_the_hot_rewrite_is_repaired_by_the_next_run(monkeypatch):
+    storage = TransactionStorage()
+    fill(storage)
+
+    def crash(records):
+        raise OSError("disk went away")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(storage.backend, "rewrite_records", crash)
+        with pytest.raises(OSError):
+            storage.archive_old_transactions(now=NOW)
+
+    # Old records are now in both places but are only counted once
+    assert len(list(storage.archive.iter_records())) == 2
+    assert len(list(storage.backend.iter_records())) == 3
+    assert storage.rebuild_rollups() == []
+    assert storage.get_all_time_summary(include_transactions=False)["total_amount"] == 23
+
+    assert storage.archive_old_transactions(now=NOW) == 2
+    archived = list(storage.archive.iter_records())
+    assert len(archived) == 2
+    assert len({ArchiveBackend.record_key(r) for r in archived}) == 2
+    assert [r["date"] for r in storage.backend.iter_records()] == ["2025-06-14"]
+    assert storage.rebuild_rollups() == []
+
+
+def test_every_shard_is_archived():
+    sharded = ShardedTransactionStorage(shards_dir="tenants", enabled=True)
+    fill(sharded.shared)
+    fill(sharded.for_client("client-1"))
+
+    # A fresh instance has no shard open yet; the ones on disk are still archived
+    reopened = ShardedTransactionStorage(shards_dir="tenants", enabled=True)
+    assert reopened.archive_old_transactions(now=NOW) == {"": 2, "client-1": 2}
+    assert reopened.for_client("client-1").archive.months() == ["2025-03", "2025-04"]
@@ -0,0 +1,177 @@
+"""Bulk decryption pools and streamed file encryption in EncryptionManager."""
+
+import base64
+import os
+
+import pytest
+
+import encryption_manager
+from encryption_manager import EncryptionManager
+
+FIELDS = ["payer"]
+
+
+@pytest.fixture(autouse=True)
+def no_pools():
+    encryption_manager._shutdown_decrypt_pools()
+    yield
+    encryption_manager._shutdown_decrypt_pools()
+
+
+def encrypted_records(manager, count):
+    return [
+        manager.encrypt_sensitive_fields({"payer": f"PAYER {i}", "amount": i}, FIELDS)
+        for i in range(count)
+    ]
+
+
+def process_pools():
+    return {k: v for k, v in encryption_manager._decrypt_pools.items() if k[0] == "process"}
+
+
+def test_process_pool_decrypts_in_order():
+    manager = EncryptionManager(EncryptionManager.generate_random_key())
+    records = encrypted_records(manager, EncryptionManager.PARALLEL_DECRYPT_MIN_RECORDS + 10)
+
+    decrypted = manager.decrypt_many(records, FIELDS, max_workers=2)
+
+    assert [r["payer"] for r in decrypted] == [f"PAYER {i}" for i in range(len(records))]
+    (pool,) = process_pools().values()
+    # Forking the multi-threaded bot could copy a lock held by another thread
+    assert pool._mp_context.get_start_method() in ("forkserver", "spawn")
+
+
+def test_key_change_shuts_down_the_previous_process_pool():
+    first = EncryptionManager(EncryptionManager.generate_random_key())
+    second = EncryptionManager(EncryptionManager.generate_random_key())
+    count = EncryptionManager.PARALLEL_DECRYPT_MIN_RECORDS
+
+    first.decrypt_many(encrypted_records(first, count), FIELDS, max_workers=2)
+    (old_pool,) = process_pools().values()
+    decrypted = second.decrypt_many(encrypted_records(second, count), FIELDS, max_workers=2)
+
+    assert decrypted[-1]["payer"] == f"PAYER {count - 1}"
+    (new_pool,) = process_pools().values()
+    assert new_pool is not old_pool
+    assert old_pool._shutdown_thread
+
+    encryption_manager._shutdown_decrypt_pools()
+    assert encryption_manager._decrypt_pools == {}
+    assert new_pool._shutdown_thread
+
+
+@pytest.fixture
+def streamed(monkeypatch):
+    """A manager writing 16-byte frames and a helper splitting a file into its frames."""
+    monkeypatch.setattr(EncryptionManager, "FILE_CHUNK_SIZE", 16)
+    manager = EncryptionManager(EncryptionManager.generate_random_key())
+
+    def encrypt(content, name="plain.txt"):
+        with open(name, "wb") as f:
+            f.write(content)
+        assert manager.encrypt_file(name, f"{name}.encrypted")
+        with open(f"{name}.encrypted", "rb") as f:
+            data = f.read()
+
+        header_size = len(EncryptionManager.FILE_MAGIC) + 16
+        frames, position = [], header_size
+        while position < len(data):
+            (length,) = EncryptionManager.FRAME_LENGTH.unpack_from(data, position)
+            end = position + EncryptionManager.FRAME_LENGTH.size + length
+            frames.append(data[position:end])
+            position = end
+        return data[:header_size], frames
+
+    return manager, encrypt
+
+
+def decrypts(manager, data):
+    if os.path.exists("out.txt"):
+        os.remove("out.txt")
+    with open("tampered.encrypted", "wb") as f:
+        f.write(data)
+    ok = manager.decrypt_file("tampered.encrypted", "out.txt")
+    # Nothing unauthenticated is ever left under the output name
+    assert ok == os.path.exists("out.txt")
+    return ok
+
+
+CONTENT = bytes(range(256)) * 2 + b"tail"
+
+
+@pytest.mark.parametrize("content", [b"", b"x" * 16, b"x" * 32, CONTENT])
+def test_streamed_file_round_trip(streamed, content):
+    manager, encrypt = streamed
+    header, frames = encrypt(content)
+
+    assert decrypts(manager, header + b"".join(frames))
+    with open("out.txt", "rb") as f:
+        assert f.read() == content
+
+
+def test_truncated_file_is_rejected(streamed):
+    manager, encrypt = streamed
+    header, frames = encrypt(CONTENT)
+
+    assert not decrypts(manager, header + b"".join(frames[:-1]))
+    assert not decrypts(manager, header + b"".join(frames)[:-5])
+    assert not decrypts(manager, header)
+
+
+def test_reordered_or_missing_frames_are_rejected(streamed):
+    manager, encrypt = streamed
+    header, frames = encrypt(CONTENT)
+
+    swapped = frames[:1] + [frames[2], frames[1]] + frames[3:]
+    assert not decrypts(manager, header + b"".join(swapped))
+    assert not decrypts(manager, header + b"".join(frames[:1] + frames[2:]))
+
+
+def test_tampered_or_trailing_bytes_are_rejected(streamed):
+    manager, encrypt = streamed
+    header, frames = encrypt(CONTENT)
+    data = bytearray(header + b"".join(frames))
+
+    flipped = bytearray(data)
+    flipped[len(header) + 40] ^= 1
+    assert not decrypts(manager, bytes(flipped))
+    assert not decrypts(manager, bytes(data) + b"\x00")
+
+
+def test_oversized_frame_length_is_rejected_before_reading(streamed, monkeypatch):
+    manager, encrypt = streamed
+    header, frames = encrypt(CONTENT)
+    # Full frames are exactly as long as the limit allows
+    assert {len(frame) for frame in frames[:-1]} == {
+        EncryptionManager.FRAME_LENGTH.size + manager._max_frame_length()
+    }
+
+    reads = []
+    monkeypatch.setattr(manager.fernet, "decrypt", lambda token: reads.append(token))
+    hostile = EncryptionManager.FRAME_LENGTH.pack(2**32 - 1) + b"\x00" * 64
+    assert not decrypts(manager, header + hostile)
+    grown = EncryptionManager.FRAME_LENGTH.pack(manager._max_frame_length() + 16)
+    assert not decrypts(manager, header + grown + frames[0][4:] + b"\x00" * 16)
+    assert reads == []
+
+
+def test_frames_from_another_file_are_rejected(streamed):
+    manager, encrypt = streamed
+    header, frames = encrypt(CONTENT, "a.txt")
+    _, other_frames = encrypt(CONTENT, "b.txt")
+
+    spliced = frames[:2] + other_frames[2:]
+    assert not decrypts(manager, header + b"".join(spliced))
+
+
+def test_other_keys_and_the_legacy_format(streamed):
+    manager, encrypt = streamed
+    header, frames = encrypt(CONTENT)
+    stranger = EncryptionManager(EncryptionManager.generate_random_key())
+    assert not decrypts(stranger, header + b"".join(frames))
+
+    # Files written before streaming were one base64 token over the whole text
+    legacy_token = manager.fernet.encrypt(b"legacy report\n")
+    assert decrypts(manager, base64.urlsafe_b64encode(legacy_token))
+    with open("out.txt", "rb") as f:
+        assert f.read() == b"legacy report\n"
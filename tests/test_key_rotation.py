@@ -0,0 +1,137 @@
+"""Resumable whole-store key rotation."""
+
+import os
+
+import pytest
+
+from encryption_manager import EncryptionManager
+from key_rotation import KeyRotation
+from tenant_storage import ShardedTransactionStorage
+from transaction_storage import TransactionStorage
+
+
+def payment(i, date="2025-01-02"):
+    return {
+        "date": date,
+        "amount": i,
+        "payer": f"PAYER {i % 3}",
+        "source": "ABA",
+        "group_id": "-100",
+        "transaction_id": f"T{i}",
+    }
+
+
+def plain_view(storage):
+    return sorted(
+        (t["transaction_id"], t["amount"], t["payer"], t["group_id"])
+        for t in storage.iter_transactions()
+    )
+
+
+@pytest.fixture
+def storage():
+    storage = TransactionStorage()
+    for i in range(1, 8):
+        storage.save_transaction(payment(i))
+    storage.flush()
+    return storage
+
+
+def stored_under(key, storage):
+    """Whether every stored record decrypts with ``key`` alone."""
+    manager = EncryptionManager(key, [])
+    for record in storage.backend.iter_records():
+        for field in ("group_id",):
+            value = manager.decrypt_sensitive_fields(record, [field])[field]
+            if EncryptionManager.is_encrypted(value):
+                return False
+    return True
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_rotation_re_encrypts_everything_under_the_new_key(storage, monkeypatch, workers):
+    before = plain_view(storage)
+    old_key = storage.encryption_manager.encryption_key
+    new_key = EncryptionManager.generate_random_key()
+
+    # Several chunks per window, so a worker pool really shares the work
+    monkeypatch.setattr(KeyRotation, "CHUNK_SIZE", 2)
+    assert KeyRotation(workers=workers).run(new_key) == {"shared": 7}
+
+    current = EncryptionManager()
+    assert current.encryption_key == new_key
+    assert old_key in current.previous_keys
+    assert not os.path.exists(KeyRotation.STAGING_DIR)
+
+    # The instance that was open during the rotation follows the new key
+    assert plain_view(storage) == before
+    reopened = TransactionStorage()
+    assert plain_view(reopened) == before
+    assert stored_under(new_key, reopened)
+    assert reopened.rebuild_rollups() == []
+    assert reopened.get_daily_summary("2025-01-02", group_id="-100")["total_amount"] == 28
+    # Fingerprints were rebuilt under the new key, so re-deliveries are still caught
+    assert not reopened.save_transaction(payment(3))
+
+
+def test_interrupted_rotation_resumes_with_the_same_key(storage, monkeypatch):
+    before = plain_view(storage)
+    new_key = EncryptionManager.generate_random_key()
+
+    def crash(self, stores):
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as patch:
+        patch.setattr(KeyRotation, "_publish", crash)
+        with pytest.raises(KeyboardInterrupt):
+            KeyRotation().run(new_key)
+
+    # Nothing live changed yet
+    assert EncryptionManager().encryption_key != new_key
+    assert plain_view(TransactionStorage()) == before
+
+    with pytest.raises(RuntimeError, match="different key"):
+        KeyRotation().run(EncryptionManager.generate_random_key())
+
+    # Records saved while the rotation was paused are staged when it resumes
+    storage.save_transaction(payment(8))
+    storage.flush()
+    assert KeyRotation().run() == {"shared": 8}
+
+    assert EncryptionManager().encryption_key == new_key
+    reopened = TransactionStorage()
+    assert plain_view(reopened) == sorted(before + [("T8", 8, "PAYER 2", "-100")])
+    assert stored_under(new_key, reopened)
+
+
+def test_tampered_staging_fails_verification_and_leaves_the_store_alone(storage, monkeypatch):
+    before = plain_view(storage)
+    old_key = storage.encryption_manager.encryption_key
+    stage_part = KeyRotation._stage_part
+
+    def stage_and_tamper(self, client_id, store, part, read_source, staged):
+        stage_part(self, client_id, store, part, read_source, staged)
+        records = list(staged.iter_records())
+        if records:
+            records[0] = dict(records[0], amount=records[0]["amount"] + 100)
+            staged.rewrite_records(records)
+
+    monkeypatch.setattr(KeyRotation, "_stage_part", stage_and_tamper)
+    with pytest.raises(RuntimeError, match="Verification failed"):
+        KeyRotation().run()
+
+    assert EncryptionManager().encryption_key == old_key
+    assert plain_view(TransactionStorage()) == before
+
+
+def test_client_shards_are_rotated_too(storage):
+    sharded = ShardedTransactionStorage(enabled=True)
+    sharded.save_transaction(dict(payment(20), client_id="client-1"))
+    sharded.close()
+    new_key = EncryptionManager.generate_random_key()
+
+    assert KeyRotation().run(new_key) == {"shared": 7, "client-1": 1}
+
+    shard = ShardedTransactionStorage(enabled=True).for_client("client-1")
+    assert stored_under(new_key, shard)
+    assert [t["amount"] for t in shard.iter_transactions()] == [20]
@@ -0,0 +1,53 @@
+"""Upgrading a data directory written by the original single-file storage."""
+
+import base64
+import json
+
+import pytest
+
+import transaction_storage
+from encryption_manager import EncryptionManager
+from transaction_storage import TransactionStorage
+
+
+def legacy_record(manager, date, amount, payer, group_id):
+    """A record as the original storage wrote it: base64 tokens plus markers."""
+    record = {"date": date, "amount": amount, "source": "ABA"}
+    for field, value in (("payer", payer), ("group_id", group_id)):
+        token = manager._create_fernet().encrypt(value.encode("utf-8"))
+        record[field] = base64.urlsafe_b64encode(token).decode("ascii")
+        record[f"{field}_encrypted"] = True
+    return record
+
+
+@pytest.fixture
+def baseline_file():
+    manager = EncryptionManager()
+    records = [
+        # The original storage re-saved earlier records decrypted
+        {"date": "2025-01-02", "amount": 5, "payer": "ALICE", "source": "ABA", "group_id": "-100"},
+        legacy_record(manager, "2025-01-02", 7, "BOB", "-100"),
+        legacy_record(manager, "2025-01-03", 3, "CAROL", "-200"),
+    ]
+    with open("transactions.json", "w") as f:
+        json.dump(records, f, indent=2)
+
+
+@pytest.mark.parametrize("backend", ["journal", "sqlite", "partitioned", "json"])
+def test_group_totals_include_upgraded_records(baseline_file, backend, monkeypatch):
+    monkeypatch.setattr(transaction_storage, "TRANSACTIONS_BACKEND", backend)
+    storage = TransactionStorage()
+
+    daily = storage.get_daily_summary("2025-01-02", group_id="-100")
+    assert len(daily["transactions"]) == 2
+    assert daily["transaction_count"] == 2
+    assert daily["total_amount"] == 12
+
+    weekly = storage.get_weekly_summary("2025-01-02", group_id="-200")
+    assert weekly["transaction_count"] == 1
+    assert weekly["total_amount"] == 3
+    assert storage.get_all_time_summary(group_id="-100")["total_amount"] == 12
+    assert {t["payer"] for t in storage.get_transactions_by_payer("BOB")} == {"BOB"}
+
+    # Indexes were written back, so the next start has nothing left to backfill
+    assert TransactionStorage().backend.legacy_records == 0
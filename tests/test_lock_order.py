@@ -0,0 +1,59 @@
+"""Lock ordering between maintenance jobs and the write-behind flush."""
+
+import threading
+
+from transaction_storage import TransactionStorage
+
+
+def payment(i):
+    return {
+        "date": "2025-01-02",
+        "amount": 1,
+        "payer": f"PAYER {i}",
+        "source": "ABA",
+        "group_id": "-1",
+        "transaction_id": f"T{i}",
+    }
+
+
+def test_reindex_does_not_deadlock_with_a_timer_flush():
+    storage = TransactionStorage(flush_max_records=1000, flush_interval_ms=0)
+    storage.save_transaction(payment(0))
+    storage.flush()
+    # A record stored before group indexes existed, so reindex has work to do
+    storage.backend.rewrite_records(
+        [
+            {k: v for k, v in r.items() if k != "group_id_index"}
+            for r in storage.backend.iter_records()
+        ]
+    )
+
+    reindexing = threading.Event()
+    flushing = threading.Event()
+    reindex_records, write_records = storage._reindex, storage._write_records
+
+    def paused_reindex():
+        # Give a flush the chance to start while reindex is running
+        reindexing.set()
+        flushing.wait(1)
+        return reindex_records()
+
+    def paused_write(pending):
+        flushing.set()
+        return write_records(pending)
+
+    storage._reindex = paused_reindex
+    storage._write_records = paused_write
+
+    maintenance = threading.Thread(target=storage.reindex, daemon=True)
+    maintenance.start()
+    assert reindexing.wait(5)
+    storage.save_transaction(payment(1))
+    # Stands in for the flush timer firing mid-reindex
+    timer = threading.Thread(target=storage.flush, daemon=True)
+    timer.start()
+
+    maintenance.join(10)
+    timer.join(10)
+    assert not maintenance.is_alive() and not timer.is_alive(), "reindex deadlocked with flush"
+    assert storage.get_daily_summary("2025-01-02")["transaction_count"] == 2
@@ -0,0 +1,65 @@
+"""Encrypted payer dictionary shared between storage instances."""
+
+from payer_dictionary import PayerDictionary
+
+
+def reverse(text):
+    # Stands in for decryption; stored "ciphertexts" are reversed names
+    return text[::-1]
+
+
+def add(dictionary, name):
+    return dictionary.id_for(f"idx-{name}", lambda: reverse(name))
+
+
+def test_ids_are_assigned_once_and_shared():
+    writer = PayerDictionary("payers.jsonl", reverse)
+    reader = PayerDictionary("payers.jsonl", reverse)
+
+    assert add(writer, "ALICE") == 1
+    assert add(writer, "BOB") == 2
+    assert add(writer, "ALICE") == 1
+
+    # Entries appended by another instance are picked up on demand
+    assert reader.lookup(2) == "BOB"
+    assert add(reader, "BOB") == 2
+    assert add(reader, "CAROL") == 3
+    assert writer.lookup(3) == "CAROL"
+    assert writer.ciphertext(3) == "LORAC"
+
+
+def test_unknown_id_and_undecryptable_entry():
+    def failing(text):
+        raise ValueError("wrong key")
+
+    add(PayerDictionary("payers.jsonl", reverse), "ALICE")
+    assert PayerDictionary("payers.jsonl", reverse).lookup(9) is None
+    # Like inline fields, an entry that can't be decrypted is shown as stored
+    assert PayerDictionary("payers.jsonl", failing).lookup(1) == "ECILA"
+
+
+def test_replaced_file_invalidates_memoised_names_in_other_instances():
+    live = PayerDictionary("payers.jsonl", reverse)
+    other_process = PayerDictionary("payers.jsonl", reverse)
+    add(live, "ALICE")
+    add(live, "BOB")
+    assert other_process.lookup(1) == "ALICE"
+    assert other_process.lookup(2) == "BOB"
+
+    # A key rotation stages a dictionary with the ids in a different order
+    staged = PayerDictionary("staged.jsonl", reverse)
+    add(staged, "BOB")
+    add(staged, "ALICE")
+    live.replace_with(staged)
+
+    assert other_process.lookup(1) == "BOB"
+    assert other_process.lookup(2) == "ALICE"
+    assert live.lookup(1) == "BOB"
+
+
+def test_reload_forgets_everything():
+    dictionary = PayerDictionary("payers.jsonl", reverse)
+    add(dictionary, "ALICE")
+    dictionary.reload()
+    assert dictionary.ids == {"idx-ALICE": 1}
+    assert dictionary.lookup(1) == "ALICE"
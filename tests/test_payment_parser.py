@@ -0,0 +1,139 @@
+"""Message metadata, pattern caching and pre-filtering in PaymentParser."""
+
+import html
+import random
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from group_settings import GroupSettingsManager
+from payment_parser import PaymentParser
+from security_validator import SecurityValidator
+
+SENT = datetime(2025, 1, 2, 9, 30)
+FORWARDED = datetime(2025, 1, 5, 18, 0)
+
+
+def test_send_time_of_a_plain_message():
+    message = SimpleNamespace(date=SENT, forward_origin=None)
+    assert PaymentParser.original_send_time(message) == SENT
+
+
+def test_send_time_looks_through_forward_origin():
+    message = SimpleNamespace(date=FORWARDED, forward_origin=SimpleNamespace(date=SENT))
+    assert PaymentParser.original_send_time(message) == SENT
+
+
+def test_send_time_falls_back_to_forward_date_on_older_clients():
+    assert (
+        PaymentParser.original_send_time(SimpleNamespace(date=FORWARDED, forward_date=SENT)) == SENT
+    )
+    assert PaymentParser.original_send_time(SimpleNamespace(date=SENT, forward_date=None)) == SENT
+
+
+@pytest.fixture
+def validations(monkeypatch):
+    """Count how often pattern pairs are validated (and so compiled)."""
+    calls = []
+    validate = SecurityValidator.validate_regex_pattern
+
+    def counting(pattern, pattern_type):
+        calls.append(pattern)
+        return validate(pattern, pattern_type)
+
+    monkeypatch.setattr(SecurityValidator, "validate_regex_pattern", counting)
+    return calls
+
+
+def test_compiled_patterns_are_reused_until_the_config_version_changes(validations):
+    parser = PaymentParser()
+    settings = GroupSettingsManager()
+    settings.set_custom_patterns("-501", r"PAYIN\s+([\d.]+)", r"From:\s*(\w+)", "PAYIN")
+
+    assert parser.parse_payment("PAYIN 5 From: ALICE", "-501")["amount"] == 5
+    assert parser.parse_payment("PAYIN 6 From: BOB", "-501")["amount"] == 6
+    assert len(validations) == 2
+
+    # Another process reconfigures the group; only the settings file changes
+    GroupSettingsManager().set_custom_patterns(
+        "-501", r"PAYIN\s+USD\s*([\d.]+)", r"By:\s*(\w+)", "PAYIN"
+    )
+    transaction = parser.parse_payment("PAYIN USD 7 By: CAROL", "-501")
+    assert (transaction["amount"], transaction["payer"]) == (7, "CAROL")
+    assert parser.parse_payment("PAYIN 8 From: DAN", "-501") is None
+    assert len(validations) == 4
+
+    # A new version with the same pattern text is validated again, once
+    settings.set_payment_source("-501", "wing_money")
+    settings.set_custom_patterns("-501", r"PAYIN\s+USD\s*([\d.]+)", r"By:\s*(\w+)", "PAYIN")
+    assert parser.parse_payment("PAYIN USD 9 By: ERIN", "-501")
+    assert parser.parse_payment("PAYIN USD 10 By: FRANK", "-501")
+    assert len(validations) == 6
+
+
+def test_invalid_patterns_are_rejected_once_and_replaced_on_reconfiguration(validations, caplog):
+    parser = PaymentParser()
+    settings = GroupSettingsManager()
+    settings.set_custom_patterns("-502", r"PAYIN\s+([\d.]+),", r"From:\s*(\w+)", "PAYIN")
+
+    assert parser.parse_payment("PAYIN 4, From: ALICE", "-502") is None
+    assert parser.parse_payment("PAYIN 4, From: ALICE", "-502") is None
+    assert len(validations) == 2
+    assert caplog.text.count("Invalid regex patterns detected for group -502") == 1
+
+    settings.set_custom_patterns("-502", r"PAYIN\s+([\d.]+)", r"From:\s*(\w+)", "PAYIN")
+    transaction = parser.parse_payment("PAYIN 9.5 From: ALICE", "-502")
+    assert (transaction["amount"], transaction["payer"]) == (9.5, "ALICE")
+
+
+CUSTOM_IDENTIFIERS = {
+    "-601": "Paid &amp; Settled",
+    "-602": "Don&#x27;t (tip) $5+",
+    "-603": "ការទូទាត់ បានទទួល",
+    "-604": "Multi word ID",
+}
+WHITESPACE = [" ", "  ", "\n", "\t ", "\u00a0", "\r\n"]
+NOISE = ["", "hello ", "<b>", "&", "'", '"', "\x00", "Amount: 5 USD ", "PAYIN"]
+
+
+def spaced(rng, text):
+    """Re-space text and sprinkle null bytes the way sanitization would ignore."""
+    words = text.split()
+    joined = "".join(word + rng.choice(WHITESPACE) for word in words).rstrip()
+    if rng.random() < 0.3 and joined:
+        position = rng.randrange(len(joined))
+        joined = joined[:position] + "\x00" + joined[position:]
+    return joined
+
+
+def test_pre_filter_never_rejects_a_message_the_classifier_accepts():
+    rng = random.Random(2025)
+    settings = GroupSettingsManager()
+    for group_id, identifier in CUSTOM_IDENTIFIERS.items():
+        settings.set_custom_patterns(group_id, r"([\d.]+)", r"From:\s*(\w+)", identifier)
+    groups = list(CUSTOM_IDENTIFIERS) + ["-600"]
+    for source in ("aba_bank", "wing_money", "acleda_bank"):
+        groups.append(f"-6{len(groups):02d}")
+        settings.set_payment_source(groups[-1], source)
+
+    identifiers = list(CUSTOM_IDENTIFIERS.values()) + [
+        source["identifier"] for source in settings.get_available_sources().values()
+    ]
+    fragments = identifiers + [html.unescape(i) for i in identifiers]
+
+    parser = PaymentParser()
+    accepted = dict.fromkeys(groups, 0)
+    for _ in range(1500):
+        parts = [rng.choice(NOISE), spaced(rng, rng.choice(fragments)), rng.choice(NOISE)]
+        message = "".join(parts)
+        candidate = parser._is_candidate(message)
+        for group_id in groups:
+            # is_payment_message() itself pre-filters, so classify without it
+            context = parser._message_context(message, group_id)
+            if context is not None and parser._is_payment(context):
+                accepted[group_id] += 1
+                assert candidate, (message, group_id)
+
+    # Every group accepted some messages, so the check is not vacuous
+    assert min(accepted.values()) > 0
@@ -0,0 +1,72 @@
+"""Weekly and monthly summaries over the date-ordered indexes."""
+
+import pytest
+
+from transaction_storage import TransactionStorage
+
+DATES = [
+    "2024-01-31",
+    "2024-02-01",
+    "2024-02-04",  # Sunday
+    "2024-02-05",  # Monday
+    "2024-02-11",  # Sunday
+    "2024-02-12",  # Monday
+    "2024-02-29",  # leap day
+    "2024-03-01",
+    "2024-12-31",
+    "2025-01-01",
+]
+
+
+@pytest.fixture
+def storage():
+    storage = TransactionStorage()
+    storage.save_transactions(
+        {"date": date, "amount": 2**i, "payer": "ALICE", "source": "ABA", "group_id": "-1"}
+        for i, date in enumerate(DATES)
+    )
+    return storage
+
+
+def dates(summary):
+    return [t["date"] for t in summary["transactions"]]
+
+
+@pytest.mark.parametrize("day", ["2024-02-05", "2024-02-08", "2024-02-11"])
+def test_week_runs_monday_to_sunday_inclusive(storage, day):
+    summary = storage.get_weekly_summary(day)
+
+    assert (summary["start_date"], summary["end_date"]) == ("2024-02-05", "2024-02-11")
+    assert dates(summary) == ["2024-02-05", "2024-02-11"]
+    assert summary["total_amount"] == 8 + 16
+    assert summary["daily_totals"] == {"2024-02-05": 8, "2024-02-11": 16}
+
+
+def test_week_spanning_two_years(storage):
+    summary = storage.get_weekly_summary("2025-01-01")
+
+    assert (summary["start_date"], summary["end_date"]) == ("2024-12-30", "2025-01-05")
+    assert dates(summary) == ["2024-12-31", "2025-01-01"]
+
+
+@pytest.mark.parametrize(
+    "month, first, last, expected",
+    [
+        ("2024-01", "2024-01-01", "2024-01-31", ["2024-01-31"]),
+        (
+            "2024-02",
+            "2024-02-01",
+            "2024-02-29",
+            ["2024-02-01", "2024-02-04", "2024-02-05", "2024-02-11", "2024-02-12", "2024-02-29"],
+        ),
+        ("2024-12", "2024-12-01", "2024-12-31", ["2024-12-31"]),
+        ("2025-02", "2025-02-01", "2025-02-28", []),
+    ],
+)
+def test_month_covers_its_first_to_last_day(storage, month, first, last, expected):
+    summary = storage.get_monthly_summary(month, group_id="-1")
+
+    assert (summary["start_date"], summary["end_date"]) == (first, last)
+    assert dates(summary) == expected
+    assert summary["transaction_count"] == len(expected)
+    assert summary["total_amount"] == sum(2 ** DATES.index(date) for date in expected)
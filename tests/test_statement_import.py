@@ -0,0 +1,88 @@
+"""Backfilling history from CSV and JSON bank statements."""
+
+import json
+
+import pytest
+
+from statement_import import import_statement, read_statement
+from tenant_storage import ShardedTransactionStorage
+
+CSV = """Date,Time,Amount,Payer,Reference
+2025-01-02,09:15,"USD 1,234.50",ALICE SMITH,TRX-1
+2025-01-02,10:00,12.00,BOB <script>,
+03/01/2025,,5.00,CAROL,
+03/01/2025,,5.00,CAROL,
+"""
+
+
+def write(name, content):
+    with open(name, "w", encoding="utf-8") as f:
+        f.write(content)
+    return name
+
+
+def test_rows_become_parser_style_transactions():
+    transactions = list(read_statement(write("statement.csv", CSV), "-100", source="ABA"))
+
+    assert [(t["date"], t["amount"]) for t in transactions] == [
+        ("2025-01-02", 1234.5),
+        ("2025-01-02", 12.0),
+        ("2025-01-03", 5.0),
+        ("2025-01-03", 5.0),
+    ]
+    first = transactions[0]
+    assert first["transaction_id"] == "TRX-1"
+    assert first["source"] == "ABA" and first["group_id"] == "-100"
+    assert transactions[1]["message_time"] == "2025-01-02T10:00:00"
+    # Payers are sanitized the way the message parser does it
+    assert "<" not in transactions[1]["payer"]
+    # Same-day identical rows are numbered rather than collapsed
+    assert [t["statement_row"] for t in transactions[2:]] == [1, 2]
+
+
+def test_ambiguous_amounts_are_skipped_not_misread():
+    statement = write(
+        "statement.csv",
+        "Date,Amount,Payer\n"
+        '2025-01-02,"1.234,56",A\n'
+        "2025-01-02,12.345,B\n"
+        '2025-01-02,"1,23",C\n',
+    )
+    assert list(read_statement(statement, "-100")) == []
+
+
+def test_comma_decimal_separator():
+    statement = write(
+        "statement.json",
+        json.dumps(
+            [
+                {"date": "2025-01-02", "amount": "1.234,56 €", "payer": "A"},
+                {"date": "2025-01-02", "amount": "7,5", "payer": "B"},
+                {"date": "2025-01-02", "amount": "1,234.56", "payer": "C"},
+            ]
+        ),
+    )
+    amounts = [t["amount"] for t in read_statement(statement, "-100", decimal_separator=",")]
+    assert amounts == [1234.56, 7.5]
+
+    with pytest.raises(ValueError):
+        list(read_statement(statement, "-100", decimal_separator=";"))
+
+
+def test_reimporting_a_statement_saves_nothing_new():
+    storage = ShardedTransactionStorage()
+    statement = write("statement.csv", CSV)
+
+    first = import_statement(statement, "-100", storage=storage)
+    again = import_statement(statement, "-100", storage=storage)
+
+    assert first["saved"] == 4
+    assert again["saved"] == 0 and again["duplicates"] == 4
+    summary = storage.shared.get_all_time_summary(include_transactions=False, group_id="-100")
+    assert summary["transaction_count"] == 4
+    assert summary["total_amount"] == pytest.approx(1256.5)
+
+
+def test_missing_columns_are_reported():
+    with pytest.raises(ValueError, match="payer"):
+        list(read_statement(write("statement.csv", "Date,Amount\n2025-01-02,5\n"), "-100"))
@@ -0,0 +1,112 @@
+"""On-disk transaction backends."""
+
+import json
+import os
+
+import pytest
+
+from storage_backends import JournalBackend, PartitionedBackend, SQLiteBackend
+
+RECORDS = [
+    {"date": "2025-01-30", "amount": 5, "group_id_index": "g1", "payer_index": "p1"},
+    {"date": "2025-02-01", "amount": 7, "group_id_index": "g2", "payer_index": "p1"},
+    {"date": "2025-02-03", "amount": 11, "group_id_index": "g1", "payer_index": "p2"},
+]
+
+BACKENDS = {
+    "journal": lambda legacy=None: JournalBackend("transactions.jsonl", legacy),
+    "sqlite": lambda legacy=None: SQLiteBackend("transactions.db", legacy),
+    "partitioned": lambda legacy=None: PartitionedBackend("transactions", "month", legacy),
+}
+
+
+@pytest.fixture(params=sorted(BACKENDS))
+def make_backend(request):
+    return BACKENDS[request.param]
+
+
+def amounts(records):
+    return sorted(record["amount"] for record in records)
+
+
+def test_append_and_filtered_reads(make_backend):
+    backend = make_backend()
+    backend.append_records(RECORDS[:2])
+    backend.append_records(RECORDS[2:])
+
+    assert amounts(backend.iter_records()) == [5, 7, 11]
+    assert amounts(backend.iter_records("2025-02-01", "2025-02-28")) == [7, 11]
+    assert amounts(backend.iter_records(group_index="g1")) == [5, 11]
+    assert amounts(backend.iter_records(payer_index="p1")) == [5, 7]
+    assert backend.summarize("2025-01-01", "2025-02-02") == {
+        "total_amount": 12,
+        "transaction_count": 2,
+    }
+    assert backend.summarize(group_index="g1")["total_amount"] == 16
+    assert backend.daily_totals(group_index="g1") == {"2025-01-30": 5, "2025-02-03": 11}
+
+
+def test_signature_tracks_appends_and_rewrites(make_backend):
+    backend = make_backend()
+    backend.append_records(RECORDS[:1])
+    before = backend.signature()
+
+    backend.append_records(RECORDS[1:])
+    after = backend.signature()
+    assert after != before
+    appended = backend.changes_since(before, after)
+    # Backends that can't tell return None and callers rebuild
+    assert appended is None or amounts(appended) == [7, 11]
+
+    backend.rewrite_records(RECORDS[2:])
+    assert amounts(backend.iter_records()) == [11]
+    assert backend.signature() != after
+    assert backend.changes_since(after, backend.signature()) is None
+
+
+def test_reopening_keeps_records(make_backend):
+    make_backend().append_records(RECORDS)
+    assert amounts(make_backend().iter_records()) == [5, 7, 11]
+
+
+def test_legacy_json_file_is_imported_once(make_backend):
+    legacy = [{"date": "2025-01-02", "amount": 3, "group_id": "-1", "payer": "A"}]
+    with open("transactions.json", "w") as f:
+        json.dump(legacy, f)
+
+    backend = make_backend("transactions.json")
+    assert list(backend.iter_records()) == legacy
+    assert backend.legacy_records == 1
+
+    reopened = make_backend("transactions.json")
+    assert list(reopened.iter_records()) == legacy
+    assert reopened.legacy_records == 0
+
+
+def test_journal_recovers_from_a_torn_last_line():
+    journal = JournalBackend("transactions.jsonl")
+    journal.append_records(RECORDS[:1])
+    with open("transactions.jsonl", "a") as f:
+        f.write('{"seq": 2, "record": {"date": "2025-')
+
+    reopened = JournalBackend("transactions.jsonl")
+    assert reopened.last_seq == 1
+    reopened.append_records(RECORDS[1:2])
+
+    assert amounts(reopened.iter_records()) == [5, 7]
+    with open("transactions.jsonl") as f:
+        assert json.loads(f.readlines()[-1])["seq"] == 2
+
+
+def test_partitions_are_only_read_for_overlapping_ranges():
+    backend = PartitionedBackend("transactions", "month")
+    backend.append_records(RECORDS + [{"amount": 1}])
+
+    assert sorted(n for n in os.listdir("transactions") if n.endswith(".jsonl")) == [
+        "2025-01.jsonl",
+        "2025-02.jsonl",
+        "undated.jsonl",
+    ]
+    assert amounts(backend.iter_records("2025-01-01", "2025-01-31")) == [5]
+    # Undated records only show up in unbounded scans
+    assert amounts(backend.iter_records()) == [1, 5, 7, 11]
@@ -0,0 +1,140 @@
+"""Per-client transaction shards."""
+
+import json
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+import transaction_rollups
+import transaction_storage
+from tenant_storage import ShardedTransactionStorage
+
+
+def payment(i, client_id=None, payer="ALICE"):
+    transaction = {
+        "date": "2025-01-02",
+        "amount": i,
+        "payer": payer,
+        "source": "ABA",
+        "group_id": "-100",
+        "transaction_id": f"T{i}",
+    }
+    if client_id:
+        transaction["client_id"] = client_id
+    return transaction
+
+
+def amounts(storage):
+    return sorted(t["amount"] for t in storage.iter_transactions())
+
+
+def test_transactions_are_routed_by_client():
+    sharded = ShardedTransactionStorage(enabled=True)
+    sharded.save_transaction(payment(1, "client-1"))
+    sharded.save_transaction(payment(2, "client-2"))
+    sharded.save_transaction(payment(3))
+    sharded.close()
+
+    reopened = ShardedTransactionStorage(enabled=True)
+    assert reopened.client_ids() == ["client-1", "client-2"]
+    assert amounts(reopened.for_client("client-1")) == [1]
+    assert amounts(reopened.shared) == [3]
+    assert reopened.get_recorded_totals() == {"total_amount": 6, "transaction_count": 3}
+
+    # With sharding off everything is read from and written to the shared store
+    unsharded = ShardedTransactionStorage(enabled=False)
+    assert unsharded.for_client("client-1") is unsharded.shared
+    with pytest.raises(ValueError):
+        reopened.for_client("../escape")
+
+
+def test_split_moves_client_transactions_out_of_the_shared_store():
+    unsharded = ShardedTransactionStorage(enabled=False)
+    unsharded.save_transaction(payment(1, "client-1", payer="BOB"))
+    unsharded.save_transaction(payment(2, "client-1"))
+    unsharded.save_transaction(payment(3, "client-2"))
+    unsharded.save_transaction(payment(4))
+    unsharded.close()
+
+    sharded = ShardedTransactionStorage(enabled=True)
+    assert sharded.split_shared_store() == {"client-1": 2, "client-2": 1}
+
+    assert amounts(sharded.shared) == [4]
+    client = sharded.for_client("client-1")
+    assert sorted(t["payer"] for t in client.iter_transactions()) == ["ALICE", "BOB"]
+    # Rollups and the duplicate index moved with the records
+    assert client.rebuild_rollups() == []
+    assert sharded.shared.rebuild_rollups() == []
+    assert client.get_daily_summary("2025-01-02")["total_amount"] == 3
+    assert not client.save_transaction(payment(1, "client-1", payer="BOB"))
+
+    with pytest.raises(RuntimeError):
+        ShardedTransactionStorage(enabled=False).split_shared_store()
+
+
+def test_split_moves_archived_history_too(monkeypatch):
+    monkeypatch.setattr(transaction_storage, "TRANSACTION_RETENTION_DAYS", 30)
+    unsharded = ShardedTransactionStorage(enabled=False)
+    unsharded.save_transaction(payment(1, "client-1"))
+    unsharded.save_transaction(payment(2))
+    unsharded.save_transaction(dict(payment(4, "client-1"), date="2025-03-01"))
+    assert unsharded.archive_old_transactions(datetime(2025, 3, 2)) == {"": 2}
+    unsharded.close()
+
+    sharded = ShardedTransactionStorage(enabled=True)
+    assert sharded.split_shared_store() == {"client-1": 2}
+
+    client = sharded.for_client("client-1")
+    assert client.archive.months() == ["2025-01"]
+    assert amounts(client) == [4]
+    archived = client.get_transactions_by_date("2025-01-02", include_archived=True)
+    assert [t["amount"] for t in archived] == [1]
+    assert client.get_all_time_summary(include_transactions=False)["total_amount"] == 5
+
+    shared = sharded.shared
+    assert [t["amount"] for t in shared.archive.iter_records()] == [2]
+    assert shared.get_all_time_summary(include_transactions=False)["total_amount"] == 2
+    assert shared.get_daily_summary("2025-01-02")["total_amount"] == 2
+    assert sharded.get_recorded_totals() == {"total_amount": 7, "transaction_count": 3}
+
+
+def test_rollup_cli_rebuilds_every_shard(monkeypatch, capsys):
+    sharded = ShardedTransactionStorage(enabled=True)
+    sharded.save_transaction(payment(1, "client-1"))
+    sharded.save_transaction(payment(2))
+    client = sharded.for_client("client-1")
+    for buckets in client.rollups.rollups.values():
+        for bucket in buckets.values():
+            bucket["total_amount"] += 100
+    client.rollups.save()
+
+    monkeypatch.setattr(sys, "argv", ["transaction_rollups.py", "--verify"])
+    with pytest.raises(SystemExit):
+        transaction_rollups.main()
+    output = capsys.readouterr().out
+    assert "Rollups rebuilt for shared (0 mismatching rows)" in output
+    assert "Rollups rebuilt for client-1 (1 mismatching rows)" in output
+
+    reopened = ShardedTransactionStorage(enabled=True).for_client("client-1")
+    assert reopened.get_daily_summary("2025-01-02")["total_amount"] == 1
+
+
+def test_export_and_delete_one_client():
+    sharded = ShardedTransactionStorage(enabled=True)
+    sharded.save_transaction(payment(1, "client-1"))
+    sharded.save_transaction(payment(2, "client-1"))
+    sharded.save_transaction(payment(3, "client-2"))
+
+    assert sharded.export_client("client-1", "export.json") == 2
+    with open("export.json", encoding="utf-8") as f:
+        exported = json.load(f)
+    assert sorted(t["amount"] for t in exported) == [1, 2]
+    assert {t["payer"] for t in exported} == {"ALICE"}
+
+    assert sharded.delete_client("client-1")
+    assert not os.path.exists(os.path.join("tenants", "client-1"))
+    assert sharded.client_ids() == ["client-2"]
+    assert not sharded.delete_client("client-1")
+    assert amounts(sharded.for_client("client-2")) == [3]
@@ -0,0 +1,58 @@
+"""Decrypted transaction cache behaviour seen through TransactionStorage."""
+
+import transaction_storage
+from transaction_storage import TransactionStorage
+
+
+def test_returned_transactions_do_not_alias_the_cache():
+    storage = TransactionStorage()
+    storage.save_transaction(
+        {"date": "2025-01-02", "amount": 5, "payer": "ALICE", "source": "ABA", "group_id": "-1"}
+    )
+
+    first = storage.get_transactions_by_date("2025-01-02")
+    first[0]["payer"] = "MALLORY"
+    first[0]["formatted"] = "$5.00"
+    next(storage.iter_transactions())["amount"] = 0
+
+    again = storage.get_transactions_by_date("2025-01-02")
+    assert again == [
+        {"date": "2025-01-02", "amount": 5, "payer": "ALICE", "source": "ABA", "group_id": "-1"}
+    ]
+
+
+def test_filtered_queries_use_the_blind_indexes_instead_of_growing_the_cache(monkeypatch):
+    monkeypatch.setattr(transaction_storage, "TRANSACTION_CACHE_MAX_RECORDS", 4)
+    storage = TransactionStorage()
+    storage.save_transactions(
+        {
+            "date": f"2025-01-{day:02d}",
+            "amount": day,
+            "payer": "ALICE" if day % 2 else "BOB",
+            "source": "ABA",
+            "group_id": "-1",
+        }
+        for day in range(1, 11)
+    )
+    storage.get_transactions_by_date("2025-01-10")
+    low_water = storage.cache.low_water
+
+    decrypted = []
+    decrypt = storage._decrypt_transactions
+
+    def counting(records):
+        for transaction in decrypt(records):
+            decrypted.append(transaction)
+            yield transaction
+
+    monkeypatch.setattr(storage, "_decrypt_transactions", counting)
+    for _ in range(2):
+        payments = storage.get_transactions_by_payer("ALICE")
+        assert [t["amount"] for t in payments] == [1, 3, 5, 7, 9]
+    assert len(decrypted) == 10
+    assert storage.cache.low_water == low_water
+
+    # Ranges the cache already holds are still served from it
+    decrypted.clear()
+    assert storage.get_transactions_between("2025-01-10", "2025-01-10", group_id="-1")
+    assert decrypted == []
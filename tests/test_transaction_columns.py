@@ -0,0 +1,66 @@
+"""Columnar snapshot maintenance in TransactionStorage."""
+
+from storage_backends import JournalBackend
+from transaction_storage import TransactionStorage
+
+
+def payment(date, amount, source="ABA"):
+    return {"date": date, "amount": amount, "payer": "ALICE", "source": source, "group_id": "-1"}
+
+
+def test_writes_do_not_build_the_snapshot_until_queried():
+    storage = TransactionStorage()
+    storage.save_transaction(payment("2025-01-02", 5))
+    assert storage.columns.signature is None
+
+    assert storage.get_source_totals() == {"ABA": 5}
+    assert storage.columns.signature is not None
+
+    # Once built, later writes keep it current without a rebuild
+    storage.save_transaction(payment("2025-01-03", 7, source="ACLEDA"))
+    assert len(storage.columns) == 2
+    assert storage.columns.signature == storage.backend.signature()
+    assert storage.get_source_totals() == {"ABA": 5, "ACLEDA": 7}
+
+
+def test_startup_loads_the_snapshot_and_replays_only_the_journal_tail(monkeypatch):
+    storage = TransactionStorage()
+    storage.save_transactions([payment("2025-01-02", 1), payment("2025-01-03", 2)])
+    storage.get_source_totals()
+    storage.close()
+
+    # Another worker appends after the snapshot was written
+    TransactionStorage().save_transactions(
+        [payment("2025-01-04", 4, source="ACLEDA"), payment("2025-01-05", 8)]
+    )
+
+    replayed = []
+    changes_since = JournalBackend.changes_since
+
+    def spy(self, old, new):
+        records = changes_since(self, old, new)
+        replayed.append(len(records))
+        return records
+
+    def no_full_scan(self):
+        raise AssertionError("startup rebuilt the snapshot from the whole history")
+
+    monkeypatch.setattr(JournalBackend, "changes_since", spy)
+    monkeypatch.setattr(TransactionStorage, "_all_records", no_full_scan)
+    reopened = TransactionStorage()
+
+    assert replayed == [2]
+    assert len(reopened.columns) == 4
+    assert reopened.get_source_totals() == {"ABA": 11, "ACLEDA": 4}
+
+
+def test_snapshot_of_a_rewritten_store_is_rebuilt():
+    storage = TransactionStorage()
+    storage.save_transactions([payment("2025-01-02", 1), payment("2025-01-03", 2)])
+    storage.get_source_totals()
+    storage.close()
+
+    records = list(storage.backend.iter_records())
+    storage.backend.rewrite_records(records[1:])
+
+    assert TransactionStorage().get_source_totals() == {"ABA": 2}
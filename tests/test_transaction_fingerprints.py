@@ -0,0 +1,76 @@
+"""Duplicate payment rejection through the fingerprint index."""
+
+import os
+
+import pytest
+
+from transaction_storage import TransactionStorage
+
+
+def payment(amount=5, **fields):
+    return {
+        "date": "2025-01-02",
+        "amount": amount,
+        "payer": "ALICE",
+        "source": "ABA",
+        "group_id": "-1",
+        **fields,
+    }
+
+
+@pytest.mark.parametrize(
+    "first, repeat, distinct",
+    [
+        (
+            payment(transaction_id="T1"),
+            payment(amount=6, transaction_id="T1"),
+            payment(transaction_id="T1", group_id="-2"),
+        ),
+        (
+            payment(message_time="2025-01-02T10:00:00"),
+            payment(message_time="2025-01-02T10:00:00"),
+            payment(message_time="2025-01-02T10:00:01"),
+        ),
+        (
+            payment(statement_row=1),
+            payment(statement_row=1),
+            payment(statement_row=2),
+        ),
+    ],
+    ids=["transaction_id", "message_time", "statement_row"],
+)
+def test_repeated_payments_are_rejected(first, repeat, distinct):
+    storage = TransactionStorage()
+    assert storage.save_transaction(first)
+    assert not storage.save_transaction(repeat)
+    assert storage.save_transaction(distinct)
+
+    # Other instances (worker processes) share the index
+    assert not TransactionStorage().save_transaction(repeat)
+    assert storage.save_transactions([first, distinct])["duplicates"] == 2
+    assert storage.get_daily_summary("2025-01-02")["transaction_count"] == 2
+
+
+def test_payments_without_an_identifier_are_never_deduplicated():
+    storage = TransactionStorage()
+    assert storage.save_transaction(payment())
+    assert storage.save_transaction(payment())
+    assert storage.get_daily_summary("2025-01-02")["transaction_count"] == 2
+
+
+def test_duplicates_within_a_batch_or_the_write_buffer_are_dropped():
+    storage = TransactionStorage(flush_max_records=100)
+    assert storage.save_transaction(payment(transaction_id="T1"))
+    assert not storage.save_transaction(payment(transaction_id="T1"))
+
+    counts = storage.save_transactions([payment(transaction_id="T2")] * 2)
+    assert counts == {"saved": 1, "duplicates": 1, "invalid": 0}
+    assert storage.get_daily_summary("2025-01-02")["transaction_count"] == 2
+
+
+def test_lost_index_is_rebuilt_from_stored_fingerprints():
+    storage = TransactionStorage()
+    storage.save_transaction(payment(transaction_id="T1"))
+    os.remove(storage.fingerprints.file_path)
+
+    assert not TransactionStorage().save_transaction(payment(transaction_id="T1"))
@@ -0,0 +1,115 @@
+"""Rollup verification and blind-index backfill."""
+
+import json
+import os
+import sys
+
+import pytest
+
+import transaction_rollups
+from transaction_storage import TransactionStorage
+
+
+def payment(i, date="2025-01-02", group_id="-100"):
+    return {
+        "date": date,
+        "amount": i,
+        "payer": "ALICE",
+        "source": "ABA",
+        "group_id": group_id,
+        "transaction_id": f"T{i}",
+    }
+
+
+@pytest.fixture
+def storage():
+    storage = TransactionStorage()
+    storage.save_transactions(
+        [payment(1), payment(2), payment(4, "2025-01-03"), payment(8, group_id="-200")]
+    )
+    return storage
+
+
+def run_cli(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["transaction_rollups.py", *args])
+    transaction_rollups.main()
+
+
+def test_incremental_rollups_match_raw_storage(storage):
+    assert storage.rebuild_rollups() == []
+    assert storage.get_daily_summary("2025-01-02", group_id="-100")["total_amount"] == 3
+    assert storage.get_all_time_summary(include_transactions=False)["total_amount"] == 15
+
+
+def test_inserts_append_deltas_instead_of_rewriting_the_file(storage):
+    path = storage.rollups.file_path
+    inode, size = os.stat(path).st_ino, os.path.getsize(path)
+    other = TransactionStorage()
+
+    assert storage.save_transaction(payment(16))
+    assert os.stat(path).st_ino == inode
+    with open(path) as f:
+        assert f.read()[size:].count("\n") == 1
+
+    # Another instance picks up the appended line without reloading the rest
+    assert other.get_daily_summary("2025-01-02", group_id="-100")["total_amount"] == 19
+
+
+def test_compaction_folds_the_log_into_one_snapshot_line(storage):
+    storage.rollups.save()
+    storage.rollups.compact_every = 2
+    storage.save_transaction(payment(16))
+    storage.save_transaction(payment(32))
+
+    with open(storage.rollups.file_path) as f:
+        lines = f.readlines()
+    assert len(lines) == 1 and "rollups" in json.loads(lines[0])
+    assert TransactionStorage().get_daily_summary("2025-01-02")["total_amount"] == 59
+
+
+@pytest.mark.parametrize("damage", ["garbage\n", '{"deltas": [["2025-01-02"'])
+def test_corrupt_or_torn_rollups_are_rebuilt_from_raw_storage(storage, damage):
+    with open(storage.rollups.file_path, "a") as f:
+        f.write(damage)
+
+    reopened = TransactionStorage()
+    assert reopened.save_transaction(payment(16))
+    assert reopened.get_daily_summary("2025-01-02", group_id="-100")["total_amount"] == 19
+    assert reopened.rebuild_rollups() == []
+
+
+def test_drifted_rollups_are_reported_and_repaired(storage, monkeypatch):
+    for buckets in storage.rollups.rollups.values():
+        for bucket in buckets.values():
+            bucket["total_amount"] += 100
+    storage.rollups.save()
+
+    # Single days are answered from the rollups, so the drift shows there
+    daily = TransactionStorage().get_daily_summary("2025-01-02", group_id="-100")
+    assert daily["total_amount"] == 103
+
+    with pytest.raises(SystemExit) as exit_info:
+        run_cli(monkeypatch, "--verify")
+    assert exit_info.value.code == 1
+
+    # The failed verification rebuilt them, so the next one passes
+    run_cli(monkeypatch, "--verify")
+    daily = TransactionStorage().get_daily_summary("2025-01-02", group_id="-100")
+    assert daily["total_amount"] == 3
+
+
+def test_reindex_backfills_missing_blind_indexes(storage, monkeypatch, capsys):
+    records = list(storage.backend.iter_records())
+    storage.backend.rewrite_records(
+        [{k: v for k, v in r.items() if k != "group_id_index"} for r in records]
+    )
+    storage.rollups.rebuild(storage.backend.iter_records())
+
+    run_cli(monkeypatch, "--reindex")
+    assert "Backfilled blind indexes on 4 transactions" in capsys.readouterr().out
+
+    reopened = TransactionStorage()
+    assert all("group_id_index" in r for r in reopened.backend.iter_records())
+    assert reopened.get_daily_summary("2025-01-02", group_id="-100")["total_amount"] == 3
+    assert reopened.get_daily_summary("2025-01-02", group_id="-200")["total_amount"] == 8
+    assert reopened.reindex() == 0
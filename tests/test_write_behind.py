@@ -0,0 +1,63 @@
+"""Write-behind batching of transaction inserts."""
+
+import time
+
+from transaction_storage import TransactionStorage
+
+
+def payment(i):
+    return {"date": "2025-01-02", "amount": i, "payer": "ALICE", "source": "ABA", "group_id": "-1"}
+
+
+def stored(storage):
+    return len(list(storage.backend.iter_records()))
+
+
+def test_buffer_is_written_as_one_batch_at_the_size_threshold(monkeypatch):
+    storage = TransactionStorage(flush_max_records=3)
+    appends = []
+    append_records = storage.backend.append_records
+
+    def counting(records):
+        appends.append(len(records))
+        return append_records(records)
+
+    monkeypatch.setattr(storage.backend, "append_records", counting)
+
+    assert storage.save_transaction(payment(1))
+    assert storage.save_transaction(payment(2))
+    assert stored(storage) == 0
+
+    assert storage.save_transaction(payment(3))
+    assert appends == [3]
+    assert stored(storage) == 3
+
+
+def test_interval_timer_flushes_a_partial_batch():
+    storage = TransactionStorage(flush_max_records=100, flush_interval_ms=50)
+    storage.save_transaction(payment(1))
+    storage.save_transaction(payment(2))
+
+    deadline = time.monotonic() + 5
+    while stored(storage) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert stored(storage) == 2
+    assert storage._flush_timer is None
+
+
+def test_close_flushes_what_is_still_buffered():
+    storage = TransactionStorage(flush_max_records=100, flush_interval_ms=60_000)
+    storage.save_transaction(payment(1))
+    assert stored(storage) == 0
+
+    storage.close()
+    assert stored(storage) == 1
+    assert TransactionStorage().get_daily_summary("2025-01-02")["total_amount"] == 1
+
+
+def test_reads_see_buffered_inserts():
+    storage = TransactionStorage(flush_max_records=100)
+    assert storage.save_transaction(payment(1))
+
+    assert [t["amount"] for t in storage.get_transactions_by_date("2025-01-02")] == [1]
+    assert stored(storage) == 1
@@ -0,0 +1,115 @@
+"""
+Decrypted Transaction Cache for Payment Bot SaaS
+Copyright (c) 2025 Sochetra. All rights reserved.
+
+This module keeps recently used transactions in memory in decrypted form so
+repeated reports and back-to-back payments do not pay for a full decrypt
+pass each time.
+"""
+
+import logging
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DecryptedRecordCache:
+    """In-process cache of decrypted transactions, bucketed by date.
+
+    The cache always holds a contiguous suffix of the history: every record
+    dated on or after ``low_water``. ``low_water == ""`` means the whole
+    history, including undated records, is cached. When the record cap is
+    exceeded the oldest dates are evicted and ``low_water`` moves forward.
+    ``signature`` is the backend signature the cached state corresponds to.
+    """
+
+    EVERYTHING = ""
+
+    def __init__(self, max_records: int):
+        self.max_records = max_records
+        self.clear()
+
+    def clear(self):
+        """Drop all cached records."""
+        self.by_date: Dict[str, List[Dict[str, Any]]] = {}
+        # Sorted keys of by_date, so ranges are located by binary search
+        self.dates: List[str] = []
+        self.low_water: Optional[str] = None
+        self.signature: Optional[Any] = None
+        self.record_count = 0
+
+    def covers(self, start_date: Optional[str]) -> bool:
+        """Check whether every record dated on or after ``start_date`` is cached."""
+        if self.low_water is None:
+            return False
+        if self.low_water == self.EVERYTHING:
+            return True
+        return start_date is not None and start_date >= self.low_water
+
+    def is_cached(self, record: Dict[str, Any]) -> bool:
+        """Check whether a record falls inside the cached part of the history."""
+        return self.covers(record.get("date") or self.EVERYTHING)
+
+    def add(self, records: Iterable[Dict[str, Any]]):
+        """Add decrypted records that fall inside the cached part of the history."""
+        for record in records:
+            if self.is_cached(record):
+                self._insert(record)
+
+    def extend(self, records: Iterable[Dict[str, Any]], low_water: str):
+        """Add older records and lower the coverage boundary to ``low_water``.
+
+        ``records`` must be every record dated between ``low_water`` and the
+        current boundary (or the whole uncached history for ``EVERYTHING``).
+        """
+        for record in records:
+            self._insert(record)
+        self.low_water = low_water
+
+    def _insert(self, record: Dict[str, Any]):
+        date = record.get("date") or self.EVERYTHING
+        if date not in self.by_date:
+            self.by_date[date] = []
+            insort(self.dates, date)
+        self.by_date[date].append(record)
+        self.record_count += 1
+
+    def select(
+        self, start_date: Optional[str] = None, end_date: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield copies of cached records in date order for an inclusive date range.
+
+        Callers get their own dicts, so changing a returned transaction never
+        alters what later queries see.
+        """
+        if start_date is None and end_date is None:
+            dates = list(self.dates)
+        else:
+            # Undated records sort first and only belong to unbounded scans
+            low = bisect_right(self.dates, self.EVERYTHING)
+            if start_date is not None:
+                low = max(low, bisect_left(self.dates, start_date))
+            high = len(self.dates) if end_date is None else bisect_right(self.dates, end_date)
+            dates = self.dates[low:high]
+
+        for date in dates:
+            for record in self.by_date[date]:
+                yield dict(record)
+
+    def evict(self):
+        """Evict the oldest dates until the cache is back under its record cap."""
+        if self.record_count <= self.max_records:
+            return
+
+        evicted = 0
+        while self.record_count > self.max_records and evicted < len(self.dates):
+            self.record_count -= len(self.by_date.pop(self.dates[evicted]))
+            evicted += 1
+        del self.dates[:evicted]
+
+        # Everything older than the first remaining date is no longer cached
+        self.low_water = self.dates[0] if self.dates else None
+        if self.low_water is None:
+            self.record_count = 0
+        logger.debug(f"Transaction cache evicted down to {self.record_count} records")
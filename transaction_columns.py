@@ -0,0 +1,281 @@
+"""
+Columnar Transaction Snapshot for Payment Bot SaaS
+Copyright (c) 2025 Sochetra. All rights reserved.
+
+This module keeps the aggregatable fields of every stored transaction in
+compact typed arrays so whole-history totals can be computed without
+building a dict per record or decrypting anything. The reductions are
+plain Python loops over the arrays (no numpy), so they save the per-record
+dict and decryption cost but are not vectorized.
+"""
+
+import json
+import logging
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date as date_cls
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ColumnarSnapshot:
+    """Array-backed copy of the amount, date, source, group and client columns.
+
+    Amounts are integer cents, dates are day ordinals (0 for undated records)
+    and source/group/client values are interned to small integer ids. Only
+    stored (encrypted) records are read, so the group column holds blind
+    indexes; ``group_samples`` keeps one stored record per group so callers
+    can decrypt a label once per group rather than once per record.
+    """
+
+    UNDATED = 0
+    COLUMNS = ("source", "group", "client")
+    SNAPSHOT_MAGIC = b"PBCOLS\x01\n"
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Drop all rows."""
+        self.amounts = array("q")
+        self.days = array("l")
+        self.ids = {column: array("l") for column in self.COLUMNS}
+        self.names: Dict[str, List[str]] = {column: [] for column in self.COLUMNS}
+        self._interned: Dict[str, Dict[str, int]] = {column: {} for column in self.COLUMNS}
+        self.group_samples: Dict[str, Dict[str, Any]] = {}
+        # Date-ordered index: row numbers sorted by day, plus their days
+        self._order: Optional[array] = array("l")
+        self._sorted_days = array("l")
+        self.signature: Optional[Any] = None
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def _intern(self, column: str, value: Any) -> int:
+        value = str(value or "")
+        interned = self._interned[column]
+        if value not in interned:
+            interned[value] = len(self.names[column])
+            self.names[column].append(value)
+        return interned[value]
+
+    @classmethod
+    def _to_ordinal(cls, date: Optional[str]) -> int:
+        if not date:
+            return cls.UNDATED
+        try:
+            return date_cls.fromisoformat(date).toordinal()
+        except (TypeError, ValueError):
+            return cls.UNDATED
+
+    def add_records(self, records: Iterable[Dict[str, Any]]):
+        """Append stored records as new rows."""
+        for record in records:
+            group = record.get("group_id_index") or record.get("group_id") or ""
+            day = self._to_ordinal(record.get("date"))
+            if self._order is not None:
+                # In-order appends extend the index; anything else rebuilds it lazily
+                if not self._sorted_days or day >= self._sorted_days[-1]:
+                    self._order.append(len(self))
+                    self._sorted_days.append(day)
+                else:
+                    self._order = None
+            self.amounts.append(round(float(record.get("amount", 0) or 0) * 100))
+            self.days.append(day)
+            self.ids["source"].append(self._intern("source", record.get("source")))
+            self.ids["group"].append(self._intern("group", group))
+            self.ids["client"].append(self._intern("client", record.get("client_id")))
+            if group and group not in self.group_samples:
+                self.group_samples[str(group)] = record
+
+    def _date_order(self):
+        """Return (sorted days, row numbers in date order), rebuilding if stale."""
+        if self._order is None:
+            self._order = array("l", sorted(range(len(self)), key=self.days.__getitem__))
+            self._sorted_days = array("l", (self.days[row] for row in self._order))
+        return self._sorted_days, self._order
+
+    def _rows(
+        self, start_date: Optional[str], end_date: Optional[str], group_index: Optional[str]
+    ) -> Optional[Iterable[int]]:
+        """Select row numbers for a date range and group, or None for every row.
+
+        Date ranges are located by binary search over the date-ordered index;
+        undated rows only match unbounded selections.
+        """
+        rows = None
+        if start_date is not None or end_date is not None:
+            sorted_days, order = self._date_order()
+            low = bisect_right(sorted_days, self.UNDATED)
+            if start_date is not None:
+                low = max(low, bisect_left(sorted_days, self._to_ordinal(start_date)))
+            high = len(order)
+            if end_date is not None:
+                high = bisect_right(sorted_days, self._to_ordinal(end_date))
+            rows = order[low:high]
+
+        if group_index is not None:
+            group_id = self._interned["group"].get(str(group_index))
+            if group_id is None:
+                return []
+            groups = self.ids["group"]
+            if rows is None:
+                rows = range(len(self))
+            rows = [row for row in rows if groups[row] == group_id]
+
+        return rows
+
+    def summarize(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Return total amount and transaction count for a date range."""
+        rows = self._rows(start_date, end_date, group_index)
+        if rows is None:
+            return {"total_amount": sum(self.amounts) / 100, "transaction_count": len(self)}
+
+        amounts = self.amounts
+        return {
+            "total_amount": sum(amounts[row] for row in rows) / 100,
+            "transaction_count": len(rows),
+        }
+
+    def _bincount(self, keys: array, rows: Optional[Iterable[int]]) -> Dict[int, int]:
+        """Sum amounts per key over the selected rows, like numpy.bincount with weights.
+
+        This is a per-row Python loop rather than a vectorized reduction.
+
+        Only keys that occur are returned, so zero-amount rows are still reported.
+        """
+        bins: Dict[int, int] = {}
+        amounts = self.amounts
+        if rows is None:
+            pairs = zip(keys, amounts)
+        else:
+            pairs = ((keys[row], amounts[row]) for row in rows)
+        for key, amount in pairs:
+            bins[key] = bins.get(key, 0) + amount
+        return bins
+
+    def daily_totals(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+    ) -> Dict[str, float]:
+        """Return the total amount per date for a date range."""
+        rows = self._rows(start_date, end_date, group_index)
+        if rows is None:
+            # Every dated row, in date order
+            sorted_days, order = self._date_order()
+            rows = order[bisect_right(sorted_days, self.UNDATED) :]
+
+        totals = self._bincount(self.days, rows)
+        return {
+            date_cls.fromordinal(day).isoformat(): total / 100
+            for day, total in totals.items()
+            if day != self.UNDATED
+        }
+
+    def totals_by(
+        self,
+        column: str,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+    ) -> Dict[str, float]:
+        """Return the total amount per source, group or client."""
+        if column not in self.COLUMNS:
+            raise ValueError(f"Unknown column: {column}")
+
+        names = self.names[column]
+        totals = self._bincount(self.ids[column], self._rows(start_date, end_date, group_index))
+        return {names[key]: total / 100 for key, total in totals.items()}
+
+    def _arrays(self) -> List[array]:
+        arrays = [self.amounts, self.days] + [self.ids[column] for column in self.COLUMNS]
+        if self._order is not None:
+            arrays += [self._order, self._sorted_days]
+        return arrays
+
+    def save(self, file_path: str) -> bool:
+        """Write the snapshot and the backend signature it corresponds to.
+
+        The file is a small JSON header (signature, interned names, group
+        samples) followed by the raw bytes of each column array.
+        """
+        header = {
+            "version": 1,
+            "signature": self.signature,
+            "rows": len(self),
+            "ordered": self._order is not None,
+            "itemsizes": {"q": array("q").itemsize, "l": array("l").itemsize},
+            "names": self.names,
+            "group_samples": self.group_samples,
+        }
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(self.SNAPSHOT_MAGIC)
+                f.write(struct.pack("<Q", len(header_bytes)))
+                f.write(header_bytes)
+                for column in self._arrays():
+                    column.tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, file_path)
+            return True
+        except Exception as e:
+            logger.error(f"Error saving columnar snapshot: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+    def load(self, file_path: str) -> bool:
+        """Replace the contents with a saved snapshot; False if it is missing or unusable."""
+        try:
+            with open(file_path, "rb") as f:
+                if f.read(len(self.SNAPSHOT_MAGIC)) != self.SNAPSHOT_MAGIC:
+                    raise ValueError("not a columnar snapshot")
+                (header_length,) = struct.unpack("<Q", f.read(8))
+                header = json.loads(f.read(header_length).decode("utf-8"))
+
+                # Arrays are stored in native layout; another platform means rebuilding
+                if header["itemsizes"] != {"q": array("q").itemsize, "l": array("l").itemsize}:
+                    raise ValueError("snapshot was written on an incompatible platform")
+
+                self.clear()
+                if not header["ordered"]:
+                    self._order = None
+                rows = header["rows"]
+                for column in self._arrays():
+                    column.fromfile(f, rows)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"Ignoring columnar snapshot {file_path}: {e}")
+            self.clear()
+            return False
+
+        self.names = header["names"]
+        self._interned = {
+            column: {name: i for i, name in enumerate(names)}
+            for column, names in self.names.items()
+        }
+        self.group_samples = header["group_samples"]
+        self.signature = _as_tuple(header["signature"])
+        return True
+
+
+def _as_tuple(value: Any) -> Any:
+    """Turn JSON lists back into the nested tuples backends use as signatures."""
+    if isinstance(value, list):
+        return tuple(_as_tuple(item) for item in value)
+    return value
@@ -0,0 +1,94 @@
+"""
+Transaction Fingerprint Index for Payment Bot SaaS
+Copyright (c) 2025 Sochetra. All rights reserved.
+
+This module keeps a persistent set of payment fingerprints so re-delivered,
+forwarded or edited notifications are recognised as duplicates without
+scanning the decrypted transaction history.
+"""
+
+import logging
+import os
+from typing import Iterable, Optional, Set
+
+from config import TRANSACTION_FINGERPRINTS_FILE
+from file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+
+class TransactionFingerprints:
+    """Append-only file of fingerprints, one hex digest per line, held in a set."""
+
+    def __init__(self, file_path: str = TRANSACTION_FINGERPRINTS_FILE):
+        self.file_path = file_path
+        self.fingerprints: Set[str] = set()
+        # (inode, bytes read) of the file as last loaded
+        self._position: Optional[tuple] = None
+        self._refresh()
+
+    def exists(self) -> bool:
+        """Check whether the index has been persisted yet."""
+        return os.path.exists(self.file_path)
+
+    def lock(self):
+        """Return the cross-process lock to hold around read-modify-write cycles."""
+        return file_lock(self.file_path)
+
+    def _refresh(self):
+        """Load fingerprints appended by other storage instances."""
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            self.fingerprints = set()
+            self._position = None
+            return
+
+        offset = 0
+        if self._position is not None and self._position[0] == stat.st_ino:
+            if self._position[1] == stat.st_size:
+                return
+            if self._position[1] < stat.st_size:
+                offset = self._position[1]
+        if offset == 0:
+            self.fingerprints = set()
+
+        with open(self.file_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+
+        # Ignore a partially written last line; it is picked up once complete
+        complete = data.rfind(b"\n") + 1
+        self.fingerprints.update(line for line in data[:complete].decode().split("\n") if line)
+        self._position = (stat.st_ino, offset + complete)
+
+    def __contains__(self, fingerprint: str) -> bool:
+        self._refresh()
+        return fingerprint in self.fingerprints
+
+    def add(self, fingerprints: Iterable[str]):
+        """Append fingerprints to the index and flush them to disk."""
+        new = [fp for fp in fingerprints if fp and fp not in self.fingerprints]
+        if not new:
+            return
+
+        with open(self.file_path, "a") as f:
+            f.write("".join(f"{fp}\n" for fp in new))
+            f.flush()
+            os.fsync(f.fileno())
+        self.fingerprints.update(new)
+
+    def rebuild(self, fingerprints: Iterable[str]) -> int:
+        """Replace the index with the given fingerprints; returns how many were kept."""
+        self.fingerprints = {fp for fp in fingerprints if fp}
+        temp_path = f"{self.file_path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write("".join(f"{fp}\n" for fp in sorted(self.fingerprints)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.file_path)
+
+        stat = os.stat(self.file_path)
+        self._position = (stat.st_ino, stat.st_size)
+        logger.info(f"Rebuilt transaction fingerprint index with {len(self.fingerprints)} entries")
+        return len(self.fingerprints)
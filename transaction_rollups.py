@@ -0,0 +1,311 @@
+"""
+Transaction Rollups for Payment Bot SaaS
+Copyright (c) 2025 Sochetra. All rights reserved.
+
+This module keeps per-day aggregates (date x group x source x client ->
+total amount, count) next to the raw transaction store so that summaries do
+not have to touch individual records.
+"""
+
+import argparse
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import TRANSACTION_ROLLUPS_COMPACT_EVERY, TRANSACTION_ROLLUPS_FILE
+from file_lock import file_lock, fsync_directory
+
+logger = logging.getLogger(__name__)
+
+
+class TransactionRollups:
+    """Incrementally maintained daily rollups stored as a JSON Lines log.
+
+    The first line holds every bucket as of the last compaction; each later
+    line holds the deltas of one insert batch, so an insert appends a line
+    instead of rewriting the file.
+    """
+
+    KEY_SEPARATOR = "|"
+    # Legacy records without a date still count towards all-time totals
+    UNDATED = ""
+
+    def __init__(
+        self,
+        file_path: str = TRANSACTION_ROLLUPS_FILE,
+        compact_every: int = TRANSACTION_ROLLUPS_COMPACT_EVERY,
+    ):
+        self.file_path = file_path
+        self.compact_every = compact_every
+        # {date: {"group|source|client": {"total_amount": float, "transaction_count": int}}}
+        self.rollups: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # (inode, bytes read) of the file as last loaded
+        self._position: Optional[tuple] = None
+        self._delta_lines = 0
+        # Set when the file could not be decoded; callers rebuild from raw storage
+        self.corrupt = False
+        self._refresh()
+
+    def exists(self) -> bool:
+        """Check whether usable rollups have been persisted yet."""
+        self._refresh()
+        return self._position is not None and not self.corrupt
+
+    def lock(self):
+        """Return the cross-process lock to hold around read-modify-write cycles."""
+        return file_lock(self.file_path)
+
+    def _refresh(self):
+        """Apply lines appended by other storage instances since the last load."""
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            self.rollups = {}
+            self._position = None
+            self._delta_lines = 0
+            self.corrupt = False
+            return
+
+        offset = 0
+        if self._position is not None and self._position[0] == stat.st_ino:
+            if self._position[1] == stat.st_size or self.corrupt:
+                return
+            if self._position[1] < stat.st_size:
+                offset = self._position[1]
+        if offset == 0:
+            self.rollups = {}
+            self._delta_lines = 0
+            self.corrupt = False
+
+        with open(self.file_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+
+        # Ignore a partially written last line; it is picked up once complete
+        complete = data.rfind(b"\n") + 1
+        self._position = (stat.st_ino, offset + complete)
+        try:
+            lines = [line for line in data[:complete].decode().split("\n") if line]
+            for number, line in enumerate(lines):
+                self._apply(json.loads(line), first=offset == 0 and number == 0)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Could not load transaction rollups: {e}")
+            self.rollups = {}
+            self.corrupt = True
+
+    def _apply(self, entry: Dict[str, Any], first: bool = False):
+        """Fold one log line into the in-memory rollups."""
+        if "rollups" in entry:
+            if not first:
+                raise ValueError("snapshot after the first line")
+            self.rollups = entry["rollups"]
+            return
+
+        for date, key, amount, count in entry["deltas"]:
+            bucket = self.rollups.setdefault(date, {}).setdefault(
+                key, {"total_amount": 0, "transaction_count": 0}
+            )
+            bucket["total_amount"] += amount
+            bucket["transaction_count"] += count
+        self._delta_lines += 1
+
+    def save(self) -> bool:
+        """Compact the log into a single snapshot line, durably and atomically."""
+        temp_path = f"{self.file_path}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                f.write(json.dumps({"version": 2, "rollups": self.rollups}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.file_path)
+            fsync_directory(os.path.dirname(self.file_path))
+            stat = os.stat(self.file_path)
+            self._position = (stat.st_ino, stat.st_size)
+            self._delta_lines = 0
+            self.corrupt = False
+            return True
+        except Exception as e:
+            logger.error(f"Error saving transaction rollups: {e}")
+            return False
+
+    def append_records(self, records: Iterable[Dict[str, Any]]) -> bool:
+        """Persist the deltas of newly stored records as one appended line.
+
+        Call with lock() held. Returns False without writing if the log is
+        missing, unreadable or ends in a line torn by a crashed writer; the
+        caller then rebuilds the rollups from raw storage.
+        """
+        self._refresh()
+        if self._position is None or self.corrupt:
+            return False
+        if os.path.getsize(self.file_path) != self._position[1]:
+            logger.warning("Transaction rollups end in a torn write")
+            self.corrupt = True
+            return False
+
+        deltas: Dict[tuple, List] = {}
+        for record in records:
+            key = (record.get("date") or self.UNDATED, self._rollup_key(record))
+            delta = deltas.setdefault(key, [0, 0])
+            delta[0] += record.get("amount", 0)
+            delta[1] += 1
+        if not deltas:
+            return True
+
+        entry = {
+            "deltas": [
+                [date, key, amount, count] for (date, key), (amount, count) in deltas.items()
+            ]
+        }
+        try:
+            with open(self.file_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            logger.error(f"Error appending transaction rollups: {e}")
+            return False
+
+        self._apply(entry)
+        self._position = (self._position[0], os.path.getsize(self.file_path))
+        if self.compact_every and self._delta_lines >= self.compact_every:
+            self.save()
+        return True
+
+    @classmethod
+    def _rollup_key(cls, record: Dict[str, Any]) -> str:
+        """Build the group|source|client key for a stored record."""
+        # Stored records carry the blind index instead of the plaintext group
+        group = record.get("group_id_index") or record.get("group_id") or ""
+        return cls.KEY_SEPARATOR.join(
+            [str(group), str(record.get("source") or ""), str(record.get("client_id") or "")]
+        )
+
+    def add_records(self, records: Iterable[Dict[str, Any]]):
+        """Fold stored records into the in-memory rollups only."""
+        for record in records:
+            date = record.get("date") or self.UNDATED
+            bucket = self.rollups.setdefault(date, {}).setdefault(
+                self._rollup_key(record), {"total_amount": 0, "transaction_count": 0}
+            )
+            bucket["total_amount"] += record.get("amount", 0)
+            bucket["transaction_count"] += 1
+
+    def _dates_in_range(self, start_date: Optional[str], end_date: Optional[str]) -> List[str]:
+        if start_date is not None and start_date == end_date:
+            return [start_date] if start_date in self.rollups else []
+
+        if start_date is None and end_date is None:
+            return list(self.rollups)
+
+        return [
+            date
+            for date in self.rollups
+            if date != self.UNDATED
+            and (start_date is None or date >= start_date)
+            and (end_date is None or date <= end_date)
+        ]
+
+    def _buckets(self, date: str, group_index: Optional[str]) -> Iterable[Dict[str, Any]]:
+        """Yield the buckets of a date, optionally only those of one group."""
+        for key, bucket in self.rollups[date].items():
+            if group_index is None or key.split(self.KEY_SEPARATOR, 1)[0] == group_index:
+                yield bucket
+
+    def summarize(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Return total amount and transaction count for a date range."""
+        self._refresh()
+        total_amount = 0
+        transaction_count = 0
+        for date in self._dates_in_range(start_date, end_date):
+            for bucket in self._buckets(date, group_index):
+                total_amount += bucket["total_amount"]
+                transaction_count += bucket["transaction_count"]
+
+        return {"total_amount": total_amount, "transaction_count": transaction_count}
+
+    def daily_totals(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_index: Optional[str] = None,
+    ) -> Dict[str, float]:
+        """Return the total amount per date for a date range."""
+        self._refresh()
+        totals = {}
+        for date in self._dates_in_range(start_date, end_date):
+            if date == self.UNDATED:
+                continue
+            buckets = list(self._buckets(date, group_index))
+            if buckets:
+                totals[date] = sum(bucket["total_amount"] for bucket in buckets)
+        return totals
+
+    def rebuild(self, records: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Recompute rollups from stored records and report rows that differed."""
+        self._refresh()
+        previous = self.rollups
+        self.rollups = {}
+        self.add_records(records)
+
+        mismatches = []
+        for date in sorted(set(previous) | set(self.rollups)):
+            old_buckets = previous.get(date, {})
+            new_buckets = self.rollups.get(date, {})
+            for key in sorted(set(old_buckets) | set(new_buckets)):
+                old = old_buckets.get(key, {"total_amount": 0, "transaction_count": 0})
+                new = new_buckets.get(key, {"total_amount": 0, "transaction_count": 0})
+                if old["transaction_count"] != new["transaction_count"] or round(
+                    old["total_amount"], 2
+                ) != round(new["total_amount"], 2):
+                    mismatches.append({"date": date, "key": key, "stored": old, "rebuilt": new})
+
+        self.save()
+        return mismatches
+
+
+def main():
+    """Rebuild the rollups of the shared store and every client shard, reporting drift."""
+    from tenant_storage import ShardedTransactionStorage
+
+    arg_parser = argparse.ArgumentParser(description="Rebuild transaction rollups")
+    arg_parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="exit with status 1 if the stored rollups did not match raw storage",
+    )
+    arg_parser.add_argument(
+        "--reindex",
+        action="store_true",
+        help="backfill blind indexes on transactions stored before they existed first",
+    )
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    drifted = 0
+    for client_id, storage in ShardedTransactionStorage().stores().items():
+        name = client_id or "shared"
+        if args.reindex:
+            print(f"Backfilled blind indexes on {storage.reindex()} transactions ({name})")
+        mismatches = storage.rebuild_rollups()
+
+        for mismatch in mismatches:
+            print(
+                f"{name} {mismatch['date']} {mismatch['key']}: stored {mismatch['stored']} "
+                f"-> rebuilt {mismatch['rebuilt']}"
+            )
+        print(f"Rollups rebuilt for {name} ({len(mismatches)} mismatching rows)")
+        drifted += len(mismatches)
+
+    if args.verify and drifted:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
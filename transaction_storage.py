@@ -1,126 +1,1090 @@
-import json
+import atexit
+import hashlib
 import logging
 import os
-from datetime import datetime
-from typing import Any, Dict, List
+import threading
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from itertools import chain, islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from config import TRANSACTIONS_FILE
+from config import (
+    ENABLE_COLUMNAR_SNAPSHOT,
+    ENABLE_DUPLICATE_DETECTION,
+    ENABLE_PAYER_DICTIONARY,
+    ENABLE_TRANSACTION_ROLLUPS,
+    TRANSACTION_ARCHIVE_COMPRESSION,
+    TRANSACTION_ARCHIVE_DIR,
+    TRANSACTION_CACHE_MAX_RECORDS,
+    TRANSACTION_DECRYPT_POOL,
+    TRANSACTION_DECRYPT_WORKERS,
+    TRANSACTION_FINGERPRINTS_FILE,
+    TRANSACTION_FLUSH_INTERVAL_MS,
+    TRANSACTION_FLUSH_MAX_RECORDS,
+    TRANSACTION_PAYERS_FILE,
+    TRANSACTION_RETENTION_DAYS,
+    TRANSACTION_ROLLUPS_FILE,
+    TRANSACTION_SNAPSHOT_FILE,
+    TRANSACTION_SNAPSHOT_INTERVAL,
+    TRANSACTION_TIMEOUT_HOURS,
+    TRANSACTIONS_BACKEND,
+)
 from encryption_manager import EncryptionManager
+from payer_dictionary import PayerDictionary
+from security_validator import SecurityValidator
+from storage_backends import ArchiveBackend, StorageBackend, create_backend
+from transaction_cache import DecryptedRecordCache
+from transaction_columns import ColumnarSnapshot
+from transaction_fingerprints import TransactionFingerprints
+from transaction_rollups import TransactionRollups
 
 logger = logging.getLogger(__name__)
 
 
 class TransactionStorage:
-    def __init__(self, use_encryption: bool = True):
-        self.file_path = TRANSACTIONS_FILE
+    # Stored next to each record so the duplicate index can be rebuilt from storage
+    FINGERPRINT_FIELD = "fingerprint"
+    # Replaces the payer ciphertext in records when the payer dictionary is enabled
+    PAYER_ID_FIELD = "payer_id"
+    # Records decrypted per decrypt_many() call when streaming from a backend
+    DECRYPT_BATCH_SIZE = 1000
+
+    def __init__(
+        self,
+        use_encryption: bool = True,
+        backend: Optional[StorageBackend] = None,
+        rollups: Optional[TransactionRollups] = None,
+        fingerprints: Optional[TransactionFingerprints] = None,
+        flush_max_records: Optional[int] = None,
+        flush_interval_ms: Optional[int] = None,
+        data_dir: Optional[str] = None,
+        encryption_manager: Optional[EncryptionManager] = None,
+    ):
+        # data_dir keeps every file of this store in one directory (a tenant shard)
+        self.data_dir = data_dir
+        self.backend = backend or create_backend(TRANSACTIONS_BACKEND, data_dir)
+        # Transactions moved out of the hot window by archive_old_transactions()
+        self.archive = ArchiveBackend(
+            self._data_path(TRANSACTION_ARCHIVE_DIR), TRANSACTION_ARCHIVE_COMPRESSION
+        )
         self.use_encryption = use_encryption
-        self.encryption_manager = EncryptionManager() if use_encryption else None
+        self.encryption_manager = None
+        if use_encryption:
+            self.encryption_manager = encryption_manager or EncryptionManager()
 
         # Fields to encrypt for privacy
         self.sensitive_fields = ["payer", "group_id"]
 
-        self._ensure_file_exists()
+        # Blind indexes stored next to the ciphertext so lookups can skip decryption
+        self.index_fields = {"group_id": "group_id_index", "payer": "payer_index"}
+
+        # Each distinct payer is encrypted once and records refer to it by id. The
+        # dictionary is always readable; the flag only decides how new records are stored
+        self.payers = None
+        if self.encryption_manager:
+            self.payers = PayerDictionary(
+                self._data_path(TRANSACTION_PAYERS_FILE), self.encryption_manager.decrypt_data
+            )
+
+        # Decrypted working set, invalidated when the backend changes underneath us
+        self.cache = None
+        if TRANSACTION_CACHE_MAX_RECORDS > 0:
+            self.cache = DecryptedRecordCache(TRANSACTION_CACHE_MAX_RECORDS)
+
+        # Compact array copy of the stored history for whole-history aggregation
+        self.columns = ColumnarSnapshot() if ENABLE_COLUMNAR_SNAPSHOT else None
+        self.snapshot_path = self._data_path(TRANSACTION_SNAPSHOT_FILE)
+        self._snapshot_rows = 0
+        self._snapshot_signature = None
+
+        # Write-behind buffer: (stored record, plaintext) pairs waiting for a flush
+        self.flush_max_records = max(
+            1, flush_max_records if flush_max_records is not None else TRANSACTION_FLUSH_MAX_RECORDS
+        )
+        self.flush_interval_ms = (
+            flush_interval_ms if flush_interval_ms is not None else TRANSACTION_FLUSH_INTERVAL_MS
+        )
+        self._pending: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+        self._flush_timer: Optional[threading.Timer] = None
+        # Guards the buffer, cache and rollups against the flush timer thread.
+        # Lock order, everywhere: self._lock, fingerprints, backend, rollups,
+        # payers. The flush timer holds self._lock while it takes the file
+        # locks, so taking any file lock first and self._lock later deadlocks.
+        self._lock = threading.RLock()
+
+        if self.columns is not None and self.columns.load(self.snapshot_path):
+            # Start from the saved image and replay only what was appended since
+            self._snapshot_rows = len(self.columns)
+            self._snapshot_signature = self.columns.signature
+            self._sync_columns()
+
+        # Daily aggregates answer summaries without reading individual records
+        self.rollups = rollups
+        if self.rollups is None and ENABLE_TRANSACTION_ROLLUPS:
+            self.rollups = TransactionRollups(self._data_path(TRANSACTION_ROLLUPS_FILE))
+
+        # Fingerprints of every stored payment, so re-deliveries are rejected in O(1)
+        self.fingerprints = fingerprints
+        if self.fingerprints is None and ENABLE_DUPLICATE_DETECTION:
+            self.fingerprints = TransactionFingerprints(
+                self._data_path(TRANSACTION_FINGERPRINTS_FILE)
+            )
+
+        if self.backend.legacy_records:
+            # Group totals only count indexed records, so upgraded stores are indexed first
+            logger.info(
+                f"Backfilling blind indexes on {self.backend.legacy_records} legacy transactions"
+            )
+            self.reindex()
+
+        self._usable_rollups()
+        if self.fingerprints is not None and not self.fingerprints.exists():
+            self.rebuild_fingerprints()
+
+        if self.buffered:
+            atexit.register(self.close)
+
+    def _data_path(self, file_name: str) -> str:
+        return os.path.join(self.data_dir, file_name) if self.data_dir else file_name
+
+    @property
+    def buffered(self) -> bool:
+        """Whether inserts are batched instead of written one by one."""
+        return self.flush_max_records > 1 or self.flush_interval_ms > 0
+
+    def _refresh_keys(self) -> bool:
+        """Switch to a key published by a key rotation, dropping key-dependent state.
+
+        Cached plaintext stays valid, but blind indexes change with the key,
+        so the columnar copy is rebuilt. Returns True if the key changed.
+        """
+        if not (self.use_encryption and self.encryption_manager):
+            return False
+        with self._lock:
+            if not self.encryption_manager.reload_keys():
+                return False
+            self._drop_derived_state()
+            return True
+
+    def _drop_derived_state(self):
+        if self.payers is not None:
+            self.payers.reload()
+        if self.cache is not None:
+            self.cache.clear()
+        if self.columns is not None:
+            self.columns.clear()
+
+    def _sync_cache(self) -> bool:
+        """Bring the cache up to date with storage; returns False if it can't be used."""
+        if self.cache is None:
+            return False
+
+        # Locked so a write by another worker is never seen half-way
+        with self._lock, self.backend.lock():
+            self._refresh_keys()
+            signature = self.backend.signature()
+            if signature is None:
+                return False
+            if signature == self.cache.signature:
+                return True
+
+            if self.cache.low_water is not None:
+                # Appends by other instances are folded in; anything else starts over
+                appended = self.backend.changes_since(self.cache.signature, signature)
+                if appended is None:
+                    self.cache.clear()
+                else:
+                    self.cache.add(
+                        self._decrypt_transactions(r for r in appended if self.cache.is_cached(r))
+                    )
+
+            self.cache.signature = signature
+            return True
+
+    def _columns_in_use(self) -> bool:
+        """Whether the columnar snapshot has been built or loaded and should be maintained."""
+        return self.columns is not None and self.columns.signature is not None
+
+    def _sync_columns(self) -> bool:
+        """Bring the columnar snapshot up to date; returns False if it can't be used."""
+        if self.columns is None:
+            return False
+
+        with self._lock, self.backend.lock():
+            self._refresh_keys()
+            signature = self.backend.signature()
+            if signature is None:
+                return False
+            if signature == self.columns.signature:
+                return True
+
+            appended = None
+            if self.columns.signature is not None:
+                appended = self.backend.changes_since(self.columns.signature, signature)
+            rebuilt = appended is None
+            if rebuilt:
+                self.columns.clear()
+                appended = self._all_records()
+            self.columns.add_records(appended)
+
+            self.columns.signature = signature
+
+        # A full rebuild is the expensive case, so persist it straight away
+        if rebuilt:
+            self.save_snapshot()
+        else:
+            self._maybe_snapshot()
+        return True
+
+    def save_snapshot(self) -> bool:
+        """Persist the columnar snapshot together with the backend position it reflects."""
+        with self._lock:
+            if self.columns is None or self.columns.signature is None:
+                return False
+            if self.columns.signature == self._snapshot_signature:
+                return True
+            if not self.columns.save(self.snapshot_path):
+                return False
+            self._snapshot_rows = len(self.columns)
+            self._snapshot_signature = self.columns.signature
+            logger.debug(f"Saved columnar snapshot with {self._snapshot_rows} transactions")
+            return True
+
+    def _maybe_snapshot(self):
+        """Save a new snapshot once enough transactions were added since the last one."""
+        if (
+            TRANSACTION_SNAPSHOT_INTERVAL > 0
+            and self.columns is not None
+            and len(self.columns) - self._snapshot_rows >= TRANSACTION_SNAPSHOT_INTERVAL
+        ):
+            self.save_snapshot()
+
+    def _cached_range(
+        self, start_date: Optional[str], end_date: Optional[str], extend: bool = True
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Serve a date range from the cache, extending it if needed and allowed.
+
+        Returns None when the range is better read straight from the backend,
+        i.e. it lies entirely before the part of the history being cached, or
+        it is not cached yet and ``extend`` is False.
+        """
+        if not self._sync_cache():
+            return None
+
+        if not self.cache.covers(start_date):
+            if not extend:
+                return None
+            low_water = self.cache.low_water
+            if low_water and end_date is not None and end_date < low_water:
+                return None
+
+            # Load only what is missing: everything older than the cached suffix
+            if start_date is None:
+                # Undated records only show up in unbounded scans
+                records = self.backend.iter_records()
+            else:
+                records = self.backend.iter_records(start_date, low_water or None)
+            missing = self._decrypt_transactions(r for r in records if not self.cache.is_cached(r))
+            self.cache.extend(
+                missing, start_date if start_date is not None else self.cache.EVERYTHING
+            )
 
-    def _ensure_file_exists(self):
-        """Create transactions file if it doesn't exist."""
-        if not os.path.exists(self.file_path):
-            with open(self.file_path, "w") as f:
-                json.dump([], f)
+        transactions = list(self.cache.select(start_date, end_date))
+        self.cache.evict()
+        return transactions
+
+    def _index_value(self, value: Any) -> str:
+        """Compute the stored index for a sensitive value."""
+        if self.use_encryption and self.encryption_manager:
+            return self.encryption_manager.blind_index(str(value))
+        # Without encryption the value is already stored in clear
+        return str(value)
+
+    def _group_index(self, group_id: Optional[str]) -> Optional[str]:
+        return self._index_value(group_id) if group_id is not None else None
+
+    def _summarize(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        self.flush()
+        with self._lock:
+            self._refresh_keys()
+            rollups = self._usable_rollups()
+            source = rollups if rollups is not None else self.backend
+            # Per-day rollups answer single days; longer ranges go columnar
+            if (start_date is None or start_date != end_date) and self._sync_columns():
+                source = self.columns
+            return source.summarize(start_date, end_date, self._group_index(group_id))
+
+    def _daily_totals(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_id: Optional[str] = None,
+    ) -> Dict[str, float]:
+        self.flush()
+        with self._lock:
+            self._refresh_keys()
+            rollups = self._usable_rollups()
+            source = rollups if rollups is not None else self.backend
+            if self._sync_columns():
+                source = self.columns
+            return source.daily_totals(start_date, end_date, self._group_index(group_id))
+
+    def _all_records(self) -> Iterator[Dict[str, Any]]:
+        """Yield every stored record, archived ones first.
+
+        An archive run that crashed before rewriting the hot store leaves
+        records in both; those are yielded once, from the hot store.
+        """
+        if not self.archive.months():
+            return self.backend.iter_records()
+
+        hot = {ArchiveBackend.record_key(record) for record in self.backend.iter_records()}
+        archived = (
+            record
+            for record in self.archive.iter_records()
+            if ArchiveBackend.record_key(record) not in hot
+        )
+        return chain(archived, self.backend.iter_records())
+
+    def _usable_rollups(self) -> Optional[TransactionRollups]:
+        """Return the rollups, rebuilding them first if their file is missing or corrupt."""
+        if self.rollups is not None and not self.rollups.exists():
+            self.rebuild_rollups()
+        return self.rollups
+
+    def rebuild_rollups(self) -> List[Dict[str, Any]]:
+        """Recompute rollups from raw storage, returning rows that had drifted."""
+        if self.rollups is None:
+            return []
+
+        with self._lock:
+            self.flush()
+            with self.backend.lock(), self.rollups.lock():
+                mismatches = self.rollups.rebuild(self._all_records())
+        if mismatches:
+            logger.warning(f"Rebuilt rollups: {len(mismatches)} rows did not match raw storage")
+        return mismatches
+
+    def rebuild_fingerprints(self) -> int:
+        """Recreate the duplicate index from the fingerprints kept in raw storage."""
+        if self.fingerprints is None:
+            return 0
+
+        with self._lock:
+            self.flush()
+            with self.fingerprints.lock(), self.backend.lock():
+                return self.fingerprints.rebuild(
+                    record.get(self.FINGERPRINT_FIELD) for record in self._all_records()
+                )
+
+    def rebuild_derived_data(self):
+        """Recompute the cache, columns, rollups and fingerprints from raw storage.
+
+        Needed after the stored records were rewritten under a new key, since
+        blind indexes and fingerprints are keyed.
+        """
+        with self._lock:
+            self._drop_derived_state()
+            self.rebuild_rollups()
+            self.rebuild_fingerprints()
+            self._sync_columns()
+
+    def reindex(self) -> int:
+        """Backfill blind indexes on records stored before they existed.
+
+        Only records missing an index are decrypted. Returns the number of
+        records that were updated; rollups are rebuilt afterwards.
+        """
+        with self._lock:
+            # Flushed before the backend lock: flushing takes the fingerprint lock first
+            self.flush()
+            with self.backend.lock():
+                return self._reindex()
+
+    def _reindex(self) -> int:
+        records = []
+        updated = 0
+        for record in self.backend.iter_records():
+            missing = [
+                field
+                for field, index_field in self.index_fields.items()
+                if record.get(field) is not None and index_field not in record
+            ]
+            if missing:
+                plain = self._decrypt_transaction(record)
+                record = record.copy()
+                for field in missing:
+                    # Skip fields that could not be decrypted with the current key
+                    value = plain[field]
+                    if plain.get(f"{field}_encrypted") or EncryptionManager.is_encrypted(value):
+                        continue
+                    record[self.index_fields[field]] = self._index_value(value)
+                if any(self.index_fields[field] in record for field in missing):
+                    updated += 1
+            records.append(record)
+
+        if updated:
+            self.backend.rewrite_records(records)
+            self.rebuild_rollups()
+            logger.info(f"Backfilled blind indexes on {updated} transactions")
+
+        return updated
+
+    def _decrypt_transaction(self, transaction: Dict[str, Any]) -> Dict[str, Any]:
+        """Decrypt the sensitive fields of a stored transaction."""
+        if self.use_encryption and self.encryption_manager:
+            try:
+                transaction = self.encryption_manager.decrypt_sensitive_fields(
+                    transaction, self.sensitive_fields
+                )
+            except Exception as e:
+                logger.warning(f"Could not decrypt transaction: {e}")
+                # Keep original transaction if decryption fails
+
+        return self._strip_storage_fields(self._resolve_payer(transaction))
+
+    def _resolve_payer(self, transaction: Dict[str, Any]) -> Dict[str, Any]:
+        """Replace a payer dictionary reference with the decrypted payer name."""
+        if self.PAYER_ID_FIELD not in transaction or self.payers is None:
+            return transaction
+        payer = self.payers.lookup(transaction[self.PAYER_ID_FIELD])
+        # Rebuilt in order so the payer keeps its position among the fields
+        return {
+            ("payer" if k == self.PAYER_ID_FIELD else k): (payer if k == self.PAYER_ID_FIELD else v)
+            for k, v in transaction.items()
+        }
+
+    def _strip_storage_fields(self, transaction: Dict[str, Any]) -> Dict[str, Any]:
+        # Index fields are a storage detail and are not returned to callers
+        return {
+            k: v
+            for k, v in transaction.items()
+            if k not in self.index_fields.values() and k != self.FINGERPRINT_FIELD
+        }
+
+    def _decrypt_transactions(
+        self, transactions: Iterable[Dict[str, Any]]
+    ) -> Iterator[Dict[str, Any]]:
+        """Decrypt stored records in parallel batches, yielding them in order."""
+        if not (self.use_encryption and self.encryption_manager):
+            yield from (self._strip_storage_fields(t) for t in transactions)
+            return
+
+        transactions = iter(transactions)
+        while True:
+            batch = list(islice(transactions, self.DECRYPT_BATCH_SIZE))
+            if not batch:
+                return
+            decrypted = self.encryption_manager.decrypt_many(
+                batch,
+                self.sensitive_fields,
+                max_workers=TRANSACTION_DECRYPT_WORKERS,
+                pool=TRANSACTION_DECRYPT_POOL,
+            )
+            yield from (self._strip_storage_fields(self._resolve_payer(t)) for t in decrypted)
+
+    def _plain_copy(self, transaction: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a transaction as it would read back after decryption."""
+        plain = transaction.copy()
+        if self.use_encryption and self.encryption_manager:
+            for field in self.sensitive_fields:
+                if plain.get(field) is not None:
+                    plain[field] = str(plain[field])
+        return plain
+
+    def _fingerprint(self, transaction: Dict[str, Any]) -> Optional[str]:
+        """Identify a payment independently of how often its message was delivered.
+
+        The bank's transaction ID is used when the notification carries one,
+        otherwise group + amount + payer + message time. Statement rows with
+        only a date use date + amount + payer + their ``statement_row``
+        number. Without any of these there is nothing that tells two
+        identical payments apart, so no fingerprint.
+        """
+        group_id = str(transaction.get("group_id") or "")
+        if transaction.get("transaction_id"):
+            material = f"id|{group_id}|{transaction['transaction_id']}"
+        elif transaction.get("message_time"):
+            material = "|".join(
+                [
+                    "message",
+                    group_id,
+                    str(transaction.get("amount")),
+                    str(transaction.get("payer")),
+                    str(transaction["message_time"]),
+                ]
+            )
+        elif transaction.get("statement_row"):
+            material = "|".join(
+                [
+                    "statement",
+                    group_id,
+                    str(transaction.get("date")),
+                    str(transaction.get("amount")),
+                    str(transaction.get("payer")),
+                    str(transaction["statement_row"]),
+                ]
+            )
+        else:
+            return None
+
+        if self.use_encryption and self.encryption_manager:
+            return self.encryption_manager.blind_index(material)
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def _is_duplicate(self, fingerprint: Optional[str]) -> bool:
+        """Check a fingerprint against stored and still-buffered payments."""
+        if fingerprint is None or self.fingerprints is None:
+            return False
+        if fingerprint in self.fingerprints:
+            return True
+        return any(stored.get(self.FINGERPRINT_FIELD) == fingerprint for stored, _ in self._pending)
+
+    def _prepare_for_storage(
+        self, transaction: Dict[str, Any], encrypt_fields: bool = True
+    ) -> Dict[str, Any]:
+        """Copy a transaction and encrypt its sensitive fields for storage.
+
+        With ``encrypt_fields`` False the record is indexed and its payer
+        stored by id, but the sensitive fields are left for the caller to
+        encrypt in bulk.
+        """
+        transaction_to_save = transaction.copy()
+
+        fingerprint = self._fingerprint(transaction_to_save)
+        if fingerprint is not None:
+            transaction_to_save[self.FINGERPRINT_FIELD] = fingerprint
+
+        for field, index_field in self.index_fields.items():
+            if transaction_to_save.get(field) is not None:
+                transaction_to_save[index_field] = self._index_value(transaction_to_save[field])
+
+        # Encrypt sensitive fields if encryption is enabled
+        if self.use_encryption and self.encryption_manager:
+            if (
+                ENABLE_PAYER_DICTIONARY
+                and self.payers is not None
+                and transaction_to_save.get("payer") is not None
+            ):
+                payer = str(transaction_to_save["payer"])
+                payer_id = self.payers.id_for(
+                    transaction_to_save["payer_index"],
+                    lambda: self.encryption_manager.encrypt_data(payer),
+                )
+                transaction_to_save = {
+                    (self.PAYER_ID_FIELD if k == "payer" else k): (payer_id if k == "payer" else v)
+                    for k, v in transaction_to_save.items()
+                }
+            if encrypt_fields:
+                transaction_to_save = self.encryption_manager.encrypt_sensitive_fields(
+                    transaction_to_save, self.sensitive_fields
+                )
+
+        return transaction_to_save
+
+    def _query(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_id: Optional[str] = None,
+        payer: Optional[str] = None,
+        include_archived: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Fetch and decrypt only the records matching the given filters."""
+        # Reads always see buffered inserts
+        self.flush()
+
+        archived = []
+        if include_archived:
+            archived = list(
+                self._iter_backend(start_date, end_date, group_id, payer, backend=self.archive)
+            )
+
+        with self._lock:
+            # Group and payer filters read only matching records through the blind
+            # indexes, so the cache answers them only if it already holds the range
+            cached = self._cached_range(
+                start_date, end_date, extend=group_id is None and payer is None
+            )
+        if cached is not None:
+            return archived + [
+                t
+                for t in cached
+                if (group_id is None or str(t.get("group_id")) == str(group_id))
+                and (payer is None or t.get("payer") == payer)
+            ]
+
+        return archived + list(self._iter_backend(start_date, end_date, group_id, payer))
+
+    def _iter_backend(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_id: Optional[str] = None,
+        payer: Optional[str] = None,
+        backend: Optional[StorageBackend] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Stream matching records from the backend, decrypting them batch by batch."""
+        self._refresh_keys()
+        records = (backend or self.backend).iter_records(
+            start_date,
+            end_date,
+            self._group_index(group_id),
+            self._index_value(payer) if payer is not None else None,
+        )
+
+        for transaction in self._decrypt_transactions(records):
+            # Records without a stored index are confirmed on the decrypted value
+            if group_id is not None and str(transaction.get("group_id")) != str(group_id):
+                continue
+            if payer is not None and transaction.get("payer") != payer:
+                continue
+            yield transaction
+
+    def iter_transactions(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_id: Optional[str] = None,
+        payer: Optional[str] = None,
+        include_archived: bool = False,
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield transactions one at a time, decrypting lazily.
+
+        Unlike load_transactions() this never holds the decrypted history in
+        memory: cached records are served as-is, anything else is streamed
+        from the backend without being added to the cache. Archived
+        transactions come first when ``include_archived`` is set.
+        """
+        self.flush()
+
+        if include_archived:
+            yield from self._iter_backend(
+                start_date, end_date, group_id, payer, backend=self.archive
+            )
+
+        with self._lock:
+            cached = self._cached_range(start_date, end_date, extend=False)
+
+        if cached is None:
+            yield from self._iter_backend(start_date, end_date, group_id, payer)
+            return
+
+        for transaction in cached:
+            if group_id is not None and str(transaction.get("group_id")) != str(group_id):
+                continue
+            if payer is not None and transaction.get("payer") != payer:
+                continue
+            yield transaction
 
     def load_transactions(self) -> List[Dict[str, Any]]:
-        """Load all transactions from JSON file."""
+        """Load all transactions from storage."""
         try:
-            with open(self.file_path, "r") as f:
-                transactions = json.load(f)
-
-            # Decrypt sensitive fields if encryption is enabled
-            if self.use_encryption and self.encryption_manager:
-                decrypted_transactions = []
-                for transaction in transactions:
-                    try:
-                        decrypted_transaction = self.encryption_manager.decrypt_sensitive_fields(
-                            transaction, self.sensitive_fields
-                        )
-                        decrypted_transactions.append(decrypted_transaction)
-                    except Exception as e:
-                        logger.warning(f"Could not decrypt transaction: {e}")
-                        # Keep original transaction if decryption fails
-                        decrypted_transactions.append(transaction)
-
-                return decrypted_transactions
-
-            return transactions
-
-        except (FileNotFoundError, json.JSONDecodeError) as e:
+            return self._query()
+        except Exception as e:
             logger.warning(f"Could not load transactions: {e}")
             return []
 
-    def save_transaction(self, transaction: Dict[str, Any]) -> bool:
-        """Save a new transaction to the JSON file."""
-        try:
-            # Load existing transactions (will be decrypted automatically)
-            transactions = self.load_transactions()
+    def _write_records(self, pending: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> int:
+        """Append (stored, plaintext) pairs with one backend write and one rollup append.
 
-            # Prepare transaction for storage
-            transaction_to_save = transaction.copy()
+        Called with self._lock held; the file locks are then taken in the order
+        fingerprints, backend, rollups, payers so several worker processes can
+        write concurrently. Returns the number
+        of records written after dropping duplicates stored by other workers.
+        """
+        fingerprint_lock = self.fingerprints.lock() if self.fingerprints else nullcontext()
+        with fingerprint_lock, self.backend.lock():
+            if self._refresh_keys():
+                # Prepared under a key that a rotation has since replaced
+                pending = [(self._prepare_for_storage(plain), plain) for _, plain in pending]
+            if self.fingerprints is not None:
+                pending = [
+                    (stored, plain)
+                    for stored, plain in pending
+                    if stored.get(self.FINGERPRINT_FIELD) not in self.fingerprints
+                ]
+                if not pending:
+                    return 0
+            stored_records = [stored for stored, _ in pending]
 
-            # Encrypt sensitive fields if encryption is enabled
-            if self.use_encryption and self.encryption_manager:
-                transaction_to_save = self.encryption_manager.encrypt_sensitive_fields(
-                    transaction_to_save, self.sensitive_fields
+            cache_current = self._sync_cache()
+            # Only keep the snapshot current once a query has built it; the
+            # first whole-history total pays for the build, not the first write
+            columns_current = self._columns_in_use() and self._sync_columns()
+            self.backend.append_records(stored_records)
+
+            if cache_current:
+                # We know the plaintext, so keep the cache warm without decrypting
+                self.cache.add(plain for _, plain in pending)
+                self.cache.signature = self.backend.signature()
+
+            if columns_current:
+                self.columns.add_records(stored_records)
+                self.columns.signature = self.backend.signature()
+                self._maybe_snapshot()
+
+            if self.rollups is not None:
+                with self.rollups.lock():
+                    if not self.rollups.append_records(stored_records):
+                        # Unreadable or torn log: recount everything, this batch included
+                        self.rollups.rebuild(self._all_records())
+
+            if self.fingerprints is not None:
+                self.fingerprints.add(
+                    record.get(self.FINGERPRINT_FIELD) for record in stored_records
                 )
 
-            transactions.append(transaction_to_save)
+        return len(pending)
+
+    def save_transaction(self, transaction: Dict[str, Any]) -> bool:
+        """Save a new transaction to storage.
+
+        In buffered mode the transaction is queued and written by the next
+        flush (size threshold, interval timer, a read, or close()). Returns
+        False without saving if the same payment was already recorded.
+        """
+        try:
+            # Only the new record is encrypted and appended; history is not re-read
+            entry = (self._prepare_for_storage(transaction), self._plain_copy(transaction))
+
+            with self._lock:
+                if self._is_duplicate(entry[0].get(self.FINGERPRINT_FIELD)):
+                    logger.info("Duplicate transaction ignored")
+                    return False
+
+                if not self.buffered:
+                    if not self._write_records([entry]):
+                        logger.info("Duplicate transaction ignored")
+                        return False
+                    logger.info(
+                        f"Transaction saved successfully (encrypted: {self.use_encryption})"
+                    )
+                    return True
 
-            # Save to file
-            with open(self.file_path, "w") as f:
-                json.dump(transactions, f, indent=2)
+                self._pending.append(entry)
+                if len(self._pending) >= self.flush_max_records:
+                    return self.flush()
+                if self.flush_interval_ms > 0 and self._flush_timer is None:
+                    self._flush_timer = threading.Timer(self.flush_interval_ms / 1000, self.flush)
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
 
-            logger.info(f"Transaction saved successfully (encrypted: {self.use_encryption})")
             return True
 
         except Exception as e:
             logger.error(f"Error saving transaction: {e}")
             return False
 
-    def get_transactions_by_date(self, date: str) -> List[Dict[str, Any]]:
-        """Get all transactions for a specific date (YYYY-MM-DD)."""
-        transactions = self.load_transactions()
-        return [t for t in transactions if t.get("date") == date]
+    def _validate_transaction(self, transaction: Dict[str, Any]) -> Optional[str]:
+        """Return why a transaction cannot be stored, or None if it is valid."""
+        amount_validation = SecurityValidator.validate_amount(str(transaction.get("amount")))
+        if not amount_validation["valid"]:
+            return "; ".join(amount_validation["errors"])
+
+        if not transaction.get("payer"):
+            return "Missing payer"
+        payer_validation = SecurityValidator.validate_payer_name(transaction["payer"])
+        if not payer_validation["valid"]:
+            return "; ".join(payer_validation["errors"])
+
+        try:
+            datetime.strptime(str(transaction.get("date")), "%Y-%m-%d")
+        except ValueError:
+            return f"Invalid date: {transaction.get('date')!r}"
+        return None
+
+    def save_transactions(self, transactions: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        """Validate, encrypt and store many transactions with a single write.
+
+        Meant for backfills: the whole batch is one backend append, one rollup
+        save and one fingerprint update, instead of one of each per record.
+        Invalid records and payments already recorded (or repeated within the
+        batch) are skipped. Returns counts of saved, duplicate and invalid
+        records.
+        """
+        counts = {"saved": 0, "duplicates": 0, "invalid": 0}
+        entries = []
+        seen = set()
+        for transaction in transactions:
+            error = self._validate_transaction(transaction)
+            if error:
+                logger.warning(f"Skipping invalid transaction: {error}")
+                counts["invalid"] += 1
+                continue
+
+            entry = (self._prepare_for_storage(transaction), self._plain_copy(transaction))
+            fingerprint = entry[0].get(self.FINGERPRINT_FIELD)
+            if fingerprint is not None and fingerprint in seen:
+                counts["duplicates"] += 1
+                continue
+            seen.add(fingerprint)
+            entries.append(entry)
+
+        with self._lock:
+            # Keep already buffered single saves ahead of the batch
+            self.flush()
+            if entries:
+                counts["saved"] = self._write_records(entries)
+        counts["duplicates"] += len(entries) - counts["saved"]
 
-    def get_daily_summary(self, date: str) -> Dict[str, Any]:
-        """Get daily summary for a specific date."""
-        daily_transactions = self.get_transactions_by_date(date)
+        logger.info(
+            f"Saved {counts['saved']} transactions in one batch "
+            f"({counts['duplicates']} duplicates, {counts['invalid']} invalid)"
+        )
+        return counts
 
-        total_amount = sum(t.get("amount", 0) for t in daily_transactions)
-        transaction_count = len(daily_transactions)
+    def flush(self) -> bool:
+        """Write all buffered transactions as a single batch."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+
+            if not self._pending:
+                return True
+
+            pending, self._pending = self._pending, []
+            try:
+                written = self._write_records(pending)
+                logger.info(f"Flushed {written} transactions (encrypted: {self.use_encryption})")
+                return True
+            except Exception as e:
+                # Keep the batch so the next flush retries it
+                self._pending = pending + self._pending
+                logger.error(f"Error flushing transactions: {e}")
+                return False
+
+    def close(self):
+        """Flush buffered transactions and save the snapshot; call on shutdown."""
+        self.flush()
+        self.save_snapshot()
+
+    def get_transactions_by_date(
+        self, date: str, group_id: Optional[str] = None, include_archived: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Get all transactions for a specific date (YYYY-MM-DD), optionally for one group."""
+        return self._query(date, date, group_id=group_id, include_archived=include_archived)
+
+    def get_transactions_between(
+        self,
+        start_date: str,
+        end_date: str,
+        group_id: Optional[str] = None,
+        include_archived: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Get all transactions in an inclusive date range (YYYY-MM-DD), in date order."""
+        return self._query(
+            start_date, end_date, group_id=group_id, include_archived=include_archived
+        )
+
+    def get_transactions_by_payer(
+        self, payer: str, group_id: Optional[str] = None, include_archived: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Get all transactions from a payer, optionally for one group."""
+        return self._query(group_id=group_id, payer=payer, include_archived=include_archived)
+
+    def get_daily_summary(
+        self,
+        date: str,
+        include_transactions: bool = True,
+        group_id: Optional[str] = None,
+        include_archived: bool = False,
+    ) -> Dict[str, Any]:
+        """Get daily summary for a specific date, optionally for one group.
+
+        Totals always cover archived transactions; ``include_archived`` only
+        controls whether they are listed.
+        """
+        totals = self._summarize(date, date, group_id)
 
         return {
             "date": date,
-            "total_amount": total_amount,
-            "transaction_count": transaction_count,
-            "transactions": daily_transactions,
+            "total_amount": totals["total_amount"],
+            "transaction_count": totals["transaction_count"],
+            "transactions": (
+                self.get_transactions_by_date(date, group_id, include_archived)
+                if include_transactions
+                else []
+            ),
         }
 
-    def get_all_time_summary(self) -> Dict[str, Any]:
-        """Get summary of all transactions."""
-        transactions = self.load_transactions()
+    def _range_summary(
+        self,
+        start_date: str,
+        end_date: str,
+        include_transactions: bool,
+        group_id: Optional[str],
+        include_archived: bool = False,
+    ) -> Dict[str, Any]:
+        totals = self._summarize(start_date, end_date, group_id)
 
-        total_amount = sum(t.get("amount", 0) for t in transactions)
-        transaction_count = len(transactions)
+        return {
+            "start_date": start_date,
+            "end_date": end_date,
+            "total_amount": totals["total_amount"],
+            "transaction_count": totals["transaction_count"],
+            "daily_totals": self._daily_totals(start_date, end_date, group_id),
+            "transactions": (
+                self.get_transactions_between(start_date, end_date, group_id, include_archived)
+                if include_transactions
+                else []
+            ),
+        }
 
-        # Group by date for daily breakdown
-        daily_totals = {}
-        for transaction in transactions:
-            date = transaction.get("date")
-            if date:
-                if date not in daily_totals:
-                    daily_totals[date] = 0
-                daily_totals[date] += transaction.get("amount", 0)
+    def get_weekly_summary(
+        self,
+        date: Optional[str] = None,
+        include_transactions: bool = True,
+        group_id: Optional[str] = None,
+        include_archived: bool = False,
+    ) -> Dict[str, Any]:
+        """Get summary for the Monday-Sunday week containing a date (default today)."""
+        day = datetime.strptime(date, "%Y-%m-%d") if date else datetime.now()
+        monday = day - timedelta(days=day.weekday())
+        sunday = monday + timedelta(days=6)
+        return self._range_summary(
+            monday.strftime("%Y-%m-%d"),
+            sunday.strftime("%Y-%m-%d"),
+            include_transactions,
+            group_id,
+            include_archived,
+        )
+
+    def get_monthly_summary(
+        self,
+        month: Optional[str] = None,
+        include_transactions: bool = True,
+        group_id: Optional[str] = None,
+        include_archived: bool = False,
+    ) -> Dict[str, Any]:
+        """Get summary for a calendar month (YYYY-MM, default the current month)."""
+        first = datetime.strptime(month, "%Y-%m") if month else datetime.now().replace(day=1)
+        next_month = (first.replace(day=28) + timedelta(days=4)).replace(day=1)
+        last = next_month - timedelta(days=1)
+        return self._range_summary(
+            first.strftime("%Y-%m-%d"),
+            last.strftime("%Y-%m-%d"),
+            include_transactions,
+            group_id,
+            include_archived,
+        )
+
+    def get_all_time_summary(
+        self,
+        include_transactions: bool = True,
+        group_id: Optional[str] = None,
+        include_archived: bool = False,
+    ) -> Dict[str, Any]:
+        """Get summary of all transactions, optionally for one group."""
+        totals = self._summarize(group_id=group_id)
+
+        # Streamed so a full-history listing does not also fill the cache
+        transactions = (
+            list(self.iter_transactions(group_id=group_id, include_archived=include_archived))
+            if include_transactions
+            else []
+        )
 
         return {
-            "total_amount": total_amount,
-            "transaction_count": transaction_count,
-            "daily_totals": daily_totals,
+            "total_amount": totals["total_amount"],
+            "transaction_count": totals["transaction_count"],
+            # Group by date for daily breakdown
+            "daily_totals": self._daily_totals(group_id=group_id),
             "transactions": transactions,
         }
+
+    def get_source_totals(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        group_id: Optional[str] = None,
+    ) -> Dict[str, float]:
+        """Get the total amount per payment source, optionally for one group."""
+        self.flush()
+        with self._lock:
+            if self._sync_columns():
+                return self.columns.totals_by(
+                    "source", start_date, end_date, self._group_index(group_id)
+                )
+
+        totals: Dict[str, float] = {}
+        for transaction in self.iter_transactions(start_date, end_date, group_id):
+            source = str(transaction.get("source") or "")
+            totals[source] = totals.get(source, 0) + transaction.get("amount", 0)
+        return totals
+
+    def get_group_totals(
+        self, start_date: Optional[str] = None, end_date: Optional[str] = None
+    ) -> Dict[str, float]:
+        """Get the total amount per group."""
+        self.flush()
+        with self._lock:
+            if self._sync_columns():
+                totals = {}
+                for group_index, total in self.columns.totals_by(
+                    "group", start_date, end_date
+                ).items():
+                    # Decrypt one sample record per group instead of every record
+                    sample = self.columns.group_samples.get(group_index)
+                    group_id = self._decrypt_transaction(sample).get("group_id") if sample else ""
+                    totals[str(group_id or "")] = totals.get(str(group_id or ""), 0) + total
+                return totals
+
+        totals = {}
+        for transaction in self.iter_transactions(start_date, end_date):
+            group_id = str(transaction.get("group_id") or "")
+            totals[group_id] = totals.get(group_id, 0) + transaction.get("amount", 0)
+        return totals
+
+    def archive_old_transactions(self, now: Optional[datetime] = None) -> int:
+        """Move transactions past the retention window into the compressed archive.
+
+        The hot store then only holds the last TRANSACTION_RETENTION_DAYS
+        days (never less than TRANSACTION_TIMEOUT_HOURS). Rollups, the
+        fingerprint index and the columnar snapshot keep counting archived
+        transactions, so totals and duplicate detection are unchanged.
+        Returns the number of transactions archived.
+        """
+        if TRANSACTION_RETENTION_DAYS <= 0:
+            return 0
+
+        now = now or datetime.now()
+        age = max(
+            timedelta(days=TRANSACTION_RETENTION_DAYS), timedelta(hours=TRANSACTION_TIMEOUT_HOURS)
+        )
+        cutoff = (now - age).strftime("%Y-%m-%d")
+
+        with self._lock:
+            self.flush()
+            with self.backend.lock():
+                columns_current = self._columns_in_use() and self._sync_columns()
+
+                old_records = []
+                hot_records = []
+                for record in self.backend.iter_records():
+                    date = record.get("date")
+                    (old_records if date and date < cutoff else hot_records).append(record)
+                if not old_records:
+                    return 0
+
+                # Archive first: a crash in between leaves copies, never a loss;
+                # the next run skips the copies and finishes removing them here
+                self.archive.append_records(old_records)
+                self.backend.rewrite_records(hot_records)
+
+                if columns_current:
+                    # Archived rows stay in the snapshot; only the hot store moved
+                    self.columns.signature = self.backend.signature()
+                if self.cache is not None:
+                    self.cache.clear()
+
+            if columns_current:
+                self.save_snapshot()
+            logger.info(f"Archived {len(old_records)} transactions dated before {cutoff}")
+            return len(old_records)